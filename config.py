@@ -86,12 +86,141 @@ SYNC_CONFIG = {
     "retry_count": 3,
     "retry_delay": 5,
     "batch_size": 10,
-    "timeout": 30
+    "timeout": 30,
+    "checkpoint_max_age": 86400,  # Checkpoint cũ hơn N giây sẽ bị bỏ, đồng bộ lại từ đầu
+    "clone_queue_size": 32,       # Số user đọc trước tối đa khi sao chép máy sang máy
+    "priority_push": True,        # Đẩy ngay nhân viên vừa quét vân tay lên các thiết bị được phân công
+    "priority_delay": 2           # Chờ N giây sau lần quét cuối để gộp các ngón quét liên tiếp
+}
+
+# Cấu hình lập kế hoạch đồng bộ theo dung lượng thiết bị
+SYNC_PLANNER_CONFIG = {
+    "overflow_policy": "trim",  # trim: bỏ bớt nhân viên mới khi hết chỗ | reject: không đồng bộ
+    "reserve_users": 0,         # Chừa lại N slot user trên thiết bị
+    "reserve_fingers": 0,       # Chừa lại N slot vân tay trên thiết bị
+    "command_latency": 0.05,    # Thời gian ước tính mỗi lệnh (giây)
+    "bytes_per_second": 100000  # Tốc độ truyền ước tính
+}
+
+# Cấu hình pool kết nối máy chấm công
+DEVICE_POOL_CONFIG = {
+    "idle_timeout": 300,  # Đóng kết nối không dùng quá N giây
+    "ping_interval": 30   # Ping kiểm tra kết nối nếu rảnh quá N giây
+}
+
+# Cấu hình cache thông tin máy chấm công
+DEVICE_CACHE_CONFIG = {
+    "metadata_ttl": 86400  # Đọc lại serial, firmware, fp version sau N giây
+}
+
+# Cấu hình giám sát kết nối máy chấm công
+MONITOR_CONFIG = {
+    "probe_timeout": 1,       # Timeout mỗi lần kiểm tra cổng TCP (giây)
+    "default_interval": 300,  # Chu kỳ kiểm tra nếu thiết bị không có sync_interval
+    "refresh_interval": 10,   # Chu kỳ cập nhật danh sách thiết bị cần giám sát
+    "history_size": 50        # Số lần kiểm tra gần nhất được giữ lại
+}
+
+# Cấu hình lịch đồng bộ tự động đến máy chấm công
+SCHEDULER_CONFIG = {
+    # Tắt mặc định: lần chạy đầu ghi lại (xóa rồi tạo lại) mọi nhân viên trên mọi thiết bị
+    "enabled": False,
+    "tick": 5,                # Chu kỳ kiểm tra lịch (giây)
+    "default_interval": 300,  # Dùng khi thiết bị không có sync_interval
+    "jitter": 0.1,            # Dao động ngẫu nhiên ±10% chu kỳ
+    "max_backoff": 3600       # Thời gian chờ tối đa khi thiết bị lỗi liên tiếp
+}
+
+# Cấu hình kéo log chấm công lên ERPNext (Employee Checkin)
+ATTENDANCE_PULL_CONFIG = {
+    "batch_size": 100,         # Số Employee Checkin gửi trong một request
+    "map_punch_type": False,   # True: punch 0/1 của thiết bị -> log_type IN/OUT
+    "dedup_retention_days": 62 # Giữ chỉ mục chống trùng lượt chấm công trong N ngày
+}
+
+# Cấu hình nhận chấm công realtime (live capture)
+LIVE_CAPTURE_CONFIG = {
+    "enabled": False,
+    "capture_timeout": 5,         # Timeout chờ sự kiện trên socket (giây)
+    # Thoát live capture định kỳ để kiểm tra kết nối và bù log. Mỗi lần vào lại,
+    # pyzk tải toàn bộ bảng user của thiết bị nên không đặt quá ngắn
+    "keepalive_interval": 1800,
+    "backfill_retry": 60,         # Lô realtime đẩy lỗi: thoát live capture sau tối thiểu N giây để bù từ log
+    "flush_interval": 2,          # Gom lượt chấm công tối đa N giây trước khi đẩy lên ERPNext
+    "reconnect_delay": 5,
+    "max_reconnect_delay": 300,
+    "employee_map_refresh": 600,  # Làm mới bảng tra attendance_device_id -> nhân viên
+    "refresh_interval": 30        # Chu kỳ cập nhật danh sách thiết bị
+}
+
+# Cấu hình tải vân tay từ máy chấm công về local
+# (vân tay tải về được ghi từng user vào file tạm DATA_PATHS["pull_staging"] rồi mới merge)
+FINGERPRINT_PULL_CONFIG = {
+    "max_workers": 8,                # Số thiết bị tải song song
+    "merge_rule": "most_fingers",    # most_fingers | newest: cách chọn khi nhiều thiết bị cùng có nhân viên
+    "save_machine_snapshot": False,  # Lưu thêm bản tải về vào all_fingerprints_from_machine.json
+    "pipeline_window": 20            # Số lệnh lấy template gửi liên tiếp không chờ phản hồi (cách tải từng user)
+}
+
+# Cấu hình tự chọn giao thức TCP/UDP theo tốc độ đo được
+# (thiết bị có "transport": "tcp"/"udp" trong cấu hình thì không đo)
+TRANSPORT_TUNING_CONFIG = {
+    "enabled": True,
+    "recheck_interval": 604800,  # Đo lại sau N giây (mặc định 7 ngày)
+    "sample_bytes": 524288,      # Số byte đọc thử mỗi giao thức
+    "min_gain": 0.1              # Chỉ đổi giao thức khi nhanh hơn ít nhất 10%
+}
+
+# Cấu hình tạo file nạp dữ liệu qua USB cho máy chấm công
+USB_PROVISIONING_CONFIG = {
+    "user_file": "user.dat",         # Bảng user (bản ghi 72 byte)
+    "template_file": "template.fp10",  # Template vân tay thuật toán 10.0
+    "first_uid": 1,                  # uid đầu tiên cấp cho user trong file
+    "max_template_size": 2048,       # Template dài hơn bị coi là lỗi
+    "encoding": "UTF-8"              # Mã hóa tên như pyzk khi ghi user
+}
+
+# Cấu hình sao lưu/khôi phục máy chấm công
+BACKUP_CONFIG = {
+    "backup_before_clear": True,  # Sao lưu trước khi xóa toàn bộ dữ liệu thiết bị
+    "restore_batch_users": 100,   # Số user gửi trong một lệnh lưu khi khôi phục
+    "compress_level": 6,          # Mức nén gzip (1-9)
+    "keep": 10                    # Số bản sao lưu giữ lại cho mỗi thiết bị (0: giữ tất cả)
+}
+
+# Cấu hình kiểm tra sai lệch dữ liệu giữa các máy chấm công
+DRIFT_AUDIT_CONFIG = {
+    "max_workers": 8  # Số thiết bị kiểm tra song song
+}
+
+# Cấu hình ghi xuyên khi đăng ký vân tay: quét -> file local -> ERPNext -> máy chấm công
+ENROLLMENT_PIPELINE_CONFIG = {
+    "write_through": False,  # Bật: mỗi lần quét thành công được lưu và đẩy ngay, không cần bấm lưu/đồng bộ
+    "workers": 2,            # Số luồng xử lý lưu local/ERPNext
+    "upload_erpnext": True   # Cập nhật vân tay của nhân viên lên ERPNext
+}
+
+# Cấu hình dọn nhân viên đã nghỉ khỏi máy chấm công
+INACTIVE_PRUNE_CONFIG = {
+    "max_workers": 8,        # Số thiết bị xử lý song song
+    "protect_admins": True,  # Không xóa user có quyền quản trị trên thiết bị
+    "keep_user_ids": [],     # attendance_device_id luôn giữ lại (tài khoản thử, khách...)
+    "max_ratio": 0.5         # Dừng nếu số user cần xóa vượt tỷ lệ này (danh sách nhân viên có thể chưa cập nhật)
 }
 
 # Đường dẫn file dữ liệu
 DATA_PATHS = {
     "fingerprints": "data/all_fingerprints.json",
     "devices": "data/attendance_devices.json",
+    "device_metadata": "data/device_metadata.json",
+    "sync_state": "data/sync_scheduler_state.json",
+    "checkpoints": "data/checkpoints/",
+    "attendance_cursors": "data/attendance_cursors.json",
+    "punch_index": "data/punch_index.sqlite3",
+    "transport_profiles": "data/transport_profiles.json",
+    "backups": "data/backups/",
+    "drift_report": "data/drift_report.json",
+    "device_shadows": "data/device_shadows.json",
+    "pull_staging": "data/pull_staging/",
     "logs": "logs/"
 }
\ No newline at end of file
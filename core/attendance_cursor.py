@@ -0,0 +1,95 @@
+# attendance_cursor.py
+"""
+Module lưu con trỏ đọc log chấm công của từng máy chấm công.
+Ghi nhớ thời điểm chấm công cuối cùng đã đẩy lên ERPNext và số bản ghi
+trên thiết bị để lần kéo sau chỉ xử lý các lượt chấm công mới.
+"""
+
+import json
+import os
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Any
+from config import DATA_PATHS
+
+logger = logging.getLogger(__name__)
+
+
+class AttendanceCursorStore:
+    """Con trỏ log chấm công theo thiết bị (ưu tiên theo serial)"""
+
+    def __init__(self, cursor_path: Optional[str] = None):
+        self.cursor_path = cursor_path or DATA_PATHS["attendance_cursors"]
+        self._lock = threading.Lock()
+        self._cursors = self._load()
+
+    @staticmethod
+    def make_key(device_config: Dict, serial: Optional[str] = None) -> str:
+        """Tạo key con trỏ: serial nếu biết, nếu không thì IP:port"""
+        if serial:
+            return str(serial)
+        device_ip = device_config.get('ip', device_config.get('ip_address', ''))
+        device_port = device_config.get('port', 4370)
+        return f"{device_ip}:{device_port}"
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """Tải con trỏ từ file local"""
+        try:
+            if os.path.exists(self.cursor_path):
+                with open(self.cursor_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Không thể tải con trỏ log chấm công: {str(e)}")
+        return {}
+
+    def _save(self):
+        """Lưu con trỏ xuống file local"""
+        try:
+            os.makedirs(os.path.dirname(self.cursor_path) or ".", exist_ok=True)
+            with open(self.cursor_path, 'w', encoding='utf-8') as f:
+                json.dump(self._cursors, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            logger.error(f"❌ Lỗi lưu con trỏ log chấm công: {str(e)}")
+
+    def get(self, key: str) -> Dict[str, Any]:
+        """
+        Lấy con trỏ của thiết bị
+
+        Returns:
+            Dict gồm last_timestamp (ISO), boundary_users (user_id đã đẩy tại
+            last_timestamp), records (số bản ghi lần đọc trước); rỗng nếu chưa có
+        """
+        with self._lock:
+            return dict(self._cursors.get(key, {}))
+
+    def advance(self, key: str, last_timestamp: str, boundary_users: List[str]):
+        """
+        Dời con trỏ tới lượt chấm công mới nhất đã đẩy thành công
+        (không bao giờ lùi; cùng giây thì gộp danh sách user)
+        """
+        with self._lock:
+            cursor = self._cursors.setdefault(key, {})
+            current = cursor.get('last_timestamp')
+            if current and last_timestamp < current:
+                return
+            if current == last_timestamp:
+                boundary_users = list(boundary_users) + cursor.get('boundary_users', [])
+            cursor['last_timestamp'] = last_timestamp
+            cursor['boundary_users'] = sorted(set(boundary_users))
+            cursor['updated_at'] = time.time()
+            self._save()
+
+    def set_record_count(self, key: str, records: int):
+        """Ghi nhận số bản ghi trên thiết bị sau khi đã xử lý hết log"""
+        with self._lock:
+            cursor = self._cursors.setdefault(key, {})
+            cursor['records'] = records
+            cursor['updated_at'] = time.time()
+            self._save()
+
+    def reset(self, key: str):
+        """Xóa con trỏ (lần kéo sau đọc lại toàn bộ log)"""
+        with self._lock:
+            if self._cursors.pop(key, None) is not None:
+                self._save()
@@ -4,15 +4,33 @@ Module đồng bộ dữ liệu vân tay đến máy chấm công ZKTeco
 """
 
 import logging
-from typing import List, Dict, Optional, Tuple
+from typing import Any, List, Dict, Optional, Tuple, Callable
 from datetime import datetime
 import base64
 import socket
+import threading
 import time
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 from zk import ZK, const
-from zk.base import Finger
-from config import ATTENDANCE_DEVICES, FINGERPRINT_CONFIG
+from zk.base import Finger, User
+from config import ATTENDANCE_DEVICES, FINGERPRINT_CONFIG, SYNC_CONFIG, ATTENDANCE_PULL_CONFIG, BACKUP_CONFIG
 from core.erpnext_api import ERPNextAPI
+from core.device_pool import DeviceConnectionPool
+from core.device_metadata import DeviceMetadataCache
+from core.sync_checkpoint import SyncCheckpointJournal
+from core.data_manager import DataManager, employee_fingerprint_digest
+from core.attendance_cursor import AttendanceCursorStore
+from core.punch_index import PunchDedupIndex
+from core.device_assignment import DeviceAssignment
+from core.sync_planner import SyncPlanner
+from core.progress import progress_bus
+from core.transport_tuner import TransportTuner
+from core.template_stream import iter_user_templates
+from core.device_backup import DeviceBackup
+from core.device_shadow import DeviceShadowStore, user_entry, employee_fingers
+from core.priority_sync import PrioritySyncQueue, PRIORITY_ENROLLMENT
+from core.sync_scheduler import forget_synced_state
 
 logger = logging.getLogger(__name__)
 
@@ -23,27 +41,65 @@ class AttendanceDeviceSync:
     def __init__(self, erpnext_api: ERPNextAPI):
         self.erpnext_api = erpnext_api
         self.connected_devices = {}
+        self.pool = DeviceConnectionPool()
+        self.metadata_cache = DeviceMetadataCache()
+        self.attendance_cursors = AttendanceCursorStore()
+        self.punch_index = PunchDedupIndex()
+        self.assignment = DeviceAssignment(DataManager().load_employees_from_local)
+        self.planner = SyncPlanner(self)
+        self.transport_tuner = TransportTuner(self)
+        self.backups = DeviceBackup()
+        self.shadow = DeviceShadowStore()
+        self.priority_queue = PrioritySyncQueue()
+        self.sync_scheduler = None  # SyncScheduler tự gắn vào khi được tạo
+        # device_id -> mã nhân viên bị cắt/từ chối do hết dung lượng ở lần đồng bộ gần nhất
+        self.capacity_skipped: Dict[Any, List[str]] = {}
         
     def connect_device(self, device_config: Dict) -> Optional[ZK]:
         """
-        Kết nối với một máy chấm công
+        Kết nối với một máy chấm công (lấy từ pool nếu đã có kết nối sẵn)
         
         Args:
             device_config: Thông tin cấu hình thiết bị
             
         Returns:
-            ZK object nếu kết nối thành công, None nếu thất bại
+            ZK object nếu kết nối thành công, None nếu thất bại.
+            Phải gọi disconnect_device() để trả kết nối về pool.
         """
+        device_id = device_config.get('id', 1)
         try:
+            conn = self.pool.acquire(device_id, lambda: self._open_connection(device_config))
+        except Exception as e:
+            logger.error(f"❌ Lỗi lấy kết nối thiết bị ID {device_id}: {str(e)}")
+            return None
+        
+        if conn:
+            self.connected_devices[device_id] = conn
+        return conn
+    
+    def _open_connection(self, device_config: Dict) -> Tuple[Optional[ZK], Dict]:
+        """
+        Mở kết nối mới đến máy chấm công và đọc thông tin thiết bị
+        
+        Args:
+            device_config: Thông tin cấu hình thiết bị
+            
+        Returns:
+            Tuple (ZK object hoặc None, thông tin thiết bị)
+        """
+        try:
+            # Dùng giao thức đã đo là nhanh hơn cho thiết bị này (nếu có)
+            device_config = self.transport_tuner.apply(device_config)
             device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
             device_ip = device_config.get('ip', device_config.get('ip_address', ''))
             device_port = device_config.get('port', 4370)
+            transport = 'UDP' if device_config.get('force_udp', True) else 'TCP'
             
-            logger.info(f"🔌 Đang kết nối với {device_name} ({device_ip}:{device_port})...")
+            logger.info(f"🔌 Đang kết nối với {device_name} ({device_ip}:{device_port}, {transport})...")
             
             if not device_ip:
                 logger.error(f"❌ Thiết bị {device_name} không có địa chỉ IP")
-                return None
+                return None, {}
             
             # Tạo instance ZK với thông tin từ config
             zk = ZK(
@@ -62,11 +118,11 @@ class AttendanceDeviceSync:
                 result = sock.connect_ex((device_ip, device_port))
                 if result != 0:
                     logger.error(f"❌ Không thể kết nối đến {device_ip}:{device_port} - Lỗi: {result}")
-                    return None
+                    return None, {}
                 sock.close()
             except Exception as e:
                 logger.error(f"❌ Lỗi kiểm tra kết nối mạng: {str(e)}")
-                return None
+                return None, {}
             
             # Kết nối với thiết bị
             try:
@@ -75,60 +131,179 @@ class AttendanceDeviceSync:
                     raise Exception("Failed to connect to device")
             except Exception as e:
                 logger.error(f"❌ Lỗi kết nối với thiết bị: {str(e)}")
-                return None
-            
-            # Tạm thời vô hiệu hóa thiết bị để tránh xung đột
-            try:
-                conn.disable_device()
-            except Exception as e:
-                logger.error(f"❌ Lỗi vô hiệu hóa thiết bị: {str(e)}")
-                return None
+                return None, {}
             
-            # Lấy thông tin thiết bị
+            # Lấy thông tin thiết bị (thông tin định danh lấy từ cache nếu còn hạn)
             try:
-                device_info = {
-                    'serial': conn.get_serialnumber(),
-                    'platform': conn.get_platform(),
-                    'device_name': conn.get_device_name(),
-                    'firmware': conn.get_firmware_version(),
-                    'users': len(conn.get_users()),
-                    'fingerprints': conn.get_fp_version()
-                }
+                device_info = self.metadata_cache.get(device_config)
+                refresh_identity = device_info is None
+                if refresh_identity:
+                    device_info = {
+                        'serial': conn.get_serialnumber(),
+                        'platform': conn.get_platform(),
+                        'device_name': conn.get_device_name(),
+                        'firmware': conn.get_firmware_version(),
+                        'fp_version': conn.get_fp_version()
+                    }
+                
+                # read_sizes chỉ trả về bộ đếm, không tải toàn bộ danh sách user
+                conn.read_sizes()
+                device_info.update({
+                    'users': conn.users,
+                    'fingers': conn.fingers,
+                    'records': conn.records,
+                    'users_cap': conn.users_cap,
+                    'fingers_cap': conn.fingers_cap,
+                    'rec_cap': conn.rec_cap
+                })
+                self.metadata_cache.put(device_config, device_info, refresh_identity=refresh_identity)
                 
                 logger.info(f"✅ Kết nối thành công với {device_name}")
                 logger.info(f"   📱 Model: {device_info['device_name']}")
                 logger.info(f"   🔢 Serial: {device_info['serial']}")
-                logger.info(f"   👥 Số người dùng: {device_info['users']}")
+                logger.info(f"   👥 Số người dùng: {device_info['users']}/{device_info['users_cap']}")
+                logger.info(f"   👆 Số vân tay: {device_info['fingers']}/{device_info['fingers_cap']}")
                 
-                # Lưu connection
-                device_id = device_config.get('id', 1)
-                self.connected_devices[device_id] = conn
-                
-                return conn
+                return conn, device_info
             except Exception as e:
                 logger.error(f"❌ Lỗi lấy thông tin thiết bị: {str(e)}")
-                return None
+                try:
+                    conn.disconnect()
+                except Exception:
+                    pass
+                return None, {}
                 
         except Exception as e:
             logger.error(f"❌ Lỗi kết nối với {device_name}: {str(e)}")
-            return None
+            return None, {}
     
     def disconnect_device(self, device_id: int):
-        """Ngắt kết nối với thiết bị"""
+        """Trả kết nối thiết bị về pool (kết nối được giữ lại cho lần sau)"""
         if device_id in self.connected_devices:
             try:
-                self.connected_devices[device_id].enable_device()
-                self.connected_devices[device_id].disconnect()
                 del self.connected_devices[device_id]
-                logger.info(f"✅ Đã ngắt kết nối thiết bị ID: {device_id}")
+                self.pool.release(device_id)
+                logger.info(f"↩️ Đã trả kết nối thiết bị ID {device_id} về pool")
             except Exception as e:
                 logger.error(f"❌ Lỗi ngắt kết nối: {str(e)}")
     
     def disconnect_all_devices(self):
-        """Ngắt kết nối tất cả thiết bị"""
+        """Ngắt kết nối tất cả thiết bị (đóng toàn bộ pool)"""
         device_ids = list(self.connected_devices.keys())
         for device_id in device_ids:
             self.disconnect_device(device_id)
+        self.pool.close_all()
+    
+    def get_device_capabilities(self, device_config: Dict) -> Dict:
+        """
+        Lấy khả năng và số lượng hiện tại của thiết bị cho việc lập kế hoạch đồng bộ
+        
+        Args:
+            device_config: Thông tin cấu hình thiết bị
+            
+        Returns:
+            Dict gồm fp_version, users_cap, fingers_cap, rec_cap và
+            users/fingers/records nếu thiết bị đang có kết nối trong pool
+        """
+        capabilities = self.metadata_cache.get_capabilities(device_config)
+        live_info = self.pool.get_device_info(device_config.get('id', 1))
+        for field in ('fp_version', 'users_cap', 'fingers_cap', 'rec_cap', 'users', 'fingers', 'records'):
+            if live_info.get(field) is not None:
+                capabilities[field] = live_info[field]
+        return capabilities
+
+    def _is_connection_alive(self, zk: ZK) -> bool:
+        """Kiểm tra nhanh kết nối còn phản hồi không (lệnh get_time)"""
+        try:
+            zk.get_time()
+            return True
+        except Exception:
+            return False
+
+    def _reconnect_device(self, device_config: Dict) -> Optional[ZK]:
+        """
+        Kết nối lại thiết bị khi kết nối bị mất giữa chừng
+        
+        Returns:
+            ZK object mới hoặc None nếu hết số lần thử
+        """
+        device_id = device_config.get('id', 1)
+        retry_count = SYNC_CONFIG.get('retry_count', 3)
+        retry_delay = SYNC_CONFIG.get('retry_delay', 5)
+        for attempt in range(1, retry_count + 1):
+            logger.info(f"🔄 Kết nối lại thiết bị ID {device_id} (lần {attempt}/{retry_count})...")
+            time.sleep(retry_delay)
+            try:
+                conn = self.pool.reconnect(device_id, lambda: self._open_connection(device_config))
+            except Exception as e:
+                logger.error(f"❌ Lỗi kết nối lại thiết bị ID {device_id}: {str(e)}")
+                conn = None
+            if conn:
+                self.connected_devices[device_id] = conn
+                return conn
+        return None
+
+    def _sync_employee_resumable(self, device_config: Dict, zk: ZK, employee: Dict,
+                                 fingerprints: List[Dict], journal: SyncCheckpointJournal,
+                                 device_users: Dict[str, int]) -> Tuple[Optional[bool], Optional[ZK]]:
+        """
+        Đồng bộ một nhân viên có ghi checkpoint, tự kết nối lại nếu mất kết nối
+        
+        Args:
+            device_users: user_id -> uid trên thiết bị của lô (đọc lại sau khi kết nối lại)
+        
+        Returns:
+            Tuple (kết quả, ZK đang dùng):
+            True/False là thành công/thất bại do dữ liệu,
+            None nếu mất kết nối và không kết nối lại được
+        """
+        digest = employee_fingerprint_digest(employee)
+        if journal.is_confirmed(employee['employee'], digest):
+            logger.info(f"   ⏭️ Đã xác nhận ở lần chạy trước, bỏ qua")
+            self._shadow_employee(device_config, employee, fingerprints)
+            return True, zk
+
+        uid = self._write_employee_to_device(zk, employee, fingerprints, device_users)
+        if uid is not None:
+            journal.confirm(employee['employee'], digest)
+            self._shadow_employee(device_config, employee, fingerprints, uid)
+            return True, zk
+
+        if self._is_connection_alive(zk):
+            return False, zk
+
+        logger.warning(f"   ⚠️ Mất kết nối với thiết bị ID {device_config.get('id', 1)}")
+        zk = self._reconnect_device(device_config)
+        if not zk:
+            return None, None
+        # Lần ghi dở có thể đã xóa user: đọc lại danh sách user của thiết bị
+        try:
+            device_users.clear()
+            device_users.update(self._device_user_ids(zk))
+        except Exception as e:
+            logger.error(f"❌ Lỗi đọc users sau khi kết nối lại: {str(e)}")
+            return None, None
+        uid = self._write_employee_to_device(zk, employee, fingerprints, device_users)
+        if uid is not None:
+            journal.confirm(employee['employee'], digest)
+            self._shadow_employee(device_config, employee, fingerprints, uid)
+            return True, zk
+        return False, zk
+
+    def _shadow_serial(self, device_config: Dict) -> Optional[str]:
+        """Serial dùng làm key shadow: lấy từ kết nối hiện tại, nếu không có thì từ cache"""
+        return self.pool.get_device_info(device_config.get('id', 1)).get('serial') or \
+            self.metadata_cache.get_serial(device_config)
+
+    def _shadow_employee(self, device_config: Dict, employee: Dict, fingerprints: List[Dict],
+                         uid: Optional[int] = None, source: str = 'sync'):
+        """Ghi nhận vào shadow nhân viên vừa được ghi lên thiết bị (uid None: giữ uid đã biết)"""
+        name = self.shorted_name(employee.get('employee_name') or '', 24)
+        entry = user_entry(uid, name.encode('utf-8')[:24].decode('utf-8', errors='ignore').strip(),
+                           const.USER_ADMIN if employee.get('employee_name') == 'USER_ADMIN' else const.USER_DEFAULT,
+                           employee_fingers({'employee': employee.get('employee'), 'fingerprints': fingerprints}))
+        self.shadow.update_users(self._shadow_serial(device_config), device_config, source,
+                                 {str(employee['attendance_device_id']): entry})
 
     def sync_employee_to_device(self, zk: ZK, employee_data: Dict, 
                                fingerprints: List[Dict]) -> bool:
@@ -143,54 +318,72 @@ class AttendanceDeviceSync:
         Returns:
             True nếu đồng bộ thành công
         """
+        return self._write_employee_to_device(zk, employee_data, fingerprints) is not None
+    
+    @staticmethod
+    def _device_user_ids(zk: ZK) -> Dict[str, int]:
+        """user_id -> uid của các user trên thiết bị (đọc một lần cho cả lô)"""
+        return {str(user.user_id): user.uid for user in zk.get_users()}
+    
+    def _write_employee_to_device(self, zk: ZK, employee_data: Dict, fingerprints: List[Dict],
+                                  device_users: Optional[Dict[str, int]] = None) -> Optional[int]:
+        """
+        Ghi user và vân tay của một nhân viên lên thiết bị
+        
+        Args:
+            device_users: user_id -> uid trên thiết bị, dùng chung cho cả lô và được cập nhật
+                sau mỗi lần ghi (None: đọc từ thiết bị)
+        
+        Returns:
+            uid của user trên thiết bị, None nếu thất bại
+        """
         try:
             # Kiểm tra dữ liệu đầu vào
             if not employee_data:
                 logger.error("❌ Không có dữ liệu nhân viên")
-                return False
+                return None
                 
             if not fingerprints:
                 logger.warning(f"⚠️ Nhân viên {employee_data.get('employee', 'Unknown')} không có dữ liệu vân tay")
-                return False
+                return None
             
             # Lấy attendance_device_id
             user_id = employee_data.get('attendance_device_id')
             if not user_id:
                 logger.error(f"❌ Nhân viên {employee_data.get('employee', 'Unknown')} chưa có attendance_device_id")
-                return False
+                return None
             
             # # Chuyển đổi user_id sang số
             # try:
             #     user_id = int(user_id)
             # except ValueError:
             #     logger.error(f"❌ attendance_device_id không hợp lệ: {user_id}")
-            #     return False
+            #     return None
             
             logger.info(f"👤 Đang xử lý nhân viên: {employee_data['employee']} - {employee_data['employee_name']} (ID: {user_id})")
             
-            # Kiểm tra xem user đã tồn tại chưa
-            existing_users = zk.get_users()
-            user_exists = any(u.user_id == user_id for u in existing_users) 
-            if user_exists:
+            if device_users is None:
+                device_users = self._device_user_ids(zk)
+            
+            # Kiểm tra xem user đã tồn tại chưa (giữ lại uid cũ khi tạo lại)
+            uid_int = device_users.get(str(user_id))
+            if uid_int is not None:
                 logger.info(f"🗑️ User {user_id} đã tồn tại. Đang xóa user cũ...")
-                zk.delete_user(user_id=user_id)
+                zk.delete_user(uid=uid_int)
+                device_users.pop(str(user_id), None)
                 logger.info(f"✅ Đã xóa user {user_id}.")
                 time.sleep(0.5)  # Cho thiết bị một chút thời gian
+            else:
+                uid_int = max(device_users.values(), default=0) + 1
             
             # Tạo user mới
             logger.info(f"➕ Tạo mới user {user_id}...") 
             full_name = employee_data['employee_name']
             shortened_name = self.shorted_name(full_name,24)  
             privilege= const.USER_ADMIN if employee_data['employee_name']=='USER_ADMIN' else const.USER_DEFAULT
-            zk.set_user(user_id=user_id, name=shortened_name, privilege=privilege, password= employee_data['password']) 
-            
-            # Lấy lại thông tin user sau khi tạo
-            users = zk.get_users()
-            user = next((u for u in users if u.user_id == user_id), None)
-            if not user:
-                logger.error(f"❌ Không thể tạo hoặc tìm thấy user {user_id} sau khi tạo.")
-                return False
-            uid_int = user.uid
+            zk.set_user(uid=uid_int, user_id=user_id, name=shortened_name, privilege=privilege, password= employee_data['password']) 
+            device_users[str(user_id)] = uid_int
+            user = User(uid_int, shortened_name, privilege, employee_data['password'], '', user_id)
             # Chuẩn bị danh sách template để gửi
             templates_to_send = []
             success_count = 0
@@ -240,15 +433,31 @@ class AttendanceDeviceSync:
                 except Exception as e:
                     logger.error(f"❌ Lỗi ghi log đồng bộ: {str(e)}")
                 
-                return True
+                return uid_int
                 
             except Exception as e:
                 logger.error(f"❌ Lỗi khi gửi template: {str(e)}")
-                return False
+                return None
                 
         except Exception as e:
             logger.error(f"❌ Lỗi đồng bộ nhân viên {employee_data.get('employee', 'Unknown')}: {str(e)}")
-            return False
+            return None
+    
+    def _plan_capacity(self, device_config: Dict, zk: ZK, employees: List[Dict]) -> List[Dict]:
+        """
+        Lập kế hoạch theo dung lượng thiết bị, trả về nhân viên sẽ đồng bộ. Nhân viên bị cắt
+        (hoặc cả danh sách khi kế hoạch bị từ chối) được ghi vào capacity_skipped để báo cáo
+        riêng, không tính là đồng bộ lỗi
+        """
+        plan = self.planner.plan(device_config, zk, employees)
+        skipped = plan['skipped'] if plan['ok'] else employees
+        self.capacity_skipped[device_config.get('id', 1)] = [emp['employee'] for emp in skipped]
+        return plan['employees']
+    
+    def capacity_note(self, device_config: Dict) -> str:
+        """Ghi chú số nhân viên bỏ qua do hết dung lượng ở lần đồng bộ gần nhất (rỗng nếu không có)"""
+        skipped = self.capacity_skipped.get(device_config.get('id', 1))
+        return f", {len(skipped)} nhân viên bỏ qua do hết dung lượng" if skipped else ""
     
     def sync_to_device(self, device_config: dict, employees: List[dict]) -> Tuple[int, int]:
         """
@@ -259,10 +468,14 @@ class AttendanceDeviceSync:
             employees: Danh sách nhân viên cần đồng bộ
             
         Returns:
-            Tuple[int, int]: (số nhân viên đồng bộ thành công, tổng số nhân viên)
+            Tuple[int, int]: (số nhân viên đồng bộ thành công, tổng số nhân viên theo kế hoạch).
+            Nhân viên vượt dung lượng không tính vào tổng, xem capacity_skipped
         """
         device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
         device_ip = device_config.get('ip', device_config.get('ip_address', ''))
+        # Nhân viên được đẩy ưu tiên sau thời điểm này có dữ liệu mới hơn danh sách của lô
+        started_at = time.time()
+        self.capacity_skipped.pop(device_config.get('id', 1), None)
         
         logger.info(f"🎯 Đồng bộ đến: {device_name}")
         logger.info("=" * 60)
@@ -276,6 +489,9 @@ class AttendanceDeviceSync:
             return 0, 0
             
         try:
+            # Chỉ đồng bộ nhân viên được phân về thiết bị
+            employees = self.assignment.filter_employees(device_config, employees)
+            
             # Lọc nhân viên có vân tay và attendance_device_id hợp lệ
             valid_employees = []
             for emp in employees:
@@ -311,44 +527,91 @@ class AttendanceDeviceSync:
                 logger.warning(f"⚠️ Không có nhân viên nào hợp lệ để đồng bộ đến {device_name}")
                 return 0, 0
                 
+            # Kiểm tra dung lượng thiết bị trước khi ghi
+            valid_employees = self._plan_capacity(device_config, zk, valid_employees)
+            if not valid_employees:
+                return 0, 0
+            
             # Đồng bộ từng nhân viên
             success_count = 0
             total_count = len(valid_employees)
             
-            for emp in valid_employees:
-                try:
-                    if self.sync_employee_to_device(zk, emp, emp['fingerprints']):
-                        success_count += 1
-                        logger.info(f"✅ Đã đồng bộ thành công nhân viên {emp['employee']} - {emp['employee_name']}")
-                    else:
-                        logger.error(f"❌ Không thể đồng bộ nhân viên {emp['employee']}")
+            journal = SyncCheckpointJournal(device_config)
+            
+            # Vô hiệu hóa thiết bị chỉ trong lúc ghi dữ liệu
+            with progress_bus.job(f"Đồng bộ {device_name}", len(valid_employees)) as job, \
+                    self.pool.write_batch(device_config.get('id', 1)):
+                device_users = self._device_user_ids(zk)
+                for emp in valid_employees:
+                    try:
+                        # Nhân viên ưu tiên (vừa đăng ký) được đẩy trước nhân viên kế tiếp của lô
+                        zk = self._sync_priority(device_config, zk, journal, device_users)
+                        if zk is None:
+                            logger.error(f"❌ Mất kết nối với {device_name}, lần chạy sau sẽ tiếp tục từ checkpoint")
+                            job.error("Mất kết nối", item=False)
+                            break
+                        if self.priority_queue.is_pushed(device_config.get('id', 1), emp, started_at):
+                            logger.info(f"⏭️ {emp['employee']} vừa được đẩy ưu tiên (bản mới hơn), bỏ qua")
+                            success_count += 1
+                            job.item_done(emp['employee'])
+                            continue
+                        result, zk = self._sync_employee_resumable(device_config, zk, emp, emp['fingerprints'], journal,
+                                                                   device_users)
+                        if result is None:
+                            logger.error(f"❌ Mất kết nối với {device_name}, lần chạy sau sẽ tiếp tục từ checkpoint")
+                            job.error("Mất kết nối", item=False)
+                            break
+                        if result:
+                            success_count += 1
+                            logger.info(f"✅ Đã đồng bộ thành công nhân viên {emp['employee']} - {emp['employee_name']}")
+                            job.item_done(emp['employee'], self.planner.template_bytes(emp))
+                        else:
+                            logger.error(f"❌ Không thể đồng bộ nhân viên {emp['employee']}")
+                            job.error(emp['employee'])
                         
-                except Exception as e:
-                    logger.error(f"❌ Lỗi khi đồng bộ nhân viên {emp['employee']}: {str(e)}")
-                    continue
+                    except Exception as e:
+                        logger.error(f"❌ Lỗi khi đồng bộ nhân viên {emp['employee']}: {str(e)}")
+                        job.error(emp['employee'])
+                        continue
+                else:
+                    self._prune_unassigned_users(device_config, zk)
+            
+            if success_count == total_count:
+                journal.clear()
             
             return success_count, total_count
             
         except Exception as e:
             logger.error(f"❌ Lỗi khi đồng bộ đến {device_name}: {str(e)}")
+            self.pool.invalidate(device_config.get('id', 1))
             return 0, 0
             
         finally:
             # Ngắt kết nối thiết bị
             device_id = device_config.get('id', 1)
             self.disconnect_device(device_id)
+            self.shadow.flush()
     
-    def sync_all_to_device(self, device_config: Dict, employees_to_sync: List[Dict]) -> Tuple[int, int]:
+    def sync_all_to_device(self, device_config: Dict, employees_to_sync: List[Dict],
+                           on_employee_synced: Optional[Callable[[Dict], None]] = None) -> Tuple[int, int]:
         """
         Đồng bộ danh sách nhân viên cụ thể đến một thiết bị
         
         Args:
             device_config: Thông tin cấu hình thiết bị
             employees_to_sync: Danh sách nhân viên cần đồng bộ (đã có vân tay trong current_fingerprints)
+            on_employee_synced: Callback gọi sau mỗi nhân viên đồng bộ thành công
             
         Returns:
-            Tuple (số nhân viên thành công, tổng số nhân viên)
+            Tuple (số nhân viên thành công, tổng số nhân viên theo kế hoạch).
+            Nhân viên vượt dung lượng không tính vào tổng, xem capacity_skipped
         """
+        # Nhân viên được đẩy ưu tiên sau thời điểm này có dữ liệu mới hơn danh sách của lô
+        started_at = time.time()
+        self.capacity_skipped.pop(device_config.get('id', 1), None)
+        # Chỉ đồng bộ nhân viên được phân về thiết bị
+        employees_to_sync = self.assignment.filter_employees(device_config, employees_to_sync)
+        
         success_count = 0
         total_count = len(employees_to_sync)
         
@@ -361,43 +624,85 @@ class AttendanceDeviceSync:
             device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
             logger.info(f"📊 Bắt đầu đồng bộ {total_count} nhân viên đến {device_name}")
             
-            # Đồng bộ từng nhân viên
-            for i, employee in enumerate(employees_to_sync, 1):
-                logger.info(f"\n[{i}/{total_count}] Đang xử lý {employee['employee']} - {employee['employee_name']}")
+            # Kiểm tra dung lượng thiết bị trước khi ghi
+            employees_to_sync = self._plan_capacity(device_config, zk, employees_to_sync)
+            total_count = len(employees_to_sync)
+            if not employees_to_sync:
+                return 0, 0
+            
+            journal = SyncCheckpointJournal(device_config)
+            
+            with progress_bus.job(f"Đồng bộ {device_name}", len(employees_to_sync)) as job, \
+                    self.pool.write_batch(device_config.get('id', 1)):
+                device_users = self._device_user_ids(zk)
+                # Đồng bộ từng nhân viên
+                for i, employee in enumerate(employees_to_sync, 1):
+                    logger.info(f"\n[{i}/{total_count}] Đang xử lý {employee['employee']} - {employee['employee_name']}")
                 
-                # Lấy dữ liệu vân tay từ employee object
-                fingerprints = employee.get('fingerprints', [])
+                    # Lấy dữ liệu vân tay từ employee object
+                    fingerprints = employee.get('fingerprints', [])
                 
-                # Kiểm tra dữ liệu vân tay
-                if not fingerprints:
-                    logger.warning(f"   ⚠️ Nhân viên không có dữ liệu vân tay để đồng bộ")
-                    continue
-                    
-                # Kiểm tra template data
-                valid_fingerprints = []
-                for fp in fingerprints:
-                    if not isinstance(fp, dict):
-                        logger.error(f"   ❌ Dữ liệu vân tay không hợp lệ: {type(fp)}")
+                    # Kiểm tra dữ liệu vân tay
+                    if not fingerprints:
+                        logger.warning(f"   ⚠️ Nhân viên không có dữ liệu vân tay để đồng bộ")
+                        job.error(employee['employee'])
                         continue
+                    
+                    # Kiểm tra template data
+                    valid_fingerprints = []
+                    for fp in fingerprints:
+                        if not isinstance(fp, dict):
+                            logger.error(f"   ❌ Dữ liệu vân tay không hợp lệ: {type(fp)}")
+                            continue
                         
-                    template_data = fp.get('template_data')
-                    if not template_data:
-                        logger.error(f"   ❌ Không có template data cho ngón {fp.get('finger_index', 'Unknown')}")
-                        continue
+                        template_data = fp.get('template_data')
+                        if not template_data:
+                            logger.error(f"   ❌ Không có template data cho ngón {fp.get('finger_index', 'Unknown')}")
+                            continue
                         
-                    valid_fingerprints.append(fp)
+                        valid_fingerprints.append(fp)
                 
-                if not valid_fingerprints:
-                    logger.warning(f"   ⚠️ Không có vân tay hợp lệ để đồng bộ")
-                    continue
+                    if not valid_fingerprints:
+                        logger.warning(f"   ⚠️ Không có vân tay hợp lệ để đồng bộ")
+                        job.error(employee['employee'])
+                        continue
+                    
+                    # Nhân viên ưu tiên (vừa đăng ký) được đẩy trước nhân viên kế tiếp của lô
+                    zk = self._sync_priority(device_config, zk, journal, device_users)
+                    if zk is None:
+                        logger.error(f"   ❌ Mất kết nối với {device_name}, lần chạy sau sẽ tiếp tục từ checkpoint")
+                        job.error("Mất kết nối", item=False)
+                        break
                     
-                # Đồng bộ
-                if self.sync_employee_to_device(zk, employee, valid_fingerprints):
-                    success_count += 1
-                    logger.info(f"   ✅ Đã đồng bộ thành công")
+                    if self.priority_queue.is_pushed(device_config.get('id', 1), employee, started_at):
+                        logger.info(f"   ⏭️ Vừa được đẩy ưu tiên (bản mới hơn), bỏ qua")
+                        success_count += 1
+                        job.item_done(employee['employee'])
+                        continue
+                    
+                    # Đồng bộ (bỏ qua nhân viên đã xác nhận ở lần chạy trước)
+                    result, zk = self._sync_employee_resumable(device_config, zk, employee, valid_fingerprints,
+                                                               journal, device_users)
+                    if result is None:
+                        logger.error(f"   ❌ Mất kết nối với {device_name}, lần chạy sau sẽ tiếp tục từ checkpoint")
+                        job.error("Mất kết nối", item=False)
+                        break
+                    if result:
+                        success_count += 1
+                        logger.info(f"   ✅ Đã đồng bộ thành công")
+                        job.item_done(employee['employee'], self.planner.template_bytes(employee))
+                        if on_employee_synced:
+                            on_employee_synced(employee)
+                    else:
+                        logger.error(f"   ❌ Đồng bộ thất bại")
+                        job.error(employee['employee'])
                 else:
-                    logger.error(f"   ❌ Đồng bộ thất bại")
+                    self._prune_unassigned_users(device_config, zk)
+            
+            if success_count == total_count:
+                journal.clear()
             
+            skipped_note = self.capacity_note(device_config)
             # Ghi log đồng bộ tổng
             try:
                 device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
@@ -406,20 +711,22 @@ class AttendanceDeviceSync:
                     device_name=device_name,
                     employee_count=success_count,
                     status="success" if success_count > 0 else "failed",
-                    message=f"Đồng bộ thành công {success_count}/{total_count} nhân viên"
+                    message=f"Đồng bộ thành công {success_count}/{total_count} nhân viên{skipped_note}"
                 )
             except Exception as e:
                 logger.error(f"❌ Lỗi ghi log đồng bộ: {str(e)}")
             
-            logger.info(f"\n✅ Hoàn thành đồng bộ: {success_count}/{total_count} nhân viên")
+            logger.info(f"\n✅ Hoàn thành đồng bộ: {success_count}/{total_count} nhân viên{skipped_note}")
             
         except Exception as e:
             logger.error(f"❌ Lỗi trong quá trình đồng bộ: {str(e)}")
+            self.pool.invalidate(device_config.get('id', 1))
             
         finally:
             # Ngắt kết nối
             device_id = device_config.get('id', 1)
             self.disconnect_device(device_id)
+            self.shadow.flush()
             
         return success_count, total_count
     
@@ -434,6 +741,7 @@ class AttendanceDeviceSync:
             Dict với key là tên thiết bị, value là (success_count, total_count)
         """
         results = {}
+        notes = {}
         
         logger.info(f"🔄 Bắt đầu đồng bộ đến {len(ATTENDANCE_DEVICES)} thiết bị")
         
@@ -445,6 +753,7 @@ class AttendanceDeviceSync:
             
             success, total = self.sync_all_to_device(device, employees_to_sync)
             results[device_name] = (success, total)
+            notes[device_name] = self.capacity_note(device)
         
         # Tổng kết
         logger.info(f"\n{'='*60}")
@@ -452,10 +761,532 @@ class AttendanceDeviceSync:
         logger.info(f"{'='*60}")
         
         for device_name, (success, total) in results.items():
-            logger.info(f"✅ {device_name}: {success}/{total} nhân viên")
+            logger.info(f"✅ {device_name}: {success}/{total} nhân viên{notes[device_name]}")
+        
+        return results
+    
+    def enqueue_priority(self, employee: Dict, devices: Optional[List[Dict]] = None,
+                         priority: int = PRIORITY_ENROLLMENT, delay: Optional[float] = None,
+                         on_synced: Optional[Callable[[Dict, Dict], None]] = None,
+                         on_failed: Optional[Callable[[Dict, Dict], None]] = None) -> List[Dict]:
+        """
+        Đưa nhân viên vào hàng đợi ưu tiên của các thiết bị được phân công và đẩy ngay:
+        thiết bị đang chạy lô đồng bộ sẽ đẩy nhân viên này trước nhân viên kế tiếp,
+        thiết bị rảnh được đẩy bằng một luồng riêng
+        
+        Args:
+            employee: Dữ liệu nhân viên kèm vân tay
+            devices: Danh sách thiết bị (mặc định ATTENDANCE_DEVICES)
+            priority: Mức ưu tiên (PRIORITY_ENROLLMENT, PRIORITY_CHANGED)
+            delay: Chờ N giây trước khi đẩy (mặc định SYNC_CONFIG priority_delay)
+            on_synced: Callback (device_config, employee) sau khi đẩy thành công lên một thiết bị
+            on_failed: Callback (device_config, employee) khi không đẩy được (chờ lô đồng bộ sau)
+            
+        Returns:
+            Danh sách thiết bị nhận nhân viên vào hàng đợi
+        """
+        if not employee.get('attendance_device_id') or \
+                not any(isinstance(fp, dict) and fp.get('template_data') for fp in employee.get('fingerprints', [])):
+            logger.warning(f"⚠️ {employee.get('employee')} chưa có ID máy chấm công hoặc vân tay, chưa đẩy ưu tiên")
+            return []
+        if delay is None:
+            delay = SYNC_CONFIG.get('priority_delay', 2)
+        # Bản sao: dữ liệu gốc có thể tiếp tục thay đổi khi quét thêm ngón
+        employee = dict(employee, fingerprints=[dict(fp) for fp in employee['fingerprints']
+                                                if isinstance(fp, dict) and fp.get('template_data')])
+        
+        queued = []
+        for device in (devices if devices is not None else ATTENDANCE_DEVICES):
+            if not device.get('enable', True) or not self.assignment.filter_employees(device, [employee]):
+                continue
+            
+            def on_done(emp: Dict, ok: bool, device=device):
+                callback = on_synced if ok else on_failed
+                if callback:
+                    callback(device, emp)
+            
+            if self.priority_queue.push(device.get('id', 1), employee, priority, delay, on_done):
+                threading.Thread(target=self.drain_priority, args=(device,), daemon=True).start()
+            queued.append(device)
+        if queued:
+            logger.info(f"⚡ Ưu tiên đẩy {employee['employee']} lên {len(queued)} thiết bị")
+        return queued
+    
+    def _sync_priority(self, device_config: Dict, zk: ZK, journal: SyncCheckpointJournal,
+                       device_users: Optional[Dict[str, int]] = None) -> Optional[ZK]:
+        """
+        Đẩy các nhân viên ưu tiên đã đến hạn của thiết bị bằng kết nối đang giữ
+        
+        Args:
+            device_users: user_id -> uid của lô đang chạy (None: đọc khi có nhân viên ưu tiên)
+        
+        Returns:
+            ZK đang dùng, None nếu mất kết nối (nhân viên chưa đẩy được trả lại hàng đợi)
+        """
+        device_id = device_config.get('id', 1)
+        while True:
+            item = self.priority_queue.pop(device_id)
+            if item is None:
+                return zk
+            employee, on_done = item
+            logger.info(f"⚡ Đẩy ưu tiên {employee['employee']} - {employee.get('employee_name')}")
+            if device_users is None:
+                device_users = self._device_user_ids(zk)
+            result, zk = self._sync_employee_resumable(device_config, zk, employee, employee['fingerprints'],
+                                                       journal, device_users)
+            if result is None:
+                self.priority_queue.push(device_id, employee, PRIORITY_ENROLLMENT, 0, on_done)
+                return None
+            if result:
+                self.priority_queue.mark_pushed(device_id, employee)
+            else:
+                logger.error(f"❌ Không đẩy ưu tiên được {employee['employee']}, chờ lần đồng bộ sau")
+            if on_done:
+                on_done(employee, bool(result))
+    
+    def drain_priority(self, device_config: Dict):
+        """Luồng đẩy hàng đợi ưu tiên của một thiết bị cho đến khi hàng đợi trống"""
+        device_id = device_config.get('id', 1)
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_id}"))
+        
+        def drop(reason: str):
+            dropped = self.priority_queue.clear(device_id)
+            logger.warning(f"⚠️ {reason} {device_name}, {len(dropped)} nhân viên ưu tiên chờ lần đồng bộ sau")
+            for employee, on_done in dropped:
+                if on_done:
+                    on_done(employee, False)
+        
+        while True:
+            wait = self.priority_queue.wait_time(device_id)
+            if wait is None:
+                if self.priority_queue.finish_drain(device_id):
+                    return
+                continue
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            
+            # Chờ nếu thiết bị đang chạy lô đồng bộ (lô đó tự lấy hàng đợi ra trước)
+            zk = self.connect_device(device_config)
+            if not zk:
+                drop("Không kết nối được")
+                continue
+            try:
+                with self.pool.write_batch(device_id):
+                    if self._sync_priority(device_config, zk, SyncCheckpointJournal(device_config)) is None:
+                        drop("Mất kết nối với")
+            except Exception as e:
+                logger.error(f"❌ Lỗi đẩy ưu tiên đến {device_name}: {str(e)}")
+                self.pool.invalidate(device_id)
+                drop("Lỗi đẩy ưu tiên đến")
+            finally:
+                self.disconnect_device(device_id)
+                self.shadow.flush()
+    
+    def clone_device(self, source_config: Dict, target_configs: List[Dict],
+                     user_ids: Optional[List[str]] = None) -> Dict[str, Tuple[int, int]]:
+        """
+        Sao chép users và template vân tay từ một máy chấm công sang các máy khác.
+        Template được đọc theo luồng từ máy nguồn và ghi ngay sang các máy đích
+        (mỗi máy đích một luồng ghi), không qua JSON/base64 và không lưu file local.
+        Máy đích vẫn áp dụng quy tắc phân công và dung lượng còn trống.
+        
+        Args:
+            source_config: Cấu hình máy nguồn
+            target_configs: Danh sách cấu hình máy đích
+            user_ids: Chỉ sao chép các attendance_device_id này (mặc định tất cả)
+            
+        Returns:
+            Dict với key là tên máy đích, value là (số user thành công, tổng số user)
+        """
+        source_id = source_config.get('id', 1)
+        source_name = source_config.get('device_name', source_config.get('name', f"Device_{source_id}"))
+        targets = [t for t in target_configs if t.get('id', 1) != source_id]
+        if not targets:
+            logger.warning("⚠️ Không có máy đích để sao chép")
+            return {}
+        
+        zk = self.connect_device(source_config)
+        if not zk:
+            return {}
+        
+        results = {}
+        try:
+            wanted = {str(user_id) for user_id in user_ids} if user_ids else None
+            users = {user.uid: user for user in zk.get_users() if wanted is None or str(user.user_id) in wanted}
+            logger.info(f"📋 Sao chép {len(users)} users từ {source_name} sang {len(targets)} thiết bị")
+            
+            queues = [Queue(maxsize=SYNC_CONFIG.get('clone_queue_size', 32)) for _ in targets]
+            with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+                futures = [executor.submit(self._clone_writer, target, queue, list(users.values()), source_name)
+                           for target, queue in zip(targets, queues)]
+                try:
+                    # Đọc template theo luồng, mỗi user đưa ngay sang hàng đợi của các máy đích.
+                    # Bảng template không liền mạch thì một uid có thể xuất hiện lại: máy đích
+                    # ghi thêm các ngón của đoạn sau vào user đã ghi
+                    seen = set()
+                    for uid, fingers in iter_user_templates(zk, users.keys()):
+                        user = users.get(uid)
+                        if user is None:
+                            continue
+                        seen.add(uid)
+                        for queue in queues:
+                            queue.put((user, fingers))
+                    # Users không có vân tay trên máy nguồn
+                    for uid, user in users.items():
+                        if uid in seen:
+                            continue
+                        for queue in queues:
+                            queue.put((user, []))
+                except Exception as e:
+                    logger.error(f"❌ Lỗi đọc dữ liệu từ {source_name}: {str(e)}")
+                    self.pool.invalidate(source_id)
+                finally:
+                    for queue in queues:
+                        queue.put(None)
+                for target, future in zip(targets, futures):
+                    target_name = target.get('device_name', target.get('name', f"Device_{target.get('id', 1)}"))
+                    results[target_name] = future.result()
+        except Exception as e:
+            logger.error(f"❌ Lỗi sao chép từ {source_name}: {str(e)}")
+            self.pool.invalidate(source_id)
+        finally:
+            self.disconnect_device(source_id)
+        
+        for target_name, (success, total) in results.items():
+            logger.info(f"✅ {source_name} → {target_name}: {success}/{total} users")
+        return results
+    
+    def _clone_writer(self, device_config: Dict, queue: Queue, source_users: List[User],
+                      source_name: str) -> Tuple[int, int]:
+        """
+        Ghi các user nhận từ hàng đợi lên một máy đích cho đến khi gặp None.
+        Khi mất kết nối vẫn lấy hết hàng đợi để luồng đọc không bị chặn.
+        """
+        device_id = device_config.get('id', 1)
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_id}"))
+        targets = self.assignment.compile(device_config)
+        total = sum(1 for user in source_users if targets is None or str(user.user_id) in targets)
+        success_count = 0
+        
+        zk = self.connect_device(device_config)
+        if not zk:
+            while queue.get() is not None:
+                pass
+            return 0, total
+        
+        try:
+            serial = self._shadow_serial(device_config)
+            zk.read_sizes()
+            existing = {str(user.user_id): user.uid for user in zk.get_users()}
+            next_uid = max(existing.values(), default=0) + 1
+            free_users = zk.users_cap - zk.users - self.planner.reserve_users if zk.users_cap else None
+            free_fingers = zk.fingers_cap - zk.fingers - self.planner.reserve_fingers if zk.fingers_cap else None
+            failed = False
+            drained = False
+            # Shadow các user đã ghi trong lần sao chép này (gộp ngón khi user xuất hiện lại)
+            written: Dict[str, Dict] = {}
+            
+            with progress_bus.job(f"Sao chép {source_name} → {device_name}", total) as job, \
+                    self.pool.write_batch(device_id):
+                while True:
+                    item = queue.get()
+                    if item is None:
+                        drained = True
+                        break
+                    source_user, fingers = item
+                    user_id = str(source_user.user_id)
+                    if failed or (targets is not None and user_id not in targets):
+                        continue
+                    
+                    uid = existing.get(user_id)
+                    # Đoạn template sau của user vừa ghi: ghi thêm ngón, không xóa user
+                    appending = user_id in written
+                    if (uid is None and free_users is not None and free_users < 1) or \
+                            ((uid is None or appending) and free_fingers is not None and free_fingers < len(fingers)):
+                        logger.warning(f"   ⚠️ {device_name} hết dung lượng, bỏ qua user {user_id}")
+                        job.error(user_id)
+                        continue
+                    
+                    try:
+                        if uid is None:
+                            uid = next_uid
+                            next_uid += 1
+                        elif not appending:
+                            # Xóa user cũ để bỏ các ngón không còn trên máy nguồn
+                            zk.delete_user(uid=uid)
+                        user = User(uid, source_user.name, source_user.privilege, source_user.password,
+                                    source_user.group_id, user_id, source_user.card)
+                        zk.save_user_template(user, [Finger(uid, finger.fid, finger.valid, finger.template)
+                                                     for finger in fingers])
+                    except Exception as e:
+                        logger.error(f"   ❌ Lỗi ghi user {user_id} lên {device_name}: {str(e)}")
+                        job.error(user_id)
+                        if not self._is_connection_alive(zk):
+                            job.error("Mất kết nối", item=False)
+                            self.pool.invalidate(device_id)
+                            failed = True
+                        continue
+                    
+                    if appending:
+                        free_fingers = free_fingers - len(fingers) if free_fingers is not None else None
+                        job.add_bytes(sum(len(finger.template) for finger in fingers), user_id)
+                    else:
+                        if user_id not in existing:
+                            existing[user_id] = uid
+                            free_users = free_users - 1 if free_users is not None else None
+                            free_fingers = free_fingers - len(fingers) if free_fingers is not None else None
+                        success_count += 1
+                        job.item_done(user_id, sum(len(finger.template) for finger in fingers))
+                    entry = user_entry(uid, user.name, user.privilege,
+                                       {finger.fid: finger.template for finger in fingers}, user.card, user.group_id)
+                    if appending:
+                        entry['fingers'] = dict(written[user_id]['fingers'], **entry['fingers'])
+                    written[user_id] = entry
+                    self.shadow.update_users(serial, device_config, 'clone', {user_id: entry})
+        except Exception as e:
+            logger.error(f"❌ Lỗi sao chép sang {device_name}: {str(e)}")
+            self.pool.invalidate(device_id)
+            while not drained and queue.get() is not None:
+                pass
+        finally:
+            self.disconnect_device(device_id)
+            self.shadow.flush()
+        
+        return success_count, total
+    
+    def build_employee_map(self, employees: Optional[List[Dict]] = None) -> Dict[str, str]:
+        """
+        Tạo bảng tra attendance_device_id -> mã nhân viên ERPNext
+        
+        Args:
+            employees: Danh sách nhân viên (mặc định lấy từ ERPNext)
+            
+        Returns:
+            Dict {user_id trên thiết bị: employee}
+        """
+        if employees is None:
+            employees = self.erpnext_api.get_all_employees()
+        employee_map = {}
+        for emp in employees:
+            attendance_id = emp.get('attendance_device_id')
+            if attendance_id is None or str(attendance_id).strip() == "":
+                continue
+            employee_map[str(attendance_id).strip()] = emp.get('name') or emp.get('employee')
+        return employee_map
+
+    def _attendance_to_checkin(self, attendance, employee_map: Dict[str, str], device_label: str) -> Optional[Dict]:
+        """Chuyển một bản ghi chấm công của thiết bị thành Employee Checkin"""
+        employee = employee_map.get(str(attendance.user_id).strip())
+        if not employee:
+            return None
+        checkin = {
+            'employee': employee,
+            'time': attendance.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            'device_id': device_label
+        }
+        if ATTENDANCE_PULL_CONFIG.get('map_punch_type'):
+            checkin['log_type'] = 'OUT' if attendance.punch == 1 else 'IN'
+        return checkin
+
+    def _post_attendance_batches(self, cursor_key: str, attendances: List, employee_map: Dict[str, str],
+                                 device_label: str, job=None, advance_cursor: bool = True) -> Tuple[int, bool]:
+        """
+        Đẩy các lượt chấm công (đã sắp theo thời gian) lên ERPNext theo lô,
+        dời con trỏ sau mỗi lô thành công (advance_cursor=False: chỉ ghi chỉ mục
+        chống trùng, dùng cho lượt chấm công realtime không đọc từ log)
+        
+        Returns:
+            Tuple (số checkin đã tạo, True nếu đẩy hết không lỗi)
+        """
+        batch_size = ATTENDANCE_PULL_CONFIG.get('batch_size', 100)
+        posted = 0
+        unmapped = set()
+        for start in range(0, len(attendances), batch_size):
+            batch = attendances[start:start + batch_size]
+            checkins = []
+            sent = []
+            # Bỏ các lượt đã gửi trước đó (đọc lại sau khi kết nối lại hoặc reset con trỏ)
+            for attendance in self.punch_index.filter_new(device_label, batch):
+                checkin = self._attendance_to_checkin(attendance, employee_map, device_label)
+                if checkin:
+                    checkins.append(checkin)
+                    sent.append(attendance)
+                else:
+                    unmapped.add(str(attendance.user_id))
+            
+            if checkins and not self.erpnext_api.create_employee_checkins(checkins):
+                logger.error(f"❌ Dừng đẩy log chấm công của {device_label}, lần sau tiếp tục từ lô lỗi")
+                if job:
+                    job.error(f"Lỗi đẩy lô {start // batch_size + 1}", item=False)
+                return posted, False
+            self.punch_index.add_many(device_label, sent)
+            posted += len(checkins)
+            if job:
+                job.item_done(device_label, count=len(batch))
+            
+            if not advance_cursor:
+                continue
+            # Con trỏ trỏ tới giây cuối cùng của lô, kèm các user đã chấm công đúng giây đó
+            batch_last = batch[-1].timestamp.isoformat()
+            boundary_users = [str(a.user_id) for a in batch if a.timestamp.isoformat() == batch_last]
+            self.attendance_cursors.advance(cursor_key, batch_last, boundary_users)
         
+        if unmapped:
+            logger.warning(f"⚠️ {len(unmapped)} user trên {device_label} chưa gắn với nhân viên nào: "
+                           f"{', '.join(sorted(unmapped)[:10])}")
+        return posted, True
+
+    def _filter_new_attendances(self, attendances: List, cursor: Dict) -> List:
+        """Lọc các lượt chấm công mới hơn con trỏ, sắp theo thời gian"""
+        last_timestamp = cursor.get('last_timestamp')
+        boundary_users = set(cursor.get('boundary_users', []))
+        new_records = []
+        for attendance in attendances:
+            ts = attendance.timestamp.isoformat()
+            if last_timestamp:
+                if ts < last_timestamp:
+                    continue
+                if ts == last_timestamp and str(attendance.user_id) in boundary_users:
+                    continue
+            new_records.append(attendance)
+        new_records.sort(key=lambda a: a.timestamp)
+        return new_records
+
+    def pull_attendance_with_connection(self, zk: ZK, device_config: Dict, serial: Optional[str],
+                                        employee_map: Optional[Dict[str, str]] = None) -> Tuple[int, int]:
+        """
+        Kéo lượt chấm công mới qua một kết nối đã mở (dùng chung cho kéo định kỳ
+        và bù khoảng trống của chế độ live capture)
+        
+        Args:
+            zk: Kết nối đang mở tới thiết bị
+            device_config: Thông tin cấu hình thiết bị
+            serial: Serial thiết bị (key con trỏ), None nếu chưa biết
+            employee_map: Bảng tra attendance_device_id -> employee
+            
+        Returns:
+            Tuple (số checkin đã tạo, số lượt chấm công mới trên thiết bị)
+        """
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
+        cursor_key = self.attendance_cursors.make_key(device_config, serial)
+        cursor = self.attendance_cursors.get(cursor_key)
+        
+        # read_sizes chỉ đọc bộ đếm: không có bản ghi mới thì khỏi tải log
+        zk.read_sizes()
+        records = zk.records
+        if cursor.get('records') is not None and records == cursor['records']:
+            logger.info(f"📭 {device_name}: không có lượt chấm công mới")
+            return 0, 0
+        if cursor.get('records') is not None and records < cursor['records']:
+            logger.info(f"🧹 Log chấm công trên {device_name} đã bị xóa bớt, lọc theo thời gian")
+        
+        if employee_map is None:
+            employee_map = self.build_employee_map()
+        if not employee_map:
+            # Không dời con trỏ khi chưa có bảng tra, tránh bỏ sót lượt chấm công
+            logger.error("❌ Không có danh sách nhân viên để gắn lượt chấm công, bỏ qua lần kéo này")
+            return 0, 0
+        
+        logger.info(f"📥 Đang đọc log chấm công từ {device_name} ({records} bản ghi)...")
+        new_records = self._filter_new_attendances(zk.get_attendance(), cursor)
+        logger.info(f"🆕 {len(new_records)} lượt chấm công mới trên {device_name}")
+        
+        with progress_bus.job(f"Chấm công {device_name}", len(new_records)) as job:
+            posted, completed = self._post_attendance_batches(cursor_key, new_records, employee_map,
+                                                              serial or device_name, job)
+        if completed:
+            self.attendance_cursors.set_record_count(cursor_key, records)
+        
+        try:
+            self.erpnext_api.log_sync_history(
+                sync_type="attendance_pull",
+                device_name=device_name,
+                employee_count=posted,
+                status="success" if completed else "failed",
+                message=f"Tạo {posted}/{len(new_records)} Employee Checkin"
+            )
+        except Exception as e:
+            logger.error(f"❌ Lỗi ghi log đồng bộ: {str(e)}")
+        
+        return posted, len(new_records)
+
+    def pull_attendance_logs(self, device_config: Dict,
+                             employee_map: Optional[Dict[str, str]] = None) -> Tuple[int, int]:
+        """
+        Kéo các lượt chấm công mới từ thiết bị và tạo Employee Checkin trên ERPNext
+        
+        Args:
+            device_config: Thông tin cấu hình thiết bị
+            employee_map: Bảng tra attendance_device_id -> employee (mặc định lấy từ ERPNext)
+            
+        Returns:
+            Tuple (số checkin đã tạo, số lượt chấm công mới trên thiết bị)
+        """
+        device_id = device_config.get('id', 1)
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_id}"))
+        
+        zk = self.connect_device(device_config)
+        if not zk:
+            return 0, 0
+        
+        try:
+            serial = self.pool.get_device_info(device_id).get('serial')
+            return self.pull_attendance_with_connection(zk, device_config, serial, employee_map)
+            
+        except Exception as e:
+            logger.error(f"❌ Lỗi kéo log chấm công từ {device_name}: {str(e)}")
+            self.pool.invalidate(device_id)
+            return 0, 0
+            
+        finally:
+            self.disconnect_device(device_id)
+
+    def pull_attendance_all_devices(self, devices: Optional[List[Dict]] = None) -> Dict[str, Tuple[int, int]]:
+        """
+        Kéo log chấm công mới từ tất cả thiết bị lên ERPNext
+        
+        Args:
+            devices: Danh sách thiết bị (mặc định ATTENDANCE_DEVICES)
+            
+        Returns:
+            Dict với key là tên thiết bị, value là (số checkin đã tạo, số lượt chấm công mới)
+        """
+        devices = devices if devices is not None else ATTENDANCE_DEVICES
+        employee_map = self.build_employee_map()
+        results = {}
+        for device in devices:
+            if not device.get('enable', True):
+                continue
+            device_name = device.get('device_name', device.get('name', f"Device_{device.get('id', 1)}"))
+            results[device_name] = self.pull_attendance_logs(device, employee_map)
         return results
     
+    def _prune_unassigned_users(self, device_config: Dict, zk: ZK) -> int:
+        """
+        Xóa khỏi thiết bị các nhân viên không thuộc quy tắc phân công (khi bật prune)
+        
+        Returns:
+            Số user đã xóa
+        """
+        rules = self.assignment.get_rules(device_config)
+        if not rules or not rules.get('prune'):
+            return 0
+        try:
+            users = self.assignment.users_to_prune(device_config, zk.get_users())
+        except Exception as e:
+            logger.error(f"❌ Lỗi lấy danh sách users để dọn: {str(e)}")
+            return 0
+        
+        deleted = [str(user.user_id) for user in users if self.delete_employee_from_device(zk, user.uid)]
+        self.shadow.update_users(self._shadow_serial(device_config), device_config, 'prune', removed=deleted)
+        self.forget_removed_users(device_config, deleted)
+        removed = len(deleted)
+        if removed:
+            device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
+            logger.info(f"🧹 Đã xóa {removed} nhân viên không thuộc quy tắc phân công khỏi {device_name}")
+        return removed
+    
     def delete_employee_from_device(self, zk: ZK, user_id: int) -> bool:
         """
         Xóa nhân viên khỏi thiết bị
@@ -480,16 +1311,21 @@ class AttendanceDeviceSync:
             logger.error(f"❌ Lỗi xóa user: {str(e)}")
             return False
     
-    def get_device_users(self, device_config: Dict) -> List[Dict]:
+    def get_device_users(self, device_config: Dict, refresh: bool = False) -> List[Dict]:
         """
-        Lấy danh sách users từ thiết bị
+        Lấy danh sách users của thiết bị, trả về từ shadow nếu đã có
         
         Args:
             device_config: Thông tin cấu hình thiết bị
+            refresh: Đọc lại từ thiết bị (và cập nhật shadow)
             
         Returns:
             Danh sách thông tin users
         """
+        if not refresh:
+            users_list = self.shadow.device_users(self.metadata_cache.get_serial(device_config))
+            if users_list is not None:
+                return users_list
         users_list = []
         
         zk = self.connect_device(device_config)
@@ -510,50 +1346,240 @@ class AttendanceDeviceSync:
                     'card': user.card
                 }
                 users_list.append(user_info)
+            # Vân tay chưa đọc: shadow giữ hash đã biết của các user này
+            self.shadow.replace(self._shadow_serial(device_config), device_config, {
+                str(user.user_id): user_entry(user.uid, user.name, user.privilege, None, user.card, user.group_id)
+                for user in users}, 'users')
             
             device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
             logger.info(f"✅ Lấy được {len(users_list)} users từ {device_name}")
             
         except Exception as e:
             logger.error(f"❌ Lỗi lấy danh sách users: {str(e)}")
+            self.pool.invalidate(device_config.get('id', 1))
             
         finally:
             device_id = device_config.get('id', 1)
             self.disconnect_device(device_id)
+            self.shadow.flush()
         
         return users_list
     
-    def clear_device_data(self, device_config: Dict) -> bool:
+    def get_device_shadow(self, device_config: Dict) -> Optional[Dict]:
+        """Shadow của thiết bị (users và hash vân tay đã biết), không kết nối thiết bị"""
+        return self.shadow.get(self.metadata_cache.get_serial(device_config))
+    
+    def refresh_shadow(self, device_config: Dict) -> Optional[Dict]:
+        """
+        Đọc lại users và hash vân tay từ thiết bị để cập nhật shadow
+        
+        Returns:
+            Shadow mới hoặc None nếu không đọc được thiết bị
+        """
+        from core.drift_audit import DriftAuditor
+        
+        result = DriftAuditor(self).device_digests(device_config)
+        if result['error'] or not result['serial']:
+            return None
+        self.shadow.replace(result['serial'], device_config, DriftAuditor.shadow_entries(result), 'refresh')
+        self.shadow.flush()
+        return self.shadow.get(result['serial'])
+    
+    def clear_device_data(self, device_config: Dict, backup: Optional[bool] = None) -> bool:
         """
-        Xóa toàn bộ dữ liệu users và vân tay trên thiết bị
+        Xóa toàn bộ dữ liệu users và vân tay trên thiết bị (log chấm công được kéo lên
+        ERPNext trước vì lệnh xóa xóa cả log; còn bản ghi chưa kéo được thì không xóa)
         
         Args:
             device_config: Thông tin cấu hình thiết bị
+            backup: Sao lưu trước khi xóa (mặc định theo BACKUP_CONFIG); sao lưu lỗi thì không xóa
             
         Returns:
             True nếu xóa thành công
         """
+        if backup is None:
+            backup = BACKUP_CONFIG.get('backup_before_clear', True)
+        if backup and not self.backup_device(device_config):
+            logger.error("❌ Không sao lưu được thiết bị, hủy thao tác xóa dữ liệu")
+            return False
+        
         zk = self.connect_device(device_config)
         if not zk:
             return False
         
         try:
             device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
-            logger.warning(f"⚠️ Đang xóa toàn bộ dữ liệu trên {device_name}...")
+            serial = self.pool.get_device_info(device_config.get('id', 1)).get('serial')
             
-            # Xóa tất cả users
-            zk.clear_data()
+            with self.pool.write_batch(device_config.get('id', 1)):
+                # Lệnh xóa xóa cả log chấm công: kéo hết lên ERPNext trước
+                if not self._pull_before_clear(zk, device_config, serial):
+                    return False
+                logger.warning(f"⚠️ Đang xóa toàn bộ dữ liệu trên {device_name}...")
+                # Xóa tất cả users
+                self._clear_data(zk)
+            self._forget_synced(device_config)
+            self.shadow.replace(self._shadow_serial(device_config), device_config, {}, 'clear')
+            self.shadow.flush()
             
             logger.info(f"✅ Đã xóa toàn bộ dữ liệu trên {device_name}")
             return True
             
         except Exception as e:
             logger.error(f"❌ Lỗi xóa dữ liệu: {str(e)}")
+            self.pool.invalidate(device_config.get('id', 1))
             return False
             
         finally:
             device_id = device_config.get('id', 1)
             self.disconnect_device(device_id)
+    
+    def _forget_synced(self, device_config: Dict):
+        """
+        Dữ liệu thiết bị vừa bị xóa/thay toàn bộ: bỏ checkpoint và danh sách nhân viên
+        đã đồng bộ của lịch tự động để lần đồng bộ sau đẩy lại đầy đủ
+        """
+        SyncCheckpointJournal(device_config).clear()
+        if self.sync_scheduler is not None:
+            self.sync_scheduler.forget_device(device_config)
+        else:
+            forget_synced_state(device_config)
+
+    def forget_removed_users(self, device_config: Dict, user_ids: List[str]):
+        """
+        Users vừa bị xóa khỏi thiết bị: bỏ nhân viên tương ứng khỏi checkpoint và danh sách
+        đã đồng bộ của lịch tự động, để khi được kích hoạt/phân công lại thì được đẩy lại
+        """
+        user_ids = {str(user_id).strip() for user_id in user_ids}
+        if not user_ids:
+            return
+        # Nhân viên đã nghỉ không còn trong employees.json, tra thêm trong file vân tay local
+        data_manager = DataManager()
+        employee_ids = {record.get('employee')
+                        for record in (data_manager.load_employees_from_local()
+                                       + list(data_manager.load_local_fingerprints().values()))
+                        if record.get('employee')
+                        and str(record.get('attendance_device_id', '')).strip() in user_ids}
+        if not employee_ids:
+            return
+        SyncCheckpointJournal(device_config).forget(employee_ids)
+        if self.sync_scheduler is not None:
+            self.sync_scheduler.forget_device(device_config, employee_ids)
+        else:
+            forget_synced_state(device_config, employee_ids)
+
+    def _pull_before_clear(self, zk: ZK, device_config: Dict, serial: Optional[str]) -> bool:
+        """
+        Kéo log chấm công còn lại lên ERPNext trước khi xóa dữ liệu thiết bị
+        (bên gọi đã vô hiệu hóa thiết bị nên không phát sinh lượt chấm công mới)
+        
+        Returns:
+            True nếu mọi bản ghi trên thiết bị đã được xử lý, được phép xóa
+        """
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
+        self.pull_attendance_with_connection(zk, device_config, serial)
+        cursor = self.attendance_cursors.get(self.attendance_cursors.make_key(device_config, serial))
+        if cursor.get('records') != zk.records:
+            logger.error(f"❌ {device_name} còn log chấm công chưa kéo lên ERPNext, không xóa dữ liệu")
+            return False
+        return True
+    
+    @staticmethod
+    def _clear_data(zk: ZK):
+        """
+        Xóa users, vân tay và log chấm công. zk.clear_data() của pyzk 0.9 gửi
+        command_string kiểu str nên lỗi khi ghép với header bytes.
+        """
+        cmd_response = zk._ZK__send_command(const.CMD_CLEAR_DATA, b'')
+        if not cmd_response.get('status'):
+            raise Exception("can't clear data")
+        zk.next_uid = 1
+    
+    def backup_device(self, device_config: Dict, path: Optional[str] = None) -> Optional[str]:
+        """
+        Sao lưu toàn bộ users, vân tay và thông tin thiết bị ra file nhị phân nén
+        
+        Args:
+            device_config: Thông tin cấu hình thiết bị
+            path: Đường dẫn file (mặc định data/backups/<serial>_<thời gian>.zkb)
+            
+        Returns:
+            Đường dẫn file sao lưu hoặc None nếu lỗi
+        """
+        device_id = device_config.get('id', 1)
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_id}"))
+        zk = self.connect_device(device_config)
+        if not zk:
+            return None
+        
+        try:
+            device_info = {field: value for field, value in self.pool.get_device_info(device_id).items()
+                           if field in ('serial', 'platform', 'device_name', 'firmware', 'fp_version')}
+            # Vô hiệu hóa thiết bị để users/vân tay không đổi trong lúc đọc
+            with progress_bus.job(f"Sao lưu {device_name}") as job, self.pool.write_batch(device_id):
+                return self.backups.backup(zk, device_info, path, job)
+        except Exception as e:
+            logger.error(f"❌ Lỗi sao lưu {device_name}: {str(e)}")
+            self.pool.invalidate(device_id)
+            return None
+        finally:
+            self.disconnect_device(device_id)
+    
+    def restore_device(self, device_config: Dict, path: str, clear: bool = True) -> Tuple[int, int]:
+        """
+        Khôi phục users và vân tay từ file sao lưu lên thiết bị
+        
+        Args:
+            device_config: Thông tin cấu hình thiết bị
+            path: File sao lưu
+            clear: Xóa dữ liệu hiện có trên thiết bị trước khi nạp. Lệnh xóa xóa cả log
+                   chấm công nên log được kéo lên ERPNext trước; còn bản ghi chưa kéo được
+                   thì không xóa và không khôi phục
+            
+        Returns:
+            Tuple (số user đã khôi phục, tổng số user trong file)
+        """
+        device_id = device_config.get('id', 1)
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_id}"))
+        meta = self.backups.verify(path)
+        if meta is None:
+            return 0, 0
+        
+        zk = self.connect_device(device_config)
+        if not zk:
+            return 0, meta.get('users', 0)
+        
+        try:
+            device_info = self.pool.get_device_info(device_id)
+            if meta.get('fp_version') and device_info.get('fp_version') and \
+                    str(meta['fp_version']) != str(device_info['fp_version']):
+                logger.error(f"❌ File sao lưu dùng vân tay phiên bản {meta['fp_version']}, "
+                             f"{device_name} dùng {device_info['fp_version']}")
+                return 0, meta.get('users', 0)
+            if meta.get('serial') != device_info.get('serial'):
+                logger.warning(f"⚠️ Khôi phục bản sao lưu của {meta.get('serial')} lên {device_info.get('serial')}")
+            
+            logger.info(f"♻️ Đang khôi phục {meta.get('users', 0)} users, {meta.get('fingers', 0)} vân tay "
+                        f"({meta.get('created_at')}) lên {device_name}...")
+            with progress_bus.job(f"Khôi phục {device_name}", meta.get('users', 0)) as job, \
+                    self.pool.write_batch(device_id):
+                if clear:
+                    if not self._pull_before_clear(zk, device_config, device_info.get('serial')):
+                        return 0, meta.get('users', 0)
+                    self._clear_data(zk)
+                result = self.backups.restore(zk, path, job)
+            self._forget_synced(device_config)
+            # Dữ liệu trên thiết bị đã thay đổi toàn bộ, cần đọc lại (refresh_shadow/audit)
+            self.shadow.invalidate(device_info.get('serial'))
+            self.shadow.flush()
+            return result
+        except Exception as e:
+            logger.error(f"❌ Lỗi khôi phục {device_name}: {str(e)}")
+            self.pool.invalidate(device_id)
+            return 0, meta.get('users', 0)
+        finally:
+            self.disconnect_device(device_id)
+    
     def shorten_employee_name(full_name, max_length=24):
         """
         Rút gọn tên nhân viên nếu vượt quá độ dài tối đa
@@ -0,0 +1,565 @@
+# cli.py
+"""
+Dòng lệnh chạy không giao diện (không import Tk/PIL) cho máy chủ và cron.
+
+Ví dụ:
+    python -m core.cli status
+    python -m core.cli pull
+    python -m core.cli push --device 1 --device 2
+    python -m core.cli refresh
+    python -m core.cli checkins
+    python -m core.cli benchmark
+    python -m core.cli calibrate
+    python -m core.cli clone --source 1 --device 2 --device 3
+    python -m core.cli usb-export --output /media/usb --device 2
+    python -m core.cli backup --device 1
+    python -m core.cli restore --device 1 --input data/backups/<serial>_<thời gian>.zkb
+    python -m core.cli audit
+    python -m core.cli audit --offline
+    python -m core.cli shadow --device 1 --refresh
+    python -m core.cli prune-inactive
+    python -m core.cli prune-inactive --apply
+    python -m core.cli daemon
+    python -m core.cli daemon --schedule --live
+"""
+
+import argparse
+import logging
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import SCHEDULER_CONFIG, LIVE_CAPTURE_CONFIG
+from utils.logger import setup_logger
+from core.erpnext_api import ERPNextAPI
+from core.data_manager import DataManager
+from core.attendance_device_sync import AttendanceDeviceSync
+from core.progress import progress_bus, format_progress, ITEM_DONE, BYTES, ERROR, JOB_FINISHED
+
+logger = logging.getLogger(__name__)
+
+
+class HeadlessApp:
+    """Các thành phần core dùng chung cho các lệnh dòng lệnh"""
+
+    def __init__(self):
+        self.data_manager = DataManager()
+        self.erpnext_api = ERPNextAPI()
+        self.device_sync = AttendanceDeviceSync(self.erpnext_api)
+        self.attendance_devices = self.data_manager.load_device_config()
+
+    def select_devices(self, device_ids: Optional[List[int]]) -> List[Dict]:
+        """Lọc thiết bị theo danh sách ID (mặc định: tất cả thiết bị đang bật)"""
+        devices = [d for d in self.attendance_devices if d.get('enable', True)]
+        if device_ids:
+            devices = [d for d in self.attendance_devices if d.get('id') in device_ids]
+        return devices
+
+    def employees_to_sync(self) -> List[Dict]:
+        """Nhân viên có vân tay và attendance_device_id trong dữ liệu local"""
+        return [
+            emp for emp in self.data_manager.load_local_fingerprints().values()
+            if emp.get('fingerprints') and emp.get('attendance_device_id')
+        ]
+
+
+class ProgressPrinter:
+    """In tiến độ các job ra stderr, mỗi job tối đa một dòng sau mỗi interval giây"""
+
+    def __init__(self, interval: float = 2.0):
+        self.interval = interval
+        self._last: Dict[int, float] = {}
+
+    def __call__(self, event):
+        now = time.time()
+        if event.kind in (ITEM_DONE, BYTES) and now - self._last.get(event.job_id, 0) < self.interval:
+            return
+        self._last[event.job_id] = now
+        if event.kind == JOB_FINISHED:
+            self._last.pop(event.job_id, None)
+        line = format_progress(event)
+        if event.kind == ERROR and event.message:
+            line += f" - lỗi: {event.message}"
+        print(line, file=sys.stderr, flush=True)
+
+
+def cmd_status(app: HeadlessApp, args) -> int:
+    """In trạng thái dữ liệu local và kết nối các thiết bị"""
+    from core.device_monitor import DeviceHealthMonitor
+    from core.sync_scheduler import SyncScheduler
+
+    employees = app.data_manager.load_employees_from_local()
+    fingerprints = app.data_manager.load_local_fingerprints()
+    with_fp = sum(1 for emp in fingerprints.values() if emp.get('fingerprints'))
+    print(f"Nhân viên local: {len(employees)}")
+    print(f"Nhân viên có vân tay: {with_fp}/{len(fingerprints)}")
+
+    devices = app.select_devices(args.device)
+    statuses = DeviceHealthMonitor().check_all(devices)
+    scheduler = SyncScheduler(app.device_sync, lambda: devices, app.employees_to_sync)
+    print(f"Máy chấm công: {len(devices)}")
+    for device in devices:
+        device_id = device.get('id')
+        device_name = device.get('device_name', device.get('name', f"Device_{device_id}"))
+        ip = device.get('ip', device.get('ip_address', ''))
+        state = scheduler.state.get(scheduler.device_key(device), {})
+        last_success = state.get('last_success')
+        last_success = datetime.fromtimestamp(last_success).strftime('%Y-%m-%d %H:%M:%S') if last_success else '-'
+        print(f"  [{device_id}] {device_name} ({ip}): {statuses.get(device_id, 'unknown')}"
+              f" | đồng bộ thành công gần nhất: {last_success}"
+              f" | chờ đồng bộ: {len(scheduler.pending_employees(device))}")
+        shadow = app.device_sync.get_device_shadow(device)
+        if shadow:
+            print(f"      shadow: {shadow['users_count']} users, {shadow['fingers_count']} vân tay"
+                  f" ({shadow['source']}, {shadow['updated_at']})")
+    return 0
+
+
+def cmd_refresh(app: HeadlessApp, args) -> int:
+    """Làm mới danh sách nhân viên và máy chấm công từ ERPNext"""
+    if not app.erpnext_api.test_connection():
+        return 1
+    employees = app.erpnext_api.get_all_employees()
+    if not employees:
+        logger.error("❌ Không lấy được nhân viên từ ERPNext, giữ nguyên dữ liệu local")
+        return 1
+    app.data_manager.save_employees_to_local(employees)
+
+    devices = app.erpnext_api.get_attendance_machines()
+    if devices:
+        app.data_manager.save_device_config(devices)
+    print(f"Đã cập nhật {len(employees)} nhân viên, {len(devices)} máy chấm công từ ERPNext")
+    return 0
+
+
+def cmd_pull(app: HeadlessApp, args) -> int:
+    """Tải vân tay từ máy chấm công về dữ liệu local"""
+    from core.fingerprint_pull import FingerprintPuller
+
+    stats = FingerprintPuller(app.device_sync, app.data_manager).pull(app.select_devices(args.device))
+    app.device_sync.disconnect_all_devices()
+    if stats is None:
+        print("Không có nhân viên nào có attendance_device_id hợp lệ để load")
+        return 1
+    for device in stats['devices']:
+        rate = device['templates'] / device['seconds'] if device['seconds'] > 0 else 0
+        status = f"lỗi: {device['error']}" if device['error'] else f"{rate:.0f} vân tay/s"
+        print(f"{device['device_name']}: {device['templates']} vân tay / {device['users']} users"
+              f" trong {device['seconds']:.1f}s ({status})")
+    print(f"Nhân viên cần load: {stats['total_employees']} | có vân tay: {stats['total_loaded']}"
+          f" | tổng sau khi merge: {stats['merged_count']}")
+    return 0
+
+
+def cmd_push(app: HeadlessApp, args) -> int:
+    """Đồng bộ vân tay local đến máy chấm công"""
+    employees = app.employees_to_sync()
+    if not employees:
+        print("Không có nhân viên nào có đủ dữ liệu để đồng bộ")
+        return 1
+
+    exit_code = 0
+    for device in app.select_devices(args.device):
+        device_name = device.get('device_name', device.get('name', f"Device_{device.get('id', 1)}"))
+        success, total = app.device_sync.sync_to_device(device, employees)
+        print(f"{device_name}: {success}/{total} nhân viên{app.device_sync.capacity_note(device)}")
+        if success < total or total == 0 or app.device_sync.capacity_skipped.get(device.get('id', 1)):
+            exit_code = 1
+    app.device_sync.disconnect_all_devices()
+    return exit_code
+
+
+def cmd_checkins(app: HeadlessApp, args) -> int:
+    """Kéo lượt chấm công mới từ máy chấm công lên ERPNext"""
+    results = app.device_sync.pull_attendance_all_devices(app.select_devices(args.device))
+    app.device_sync.disconnect_all_devices()
+    for device_name, (posted, new_count) in results.items():
+        print(f"{device_name}: {posted}/{new_count} Employee Checkin")
+    return 0
+
+
+def cmd_benchmark(app: HeadlessApp, args) -> int:
+    """Đo thời gian các thao tác chính trên từng máy chấm công"""
+    for device in app.select_devices(args.device):
+        device_id = device.get('id', 1)
+        device_name = device.get('device_name', device.get('name', f"Device_{device_id}"))
+        timings = {}
+
+        start = time.perf_counter()
+        zk, device_info = app.device_sync._open_connection(device)
+        timings['connect'] = time.perf_counter() - start
+        if not zk:
+            print(f"{device_name}: không kết nối được")
+            continue
+
+        try:
+            for name, action in (('read_sizes', zk.read_sizes),
+                                 ('get_users', zk.get_users),
+                                 ('get_templates', zk.get_templates)):
+                start = time.perf_counter()
+                result = action()
+                timings[name] = time.perf_counter() - start
+                if isinstance(result, list):
+                    timings[f"{name}_count"] = len(result)
+        finally:
+            zk.disconnect()
+
+        print(f"{device_name} ({device_info.get('users')} users, {device_info.get('fingers')} vân tay):")
+        for name in ('connect', 'read_sizes', 'get_users', 'get_templates'):
+            if name in timings:
+                count = timings.get(f"{name}_count")
+                rate = f" ({count / timings[name]:.0f}/s)" if count and timings[name] > 0 else ""
+                print(f"  {name:<14} {timings[name] * 1000:8.0f} ms{rate}")
+    return 0
+
+
+def cmd_calibrate(app: HeadlessApp, args) -> int:
+    """Đo tốc độ TCP/UDP và chọn giao thức nhanh hơn cho từng máy chấm công"""
+    exit_code = 0
+    for device in app.select_devices(args.device):
+        device_name = device.get('device_name', device.get('name', f"Device_{device.get('id', 1)}"))
+        if app.device_sync.transport_tuner.is_pinned(device):
+            print(f"{device_name}: cố định {str(device['transport']).upper()} trong cấu hình, bỏ qua")
+            continue
+        profile = app.device_sync.transport_tuner.calibrate(device)
+        if not profile:
+            print(f"{device_name}: không đo được")
+            exit_code = 1
+            continue
+        print(f"{device_name}: dùng {'UDP' if profile['force_udp'] else 'TCP'}")
+        for transport in ('tcp', 'udp'):
+            result = profile.get(transport)
+            if result:
+                print(f"  {transport.upper():<4} kết nối {result['connect'] * 1000:6.0f} ms, "
+                      f"{result['throughput'] / 1024:8.0f} KB/s")
+            else:
+                print(f"  {transport.upper():<4} lỗi")
+    return exit_code
+
+
+def cmd_clone(app: HeadlessApp, args) -> int:
+    """Sao chép users và vân tay từ một máy chấm công sang các máy khác"""
+    source = next((d for d in app.attendance_devices if d.get('id') == args.source), None)
+    if not source:
+        print(f"Không tìm thấy máy nguồn ID {args.source}")
+        return 1
+    targets = [d for d in app.select_devices(args.device) if d.get('id') != args.source]
+    if not targets:
+        print("Không có máy đích")
+        return 1
+
+    results = app.device_sync.clone_device(source, targets, args.user)
+    app.device_sync.disconnect_all_devices()
+    exit_code = 0 if len(results) == len(targets) else 1
+    for device_name, (success, total) in results.items():
+        print(f"{device_name}: {success}/{total} users")
+        if success < total:
+            exit_code = 1
+    return exit_code
+
+
+def _target_device(app: HeadlessApp, device_ids: Optional[List[int]]):
+    """Thiết bị đích (đầu tiên) theo --device, None nếu không chỉ định, False nếu không tìm thấy"""
+    if not device_ids:
+        return None
+    devices = app.select_devices(device_ids)
+    if not devices:
+        print(f"Không tìm thấy thiết bị ID {', '.join(map(str, device_ids))}")
+        return False
+    return devices[0]
+
+
+def cmd_usb_export(app: HeadlessApp, args) -> int:
+    """Tạo file nạp user và vân tay qua USB, kiểm tra và nạp thử vào máy giả lập"""
+    from core.usb_provisioning import UsbProvisioner
+
+    device = _target_device(app, args.device)
+    if device is False:
+        return 1
+    provisioner = UsbProvisioner(app.device_sync)
+    result = provisioner.export(args.output, app.employees_to_sync(), device)
+    print(f"Đã ghi {result['users']} users, {result['fingers']} vân tay vào {args.output}")
+    if result['skipped']:
+        print(f"Bỏ qua {len(result['skipped'])} nhân viên: {', '.join(map(str, result['skipped']))}")
+
+    validation = provisioner.validate(args.output, device)
+    for error in validation['errors']:
+        print(f"  Lỗi: {error}")
+    if not validation['ok']:
+        return 1
+    if not args.no_verify:
+        round_trip = provisioner.verify_round_trip(args.output, result['expected'])
+        for mismatch in round_trip['mismatches']:
+            print(f"  Sai lệch: {mismatch}")
+        print(f"Nạp thử: {'khớp' if round_trip['ok'] else 'KHÔNG khớp'} "
+              f"({round_trip['users']} users, {round_trip['fingers']} vân tay)")
+        if not round_trip['ok']:
+            return 1
+    return 0
+
+
+def cmd_usb_validate(app: HeadlessApp, args) -> int:
+    """Kiểm tra file nạp USB đã tạo"""
+    from core.usb_provisioning import UsbProvisioner
+
+    device = _target_device(app, args.device)
+    if device is False:
+        return 1
+    validation = UsbProvisioner(app.device_sync).validate(args.input, device)
+    for error in validation['errors']:
+        print(f"  Lỗi: {error}")
+    print(f"{args.input}: {validation['users']} users, {validation['fingers']} vân tay - "
+          f"{'hợp lệ' if validation['ok'] else 'KHÔNG hợp lệ'}")
+    return 0 if validation['ok'] else 1
+
+
+def cmd_backup(app: HeadlessApp, args) -> int:
+    """Sao lưu users và vân tay của máy chấm công ra file"""
+    exit_code = 0
+    for device in app.select_devices(args.device):
+        device_name = device.get('device_name', device.get('name', f"Device_{device.get('id', 1)}"))
+        path = app.device_sync.backup_device(device)
+        print(f"{device_name}: {path or 'sao lưu thất bại'}")
+        if not path:
+            exit_code = 1
+    app.device_sync.disconnect_all_devices()
+    return exit_code
+
+
+def cmd_restore(app: HeadlessApp, args) -> int:
+    """Khôi phục users và vân tay từ file sao lưu lên một máy chấm công"""
+    devices = app.select_devices(args.device)
+    if len(devices) != 1:
+        print("Chọn đúng một máy chấm công bằng --device")
+        return 1
+    device_name = devices[0].get('device_name', devices[0].get('name', f"Device_{devices[0].get('id', 1)}"))
+    success, total = app.device_sync.restore_device(devices[0], args.input, clear=not args.no_clear)
+    app.device_sync.disconnect_all_devices()
+    print(f"{device_name}: đã khôi phục {success}/{total} users")
+    return 0 if total and success == total else 1
+
+
+def cmd_audit(app: HeadlessApp, args) -> int:
+    """Kiểm tra sai lệch vân tay giữa các máy chấm công và dữ liệu local"""
+    from core.drift_audit import DriftAuditor
+
+    report = DriftAuditor(app.device_sync).audit(app.select_devices(args.device), offline=args.offline)
+    app.device_sync.disconnect_all_devices()
+    for device_name, device in report['devices'].items():
+        if device['error']:
+            print(f"{device_name}: lỗi - {device['error']}")
+            continue
+        print(f"{device_name} ({device['users']} users, {device['fingers']} vân tay, {device['seconds']}s): "
+              f"thiếu {len(device['missing'])}, thừa {len(device['extra'])}, "
+              f"khác vân tay {len(device['fingers_differ'])}, sai tên {len(device['wrong_name'])}, "
+              f"sai quyền {len(device['wrong_privilege'])}")
+        if args.verbose:
+            for label, key in (('Thiếu', 'missing'), ('Thừa', 'extra')):
+                if device[key]:
+                    print(f"  {label}: {', '.join(device[key])}")
+            for user_id, diff in device['fingers_differ'].items():
+                print(f"  {user_id}: thiếu ngón {diff['missing']}, thừa ngón {diff['extra']}, khác ngón {diff['changed']}")
+            for user_id, names in device['wrong_name'].items():
+                print(f"  {user_id}: tên '{names['device']}' (đúng: '{names['expected']}')")
+            for user_id, privileges in device['wrong_privilege'].items():
+                print(f"  {user_id}: quyền {privileges['device']} (đúng: {privileges['expected']})")
+    if report['cross_device']:
+        print(f"Lệch giữa các thiết bị: {len(report['cross_device'])} users")
+        if args.verbose:
+            for user_id, by_device in report['cross_device'].items():
+                print(f"  {user_id}: {', '.join(by_device)}")
+    summary = report['summary']
+    drift = sum(value for key, value in summary.items() if key not in ('devices', 'seconds'))
+    print(f"Kiểm tra {summary['devices']} thiết bị trong {summary['seconds']}s - "
+          f"{'có sai lệch' if drift else 'không có sai lệch'}")
+    return 1 if drift else 0
+
+
+def cmd_shadow(app: HeadlessApp, args) -> int:
+    """In users và số vân tay trên từng thiết bị theo shadow (--refresh: đọc lại từ thiết bị)"""
+    exit_code = 0
+    for device in app.select_devices(args.device):
+        device_name = device.get('device_name', device.get('name', f"Device_{device.get('id')}"))
+        shadow = app.device_sync.refresh_shadow(device) if args.refresh else app.device_sync.get_device_shadow(device)
+        if not shadow:
+            print(f"{device_name}: {'không đọc được thiết bị' if args.refresh else 'chưa có shadow'}")
+            exit_code = 1
+            continue
+        print(f"{device_name}: {shadow['users_count']} users, {shadow['fingers_count']} vân tay"
+              f" ({shadow['source']}, {shadow['updated_at']})")
+        if args.verbose:
+            for user_id, entry in sorted(shadow['users'].items()):
+                fingers = entry.get('fingers')
+                if fingers is None:
+                    fingers_text = "chưa rõ vân tay"
+                else:
+                    fingers_text = f"ngón {', '.join(sorted(fingers))}" if fingers else "không có vân tay"
+                print(f"  {user_id} (uid {entry.get('uid')}) {entry.get('name')}: {fingers_text}")
+    app.device_sync.disconnect_all_devices()
+    return exit_code
+
+
+def cmd_prune_inactive(app: HeadlessApp, args) -> int:
+    """Xem trước (mặc định) hoặc xóa nhân viên đã nghỉ khỏi máy chấm công"""
+    from core.inactive_prune import InactivePruner
+
+    results = InactivePruner(app.device_sync).prune(app.select_devices(args.device), dry_run=not args.apply,
+                                                    refresh=args.refresh, force=args.force)
+    app.device_sync.disconnect_all_devices()
+    if not results:
+        return 1
+    for device_name, result in results.items():
+        line = f"{device_name}: {len(result['orphans'])}/{result['users']} users đã nghỉ"
+        if args.apply:
+            line += f", đã xóa {result['removed']}"
+        if result['error']:
+            line += f" - lỗi: {result['error']}"
+        print(line)
+        if args.verbose:
+            for orphan in result['orphans']:
+                print(f"  {orphan['user_id']} (uid {orphan['uid']}) {orphan['name']}")
+    if not args.apply:
+        print("Chế độ xem trước, chạy lại với --apply để xóa")
+    return 1 if any(result['error'] for result in results.values()) else 0
+
+
+def cmd_daemon(app: HeadlessApp, args) -> int:
+    """Chạy nền: lịch đồng bộ vân tay, chấm công realtime và kéo chấm công định kỳ"""
+    from core.sync_scheduler import SyncScheduler
+    from core.punch_stream import LivePunchStreamer
+    from core.drift_audit import DriftAuditor
+
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info("🛑 Nhận tín hiệu dừng")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    devices_provider = lambda: app.select_devices(args.device)
+    scheduler = SyncScheduler(app.device_sync, devices_provider, app.employees_to_sync)
+    streamer = LivePunchStreamer(app.device_sync, devices_provider)
+
+    if args.schedule or SCHEDULER_CONFIG.get("enabled", False):
+        scheduler.start()
+    live = args.live or LIVE_CAPTURE_CONFIG.get("enabled", False)
+    if live:
+        streamer.start()
+
+    logger.info("🚀 Đã chạy chế độ nền")
+    next_checkins = time.time()
+    next_audit = time.time() + args.audit_interval
+    while not stop.wait(1):
+        if args.checkins_interval and not live and time.time() >= next_checkins:
+            try:
+                app.device_sync.pull_attendance_all_devices(devices_provider())
+            except Exception as e:
+                logger.error(f"❌ Lỗi kéo chấm công định kỳ: {str(e)}")
+            next_checkins = time.time() + args.checkins_interval
+        if args.audit_interval and time.time() >= next_audit:
+            try:
+                DriftAuditor(app.device_sync).audit(devices_provider())
+            except Exception as e:
+                logger.error(f"❌ Lỗi kiểm tra sai lệch định kỳ: {str(e)}")
+            next_audit = time.time() + args.audit_interval
+
+    scheduler.stop()
+    if live:
+        streamer.stop()
+    app.device_sync.disconnect_all_devices()
+    logger.info("👋 Đã dừng chế độ nền")
+    return 0
+
+
+COMMANDS = {
+    'status': cmd_status,
+    'refresh': cmd_refresh,
+    'pull': cmd_pull,
+    'push': cmd_push,
+    'checkins': cmd_checkins,
+    'benchmark': cmd_benchmark,
+    'calibrate': cmd_calibrate,
+    'clone': cmd_clone,
+    'usb-export': cmd_usb_export,
+    'usb-validate': cmd_usb_validate,
+    'backup': cmd_backup,
+    'restore': cmd_restore,
+    'audit': cmd_audit,
+    'shadow': cmd_shadow,
+    'prune-inactive': cmd_prune_inactive,
+    'daemon': cmd_daemon,
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m core.cli",
+                                     description="Đồng bộ vân tay / máy chấm công không cần giao diện")
+    parser.add_argument('--no-progress', action='store_true', help="Không in tiến độ ra stderr")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_command(name: str, help_text: str) -> argparse.ArgumentParser:
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument('--device', type=int, action='append',
+                         help="ID máy chấm công (có thể lặp lại, mặc định tất cả)")
+        return sub
+
+    add_command('status', "Trạng thái dữ liệu local và kết nối thiết bị")
+    add_command('refresh', "Làm mới nhân viên và máy chấm công từ ERPNext")
+    add_command('pull', "Tải vân tay từ máy chấm công về local")
+    add_command('push', "Đồng bộ vân tay local đến máy chấm công")
+    add_command('checkins', "Kéo lượt chấm công mới lên ERPNext")
+    add_command('benchmark', "Đo thời gian các thao tác trên máy chấm công")
+    add_command('calibrate', "Đo TCP/UDP và chọn giao thức nhanh hơn cho từng thiết bị")
+    clone = add_command('clone', "Sao chép users và vân tay từ một máy sang các máy khác (--device: máy đích)")
+    clone.add_argument('--source', type=int, required=True, help="ID máy nguồn")
+    clone.add_argument('--user', action='append', help="Chỉ sao chép attendance_device_id này (có thể lặp lại)")
+    usb_export = add_command('usb-export', "Tạo file nạp user/vân tay qua USB (--device: áp dụng phân công và dung lượng)")
+    usb_export.add_argument('--output', required=True, help="Thư mục ghi file (thư mục gốc USB)")
+    usb_export.add_argument('--no-verify', action='store_true', help="Không nạp thử vào máy giả lập")
+    usb_validate = add_command('usb-validate', "Kiểm tra file nạp USB")
+    usb_validate.add_argument('--input', required=True, help="Thư mục chứa file USB")
+    add_command('backup', "Sao lưu users và vân tay của máy chấm công")
+    restore = add_command('restore', "Khôi phục users và vân tay từ file sao lưu")
+    restore.add_argument('--input', required=True, help="File sao lưu (.zkb)")
+    restore.add_argument('--no-clear', action='store_true', help="Không xóa dữ liệu hiện có trước khi nạp")
+    audit = add_command('audit', "Kiểm tra sai lệch vân tay giữa các máy chấm công và dữ liệu local")
+    audit.add_argument('--verbose', action='store_true', help="In chi tiết từng user sai lệch")
+    audit.add_argument('--offline', action='store_true', help="Kiểm tra trên shadow, không kết nối thiết bị")
+    shadow = add_command('shadow', "Xem users/vân tay trên thiết bị theo shadow")
+    shadow.add_argument('--refresh', action='store_true', help="Đọc lại từ thiết bị trước khi in")
+    shadow.add_argument('--verbose', action='store_true', help="In từng user")
+    prune = add_command('prune-inactive', "Xóa nhân viên đã nghỉ (không còn Active) khỏi máy chấm công")
+    prune.add_argument('--apply', action='store_true', help="Xóa thật (mặc định chỉ xem trước)")
+    prune.add_argument('--refresh', action='store_true', help="Đọc lại users từ thiết bị thay vì dùng shadow")
+    prune.add_argument('--force', action='store_true', help="Bỏ qua giới hạn tỷ lệ user bị xóa")
+    prune.add_argument('--verbose', action='store_true', help="In từng user sẽ xóa")
+    daemon = add_command('daemon', "Chạy nền liên tục")
+    daemon.add_argument('--schedule', action='store_true', help="Bật lịch đồng bộ vân tay tự động")
+    daemon.add_argument('--live', action='store_true', help="Bật nhận chấm công realtime")
+    daemon.add_argument('--checkins-interval', type=int, default=0,
+                        help="Kéo chấm công định kỳ mỗi N giây khi không chạy realtime (0: tắt)")
+    daemon.add_argument('--audit-interval', type=int, default=0,
+                        help="Kiểm tra sai lệch vân tay giữa các thiết bị mỗi N giây (0: tắt)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    setup_logger()
+    if not args.no_progress and args.command != 'daemon':
+        progress_bus.subscribe(ProgressPrinter())
+    app = HeadlessApp()
+    try:
+        return COMMANDS[args.command](app, args)
+    except KeyboardInterrupt:
+        app.device_sync.disconnect_all_devices()
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,11 +5,36 @@ Module quản lý dữ liệu local
 import json
 import os
 import logging
+import hashlib
+import threading
 from typing import Dict, List, Any
 from config import DATA_PATHS, ATTENDANCE_DEVICES
 
 logger = logging.getLogger(__name__)
 
+# RLock: merge vân tay giữ khóa trong cả bước đọc - merge - ghi rồi gọi save_local_fingerprints
+_fingerprints_lock = threading.RLock()
+
+
+def employee_fingerprint_digest(employee_data: Dict[str, Any]) -> str:
+    """
+    Tính digest cho dữ liệu cần đồng bộ của một nhân viên
+    (ID máy chấm công, tên, mật khẩu, quyền và các template vân tay)
+    """
+    fingerprints = sorted(
+        (fp.get('finger_index', 0), fp.get('template_data', ''))
+        for fp in employee_data.get('fingerprints', [])
+        if isinstance(fp, dict) and fp.get('template_data')
+    )
+    payload = json.dumps([
+        str(employee_data.get('attendance_device_id', '')),
+        employee_data.get('employee_name', ''),
+        str(employee_data.get('password', '')),
+        str(employee_data.get('privilege', 0)),
+        fingerprints
+    ], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
 class DataManager:
     """Lớp quản lý dữ liệu local"""
     
@@ -56,15 +81,31 @@ class DataManager:
                     fp_data['attendance_device_id'] = emp_dict[employee_id].get('attendance_device_id', '')
                     fp_data['name'] = emp_dict[employee_id].get('name', '')
             
-            with open(DATA_PATHS["fingerprints"], 'w', encoding='utf-8') as f:
-                json.dump(data_list, f, ensure_ascii=False, indent=4)
-            
+            # Cùng khóa với save_employee_fingerprints để hai luồng không ghi đè file của nhau
+            with _fingerprints_lock:
+                tmp_path = DATA_PATHS["fingerprints"] + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data_list, f, ensure_ascii=False, indent=4)
+                os.replace(tmp_path, DATA_PATHS["fingerprints"])
+
             logger.info(f"✅ Đã lưu {len(data_list)} nhân viên vào file local")
             
         except Exception as e:
             logger.error(f"❌ Lỗi lưu dữ liệu vân tay local: {str(e)}")
             raise
         
+    def save_employee_fingerprints(self, employee_data: Dict[str, Any]):
+        """Ghi vân tay của một nhân viên vào file local (giữ nguyên các nhân viên khác)"""
+        with _fingerprints_lock:
+            fingerprints_data = self.load_local_fingerprints()
+            fingerprints_data[employee_data['employee']] = employee_data
+            data_list = list(fingerprints_data.values())
+            tmp_path = DATA_PATHS["fingerprints"] + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data_list, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, DATA_PATHS["fingerprints"])
+        logger.info(f"✅ Đã lưu vân tay của {employee_data['employee']} vào file local")
+    
     def load_employees_from_local(self) -> List[Dict[str, Any]]:
         """Tải danh sách nhân viên từ file local"""
         try:
@@ -78,6 +119,16 @@ class DataManager:
             logger.error(f"❌ Lỗi tải danh sách nhân viên local: {str(e)}")
             return []
     
+    def save_employees_to_local(self, employees: List[Dict[str, Any]]):
+        """Lưu danh sách nhân viên vào file local"""
+        try:
+            os.makedirs("data", exist_ok=True)
+            with open("data/employees.json", 'w', encoding='utf-8') as f:
+                json.dump(employees, f, ensure_ascii=False, indent=4)
+            logger.info(f"✅ Đã lưu {len(employees)} nhân viên vào file local")
+        except Exception as e:
+            logger.error(f"❌ Lỗi lưu danh sách nhân viên local: {str(e)}")
+    
     def load_device_config(self) -> List[Dict[str, Any]]:
         """Tải cấu hình máy chấm công từ file local hoặc config.py"""
         try:
@@ -96,8 +147,15 @@ class DataManager:
             return ATTENDANCE_DEVICES.copy()
     
     def save_device_config(self, devices: List[Dict[str, Any]]):
-        """Lưu cấu hình máy chấm công vào file local"""
+        """Lưu cấu hình máy chấm công vào file local (giữ quy tắc phân công đã cấu hình local)"""
         try:
+            if os.path.exists(DATA_PATHS["devices"]):
+                with open(DATA_PATHS["devices"], 'r', encoding='utf-8') as f:
+                    assignments = {d.get('id'): d['assignment'] for d in json.load(f) if d.get('assignment')}
+                for device in devices:
+                    if 'assignment' not in device and device.get('id') in assignments:
+                        device['assignment'] = assignments[device.get('id')]
+            
             with open(DATA_PATHS["devices"], 'w', encoding='utf-8') as f:
                 json.dump(devices, f, ensure_ascii=False, indent=4)
             
@@ -0,0 +1,102 @@
+# device_assignment.py
+"""
+Module phân nhân viên về từng máy chấm công theo quy tắc.
+Quy tắc lưu trong cấu hình thiết bị (attendance_devices.json), khóa "assignment":
+
+    "assignment": {
+        "custom_group": ["Kho"],          # Nhóm nhân viên (custom_group)
+        "designation": ["Thủ kho"],       # Chức danh
+        "employees": ["HR-EMP-00012"],    # Thêm trực tiếp (mã nhân viên hoặc attendance_device_id)
+        "exclude": ["HR-EMP-00099"],      # Loại trừ (ưu tiên hơn các quy tắc trên)
+        "prune": false                    # Xóa khỏi thiết bị nhân viên nằm ngoài danh sách
+    }
+
+Thiết bị không có quy tắc nhận toàn bộ nhân viên như trước.
+"""
+
+import logging
+from typing import Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+RULE_FIELDS = ('custom_group', 'designation')
+
+
+class DeviceAssignment:
+    """Biên dịch quy tắc phân công thành tập attendance_device_id của từng thiết bị"""
+
+    def __init__(self, employees_provider: Callable[[], List[Dict]]):
+        """
+        Args:
+            employees_provider: Hàm trả về danh sách nhân viên (employees.json)
+        """
+        self.employees_provider = employees_provider
+
+    @staticmethod
+    def get_rules(device_config: Dict) -> Optional[Dict]:
+        """Quy tắc của thiết bị, None nếu thiết bị nhận toàn bộ nhân viên"""
+        rules = device_config.get('assignment') or {}
+        if any(rules.get(field) for field in RULE_FIELDS + ('employees',)):
+            return rules
+        return None
+
+    @staticmethod
+    def _as_set(values) -> Set[str]:
+        if isinstance(values, str):
+            values = [values]
+        return {str(value).strip() for value in values or [] if str(value).strip()}
+
+    def compile(self, device_config: Dict, employees: Optional[List[Dict]] = None) -> Optional[Set[str]]:
+        """
+        Tính tập attendance_device_id được phân về thiết bị
+
+        Returns:
+            Tập attendance_device_id, None nếu thiết bị không có quy tắc (nhận tất cả)
+        """
+        rules = self.get_rules(device_config)
+        if rules is None:
+            return None
+
+        field_values = {field: self._as_set(rules.get(field)) for field in RULE_FIELDS}
+        explicit = self._as_set(rules.get('employees'))
+        excluded = self._as_set(rules.get('exclude'))
+
+        targets = set()
+        for emp in employees if employees is not None else self.employees_provider():
+            attendance_id = str(emp.get('attendance_device_id') or '').strip()
+            if not attendance_id:
+                continue
+            keys = {str(emp.get('employee', '')), str(emp.get('name', '')), attendance_id}
+            if keys & excluded:
+                continue
+            if keys & explicit or any(
+                str(emp.get(field) or '').strip() in values for field, values in field_values.items()
+            ):
+                targets.add(attendance_id)
+        return targets
+
+    def filter_employees(self, device_config: Dict, employees: List[Dict]) -> List[Dict]:
+        """Chỉ giữ các nhân viên được phân về thiết bị"""
+        targets = self.compile(device_config)
+        if targets is None:
+            return employees
+        selected = [emp for emp in employees if str(emp.get('attendance_device_id') or '').strip() in targets]
+        if len(selected) != len(employees):
+            device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
+            logger.info(f"🎯 {device_name}: {len(selected)}/{len(employees)} nhân viên thuộc quy tắc phân công")
+        return selected
+
+    def users_to_prune(self, device_config: Dict, device_users: List) -> List:
+        """
+        Users trên thiết bị cần xóa khi bật prune: là nhân viên đã biết (có trong
+        employees.json) nhưng không thuộc quy tắc. User lạ (admin, tài khoản thử)
+        không bị động tới.
+        """
+        rules = self.get_rules(device_config)
+        if rules is None or not rules.get('prune'):
+            return []
+        employees = self.employees_provider()
+        targets = self.compile(device_config, employees)
+        known_ids = {str(emp.get('attendance_device_id')).strip() for emp in employees if emp.get('attendance_device_id')}
+        return [user for user in device_users
+                if str(user.user_id).strip() in known_ids and str(user.user_id).strip() not in targets]
@@ -0,0 +1,267 @@
+# device_backup.py
+"""
+Module sao lưu và khôi phục toàn bộ users và template vân tay của máy chấm công.
+Bản sao lưu là một file nhị phân nén gzip gồm các khung (loại 1 byte, độ dài
+4 byte, dữ liệu): thông tin thiết bị (JSON), buffer users và buffer template
+nguyên bản như thiết bị trả về, khung cuối chứa SHA-256 của toàn bộ các khung
+trước đó. Khôi phục gửi nhiều user kèm template trong một lệnh lưu (lệnh 110)
+thay vì từng user một.
+"""
+
+import glob
+import gzip
+import hashlib
+import json
+import os
+import logging
+from datetime import datetime
+from struct import pack, unpack
+from typing import Dict, Iterator, List, Optional, Tuple, Any
+from zk import ZK, const
+from zk.base import Finger
+from zk.exception import ZKErrorResponse
+from config import DATA_PATHS, BACKUP_CONFIG
+from core.template_stream import iter_buffer_chunks, iter_template_records
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ZKBK'
+FORMAT_VERSION = 1
+FRAME_META = b'M'
+FRAME_USERS = b'U'
+FRAME_TEMPLATES = b'T'
+FRAME_END = b'E'
+CMD_SAVE_USERTEMPS = 110
+FINGER_TABLE_BASE = 0x10
+
+
+class DeviceBackup:
+    """Ghi và đọc file sao lưu máy chấm công"""
+
+    def __init__(self, backup_dir: Optional[str] = None):
+        self.backup_dir = backup_dir or DATA_PATHS["backups"]
+        self.batch_users = BACKUP_CONFIG.get('restore_batch_users', 100)
+        self.keep = BACKUP_CONFIG.get('keep', 10)
+
+    @staticmethod
+    def _write_frame(f, digest, kind: bytes, payload: bytes):
+        frame = kind + pack('<I', len(payload)) + payload
+        digest.update(frame)
+        f.write(frame)
+
+    @staticmethod
+    def _iter_frames(path: str) -> Iterator[Tuple[bytes, bytes, Any]]:
+        """Đọc lần lượt các khung, trả về (loại, dữ liệu, sha256 của các khung trước đó)"""
+        digest = hashlib.sha256()
+        with gzip.open(path, 'rb') as f:
+            header = f.read(len(MAGIC) + 1)
+            if header[:len(MAGIC)] != MAGIC:
+                raise ValueError("Không phải file sao lưu máy chấm công")
+            if header[-1] > FORMAT_VERSION:
+                raise ValueError(f"Phiên bản file sao lưu {header[-1]} chưa được hỗ trợ")
+            digest.update(header)
+            while True:
+                head = f.read(5)
+                if len(head) < 5:
+                    raise ValueError("File sao lưu bị cắt cụt")
+                kind, size = head[:1], unpack('<I', head[1:])[0]
+                payload = f.read(size)
+                if len(payload) < size:
+                    raise ValueError("File sao lưu bị cắt cụt")
+                yield kind, payload, digest.copy()
+                if kind == FRAME_END:
+                    return
+                digest.update(head + payload)
+
+    def _backup_path(self, serial: str) -> str:
+        os.makedirs(self.backup_dir, exist_ok=True)
+        return os.path.join(self.backup_dir, f"{serial or 'unknown'}_{datetime.now():%Y%m%d_%H%M%S}.zkb")
+
+    def _prune_old(self, serial: str):
+        """Chỉ giữ lại keep bản sao lưu mới nhất của mỗi thiết bị"""
+        if not self.keep:
+            return
+        for path in self.list_backups(serial)[self.keep:]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.debug(f"Không xóa được bản sao lưu cũ {path}: {str(e)}")
+
+    def list_backups(self, serial: Optional[str] = None) -> List[str]:
+        """Các file sao lưu (mới nhất trước), lọc theo serial nếu có"""
+        pattern = f"{serial}_*.zkb" if serial else "*.zkb"
+        return sorted(glob.glob(os.path.join(self.backup_dir, pattern)), reverse=True)
+
+    def backup(self, zk: ZK, device_info: Dict, path: Optional[str] = None, job=None) -> str:
+        """
+        Ghi toàn bộ users và template của thiết bị ra file sao lưu
+
+        Args:
+            zk: Kết nối thiết bị
+            device_info: Thông tin thiết bị (serial, firmware, fp_version...) ghi vào phần đầu file
+            path: Đường dẫn file (mặc định data/backups/<serial>_<thời gian>.zkb)
+            job: ProgressJob để báo số byte đã đọc
+
+        Returns:
+            Đường dẫn file sao lưu
+        """
+        zk.read_sizes()
+        meta = dict(device_info, users=zk.users, fingers=zk.fingers,
+                    users_cap=zk.users_cap, fingers_cap=zk.fingers_cap,
+                    created_at=datetime.now().isoformat(timespec='seconds'))
+        path = path or self._backup_path(meta.get('serial'))
+        tmp_path = path + '.tmp'
+        digest = hashlib.sha256()
+        nbytes = 0
+        try:
+            with gzip.open(tmp_path, 'wb', compresslevel=BACKUP_CONFIG.get('compress_level', 6)) as f:
+                header = MAGIC + bytes([FORMAT_VERSION])
+                digest.update(header)
+                f.write(header)
+                self._write_frame(f, digest, FRAME_META, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+                reads = []
+                if zk.users:
+                    reads.append((FRAME_USERS, const.CMD_USERTEMP_RRQ, const.FCT_USER))
+                if zk.fingers:
+                    reads.append((FRAME_TEMPLATES, const.CMD_DB_RRQ, const.FCT_FINGERTMP))
+                for kind, command, fct in reads:
+                    for chunk in iter_buffer_chunks(zk, command, fct):
+                        self._write_frame(f, digest, kind, chunk)
+                        nbytes += len(chunk)
+                        if job:
+                            job.add_bytes(len(chunk))
+                f.write(FRAME_END + pack('<I', digest.digest_size) + digest.digest())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        logger.info(f"💾 Đã sao lưu {meta['users']} users, {meta['fingers']} vân tay "
+                    f"({nbytes / 1024:.0f} KB, file {os.path.getsize(path) / 1024:.0f} KB) vào {path}")
+        self._prune_old(meta.get('serial'))
+        return path
+
+    def verify(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Kiểm tra toàn vẹn file sao lưu (đọc hết và so SHA-256)
+
+        Returns:
+            Thông tin thiết bị trong file hoặc None nếu file hỏng
+        """
+        meta = None
+        try:
+            for kind, payload, digest in self._iter_frames(path):
+                if kind == FRAME_META:
+                    meta = json.loads(payload.decode('utf-8'))
+                elif kind == FRAME_END:
+                    if payload != digest.digest():
+                        logger.error(f"❌ File sao lưu {path} sai checksum")
+                        return None
+                    return meta
+        except (OSError, ValueError, EOFError) as e:
+            logger.error(f"❌ File sao lưu {path} không hợp lệ: {str(e)}")
+        return None
+
+    @staticmethod
+    def _user_records(users_buffer: bytes, user_count: int) -> Dict[int, bytes]:
+        """Đổi bản ghi user trong buffer sao lưu sang dạng gói lưu user (29/73 byte), theo uid"""
+        if not users_buffer or not user_count:
+            return {}
+        total_size = unpack('I', users_buffer[:4])[0]
+        data = users_buffer[4:4 + total_size]
+        packet_size = total_size // user_count
+        records = {}
+        if packet_size == 72:
+            for offset in range(0, len(data) - 71, 72):
+                uid, privilege, password, name, card, group_id, user_id = unpack(
+                    '<HB8s24sIx7sx24s', data[offset:offset + 72])
+                records[uid] = pack('<BHB8s24sIB7sx24s', 2, uid, privilege, password, name, card, 1, group_id, user_id)
+        elif packet_size == 28:
+            for offset in range(0, len(data) - 27, 28):
+                uid, privilege, password, name, card, group_id, timezone, user_id = unpack(
+                    '<HB5s8sIxBhI', data[offset:offset + 28])
+                records[uid] = pack('<BHB5s8sIxBhI', 2, uid, privilege, password, name, card, group_id, timezone, user_id)
+        else:
+            raise ValueError(f"Kích thước bản ghi user {packet_size} byte không hỗ trợ")
+        return records
+
+    @staticmethod
+    def _save_batch(zk: ZK, batch: List[Tuple[bytes, List[Finger]]]):
+        """Lưu nhiều user kèm template bằng một lần gửi buffer và một lệnh 110"""
+        upack, table, fpack = [], [], []
+        tstart = 0
+        for record, fingers in batch:
+            upack.append(record)
+            for finger in fingers:
+                tfp = pack('H%is' % len(finger.template), len(finger.template), finger.template)
+                table.append(pack('<bHbI', 2, finger.uid, FINGER_TABLE_BASE + finger.fid, tstart))
+                fpack.append(tfp)
+                tstart += len(tfp)
+        upack, table, fpack = b''.join(upack), b''.join(table), b''.join(fpack)
+        zk._send_with_buffer(pack('III', len(upack), len(table), len(fpack)) + upack + table + fpack)
+        cmd_response = zk._ZK__send_command(CMD_SAVE_USERTEMPS, pack('<IHH', 12, 0, 8))
+        if not cmd_response.get('status'):
+            raise ZKErrorResponse("Can't save utemp")
+
+    def restore(self, zk: ZK, path: str, job=None) -> Tuple[int, int]:
+        """
+        Nạp users và template từ file sao lưu lên thiết bị (đã kiểm tra bằng verify())
+
+        Returns:
+            (số user đã nạp, tổng số user trong file)
+        """
+        meta, users_chunks = {}, []
+        for kind, payload, _ in self._iter_frames(path):
+            if kind == FRAME_META:
+                meta = json.loads(payload.decode('utf-8'))
+            elif kind == FRAME_USERS:
+                users_chunks.append(payload)
+            else:
+                break
+
+        def template_chunks() -> Iterator[bytes]:
+            # Đọc các khung template theo luồng, không giữ cả buffer trong bộ nhớ
+            for kind, payload, _ in self._iter_frames(path):
+                if kind == FRAME_TEMPLATES:
+                    yield payload
+
+        def user_groups() -> Iterator[Tuple[bytes, List[Finger]]]:
+            # Template của một uid có thể nằm ở nhiều đoạn không liền nhau: lượt đầu ghi vị trí
+            # bản ghi cuối của từng uid, lượt sau gom đủ ngón rồi mới trả user đó
+            last_index = {}
+            for index, finger in enumerate(iter_template_records(template_chunks())):
+                last_index[finger.uid] = index
+            pending: Dict[int, List[Finger]] = {}
+            for index, finger in enumerate(iter_template_records(template_chunks())):
+                pending.setdefault(finger.uid, []).append(finger)
+                if last_index[finger.uid] == index:
+                    fingers = pending.pop(finger.uid)
+                    if finger.uid in records:
+                        yield records.pop(finger.uid), fingers
+            # Users không có vân tay
+            for uid in list(records):
+                yield records.pop(uid), []
+
+        records = self._user_records(b''.join(users_chunks), meta.get('users', 0))
+        total = len(records)
+        if job:
+            job.start(total)
+        restored = 0
+        batch: List[Tuple[bytes, List[Finger]]] = []
+        for group in user_groups():
+            batch.append(group)
+            if len(batch) >= self.batch_users:
+                self._save_batch(zk, batch)
+                restored += len(batch)
+                if job:
+                    job.item_done(count=len(batch), nbytes=sum(len(f.template) for _, fingers in batch for f in fingers))
+                batch = []
+        if batch:
+            self._save_batch(zk, batch)
+            restored += len(batch)
+            if job:
+                job.item_done(count=len(batch), nbytes=sum(len(f.template) for _, fingers in batch for f in fingers))
+        zk.refresh_data()
+
+        logger.info(f"✅ Đã khôi phục {restored}/{total} users từ {path}")
+        return restored, total
@@ -0,0 +1,127 @@
+# device_metadata.py
+"""
+Module cache thông tin định danh và khả năng của máy chấm công.
+Lưu serial, platform, firmware, fp version và dung lượng thiết bị vào file local
+để không phải truy vấn lại mỗi lần kết nối.
+"""
+
+import json
+import os
+import logging
+import threading
+import time
+from typing import Dict, Optional, Any
+from config import DATA_PATHS, DEVICE_CACHE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Các trường định danh hầu như không thay đổi
+IDENTITY_FIELDS = ('serial', 'platform', 'device_name', 'firmware', 'fp_version')
+
+# Các trường dung lượng đọc từ read_sizes
+CAPACITY_FIELDS = ('users_cap', 'fingers_cap', 'rec_cap')
+
+
+class DeviceMetadataCache:
+    """Cache thông tin thiết bị theo IP và serial, có TTL"""
+
+    def __init__(self, cache_path: Optional[str] = None, ttl: Optional[int] = None):
+        self.cache_path = cache_path or DATA_PATHS["device_metadata"]
+        self.ttl = ttl or DEVICE_CACHE_CONFIG.get('metadata_ttl', 86400)
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    @staticmethod
+    def make_key(device_config: Dict) -> str:
+        """Tạo key cache từ IP và port của thiết bị"""
+        device_ip = device_config.get('ip', device_config.get('ip_address', ''))
+        device_port = device_config.get('port', 4370)
+        return f"{device_ip}:{device_port}"
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """Tải cache từ file local"""
+        try:
+            if os.path.exists(self.cache_path):
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Không thể tải cache thông tin thiết bị: {str(e)}")
+        return {}
+
+    def _save(self):
+        """Lưu cache xuống file local"""
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            logger.error(f"❌ Lỗi lưu cache thông tin thiết bị: {str(e)}")
+
+    def get(self, device_config: Dict) -> Optional[Dict[str, Any]]:
+        """
+        Lấy thông tin thiết bị còn hạn trong cache
+
+        Args:
+            device_config: Thông tin cấu hình thiết bị
+
+        Returns:
+            Dict thông tin thiết bị hoặc None nếu chưa có/đã hết hạn
+        """
+        with self._lock:
+            entry = self._entries.get(self.make_key(device_config))
+        if not entry:
+            return None
+        if time.time() - entry.get('cached_at', 0) > self.ttl:
+            return None
+        return dict(entry)
+
+    def get_serial(self, device_config: Dict) -> Optional[str]:
+        """Serial đã biết của thiết bị (không xét TTL)"""
+        with self._lock:
+            entry = self._entries.get(self.make_key(device_config), {})
+        return entry.get('serial')
+
+    def get_by_serial(self, serial: str) -> Optional[Dict[str, Any]]:
+        """Tìm thông tin thiết bị theo serial (kể cả khi đã đổi IP)"""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry.get('serial') == serial:
+                    return dict(entry, key=key)
+        return None
+
+    def put(self, device_config: Dict, device_info: Dict[str, Any], refresh_identity: bool = True):
+        """
+        Lưu thông tin thiết bị vào cache
+
+        Args:
+            device_config: Thông tin cấu hình thiết bị
+            device_info: Thông tin đọc được từ thiết bị
+            refresh_identity: True nếu thông tin định danh vừa được đọc lại (đặt lại TTL)
+        """
+        key = self.make_key(device_config)
+        with self._lock:
+            entry = dict(self._entries.get(key, {}))
+            for field in IDENTITY_FIELDS + CAPACITY_FIELDS:
+                if device_info.get(field) is not None:
+                    entry[field] = device_info[field]
+            if refresh_identity or 'cached_at' not in entry:
+                entry['cached_at'] = time.time()
+            self._entries[key] = entry
+            self._save()
+
+    def invalidate(self, device_config: Dict):
+        """Xóa thông tin thiết bị khỏi cache (buộc đọc lại ở lần kết nối sau)"""
+        with self._lock:
+            if self._entries.pop(self.make_key(device_config), None) is not None:
+                self._save()
+
+    def get_capabilities(self, device_config: Dict) -> Dict[str, Any]:
+        """
+        Lấy khả năng thiết bị đã cache (fp version, dung lượng user/vân tay)
+
+        Returns:
+            Dict gồm fp_version, users_cap, fingers_cap, rec_cap (có thể rỗng)
+        """
+        with self._lock:
+            entry = self._entries.get(self.make_key(device_config), {})
+        return {field: entry.get(field) for field in ('fp_version',) + CAPACITY_FIELDS if field in entry}
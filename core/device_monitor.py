@@ -0,0 +1,197 @@
+# device_monitor.py
+"""
+Module giám sát kết nối máy chấm công bằng asyncio.
+Kiểm tra đồng thời tất cả thiết bị, theo dõi RTT, lịch sử lên/xuống
+và chỉ báo ra ngoài khi trạng thái thiết bị thay đổi.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Any
+from config import MONITOR_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceHealth:
+    """Trạng thái sức khỏe của một thiết bị"""
+
+    def __init__(self, device_id: Any, history_size: int):
+        self.device_id = device_id
+        self.status = 'unknown'
+        self.rtt_ms: Optional[float] = None
+        self.last_check = None
+        self.last_change = None
+        self.history = deque(maxlen=history_size)
+
+    def record(self, status: str, rtt_ms: Optional[float]) -> bool:
+        """Ghi nhận một lần kiểm tra, trả về True nếu trạng thái thay đổi"""
+        now = time.time()
+        self.history.append((now, status, rtt_ms))
+        self.rtt_ms = rtt_ms
+        self.last_check = now
+        changed = status != self.status
+        if changed:
+            self.status = status
+            self.last_change = now
+        return changed
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Tóm tắt trạng thái để hiển thị"""
+        checks = len(self.history)
+        up = sum(1 for _, status, _ in self.history if status == 'connected')
+        rtts = [rtt for _, _, rtt in self.history if rtt is not None]
+        return {
+            'status': self.status,
+            'rtt_ms': self.rtt_ms,
+            'avg_rtt_ms': sum(rtts) / len(rtts) if rtts else None,
+            'uptime_ratio': up / checks if checks else None,
+            'last_check': self.last_check,
+            'last_change': self.last_change,
+            'checks': checks
+        }
+
+
+class DeviceHealthMonitor:
+    """Giám sát đồng thời kết nối tới các máy chấm công"""
+
+    def __init__(self, on_status_change: Optional[Callable[[Any, str, Dict], None]] = None,
+                 probe_timeout: Optional[float] = None):
+        self.on_status_change = on_status_change
+        self.probe_timeout = probe_timeout or MONITOR_CONFIG.get('probe_timeout', 1)
+        self.history_size = MONITOR_CONFIG.get('history_size', 50)
+        self.health: Dict[Any, DeviceHealth] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def _probe(self, device: Dict) -> tuple:
+        """Kiểm tra cổng TCP của một thiết bị, trả về (trạng thái, RTT ms)"""
+        ip = device.get('ip', device.get('ip_address', ''))
+        port = device.get('port', 4370)
+        if not ip:
+            return 'error', None
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=self.probe_timeout)
+            rtt_ms = (time.perf_counter() - start) * 1000
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+            return 'connected', rtt_ms
+        except (asyncio.TimeoutError, OSError):
+            return 'disconnected', None
+        except Exception as e:
+            logger.debug(f"Lỗi kiểm tra {ip}:{port}: {str(e)}")
+            return 'error', None
+
+    def _record(self, device: Dict, status: str, rtt_ms: Optional[float]) -> bool:
+        """Cập nhật lịch sử và gọi callback nếu trạng thái thay đổi"""
+        device_id = device.get('id')
+        health = self.health.get(device_id)
+        if health is None:
+            health = DeviceHealth(device_id, self.history_size)
+            self.health[device_id] = health
+
+        changed = health.record(status, rtt_ms)
+        if changed:
+            device_name = device.get('device_name', device.get('name', f'Device_{device_id}'))
+            ip = device.get('ip', device.get('ip_address', ''))
+            if status == 'connected':
+                logger.info(f"✅ {device_name} ({ip}) - Kết nối thành công ({rtt_ms:.0f} ms)")
+            else:
+                logger.warning(f"❌ {device_name} ({ip}) - Mất kết nối")
+            if self.on_status_change:
+                try:
+                    self.on_status_change(device_id, status, health.to_dict())
+                except Exception as e:
+                    logger.error(f"❌ Lỗi xử lý thay đổi trạng thái thiết bị: {str(e)}")
+        return changed
+
+    async def probe_all(self, devices: List[Dict]) -> Dict[Any, str]:
+        """Kiểm tra đồng thời tất cả thiết bị"""
+        results = await asyncio.gather(*(self._probe(device) for device in devices))
+        statuses = {}
+        for device, (status, rtt_ms) in zip(devices, results):
+            self._record(device, status, rtt_ms)
+            statuses[device.get('id')] = status
+        return statuses
+
+    def check_all(self, devices: List[Dict]) -> Dict[Any, str]:
+        """
+        Kiểm tra một lượt tất cả thiết bị (gọi từ luồng thường)
+
+        Returns:
+            Dict {device_id: 'connected' | 'disconnected' | 'error'}
+        """
+        if not devices:
+            return {}
+        if self._loop and self._loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self.probe_all(devices), self._loop)
+            return future.result(timeout=self.probe_timeout + 5)
+        return asyncio.run(self.probe_all(devices))
+
+    async def _watch_device(self, device: Dict):
+        """Kiểm tra định kỳ một thiết bị theo sync_interval của nó"""
+        interval = device.get('sync_interval') or MONITOR_CONFIG.get('default_interval', 300)
+        while True:
+            status, rtt_ms = await self._probe(device)
+            self._record(device, status, rtt_ms)
+            await asyncio.sleep(interval)
+
+    async def _supervise(self, devices_provider: Callable[[], List[Dict]]):
+        """Tạo/hủy task giám sát khi danh sách thiết bị thay đổi"""
+        tasks: Dict[Any, tuple] = {}
+        refresh = MONITOR_CONFIG.get('refresh_interval', 10)
+        try:
+            while not self._stop.is_set():
+                devices = [d for d in devices_provider() if d.get('enable', True)]
+                current = {d.get('id'): d for d in devices}
+
+                for device_id, (device, task) in list(tasks.items()):
+                    if current.get(device_id) != device:
+                        task.cancel()
+                        del tasks[device_id]
+                for device_id, device in current.items():
+                    if device_id not in tasks:
+                        tasks[device_id] = (dict(device), asyncio.ensure_future(self._watch_device(dict(device))))
+
+                await asyncio.sleep(refresh)
+        finally:
+            for _, task in tasks.values():
+                task.cancel()
+
+    def start(self, devices_provider: Callable[[], List[Dict]]):
+        """Chạy giám sát liên tục trong luồng nền"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def run_loop():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self._supervise(devices_provider))
+            except Exception as e:
+                logger.error(f"❌ Lỗi giám sát máy chấm công: {str(e)}")
+            finally:
+                self._loop.close()
+                self._loop = None
+
+        self._thread = threading.Thread(target=run_loop, daemon=True)
+        self._thread.start()
+        logger.info("🩺 Đã bật giám sát kết nối máy chấm công")
+
+    def stop(self):
+        """Dừng giám sát"""
+        self._stop.set()
+
+    def get_health(self, device_id) -> Dict[str, Any]:
+        """Lấy tóm tắt sức khỏe của một thiết bị"""
+        health = self.health.get(device_id)
+        return health.to_dict() if health else {'status': 'unknown'}
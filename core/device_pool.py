@@ -0,0 +1,249 @@
+# device_pool.py
+"""
+Module quản lý pool kết nối máy chấm công ZKTeco.
+Giữ phiên kết nối đã xác thực giữa các thao tác, tự đóng khi rảnh quá lâu
+và kiểm tra kết nối còn sống bằng lệnh nhẹ (get_time).
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple, Any
+from zk import ZK
+from config import DEVICE_POOL_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class PooledSession:
+    """Một phiên kết nối đang được giữ trong pool"""
+
+    def __init__(self, device_id: Any, conn: ZK, device_info: Dict):
+        self.device_id = device_id
+        self.conn = conn
+        self.device_info = device_info
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.last_ping = self.created_at
+        self.write_depth = 0
+        self.suspect = False
+
+
+class DeviceConnectionPool:
+    """Pool giữ kết nối máy chấm công giữa các thao tác"""
+
+    def __init__(self, idle_timeout: Optional[int] = None, ping_interval: Optional[int] = None):
+        self.idle_timeout = idle_timeout or DEVICE_POOL_CONFIG.get('idle_timeout', 300)
+        self.ping_interval = ping_interval or DEVICE_POOL_CONFIG.get('ping_interval', 30)
+        self._sessions: Dict[Any, PooledSession] = {}
+        self._device_locks: Dict[Any, threading.RLock] = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._stop_event = threading.Event()
+
+    def _get_device_lock(self, device_id) -> threading.RLock:
+        """Lấy lock riêng của thiết bị (mỗi thiết bị chỉ một luồng dùng socket)"""
+        with self._lock:
+            if device_id not in self._device_locks:
+                self._device_locks[device_id] = threading.RLock()
+            return self._device_locks[device_id]
+
+    def acquire(self, device_id, factory: Callable[[], Tuple[Optional[ZK], Dict]]) -> Optional[ZK]:
+        """
+        Lấy kết nối từ pool, tạo mới nếu chưa có hoặc kết nối cũ đã chết
+
+        Args:
+            device_id: ID thiết bị
+            factory: Hàm tạo kết nối mới, trả về (ZK, device_info)
+
+        Returns:
+            ZK object nếu thành công, None nếu thất bại.
+            Luồng gọi giữ lock thiết bị cho đến khi gọi release().
+        """
+        device_lock = self._get_device_lock(device_id)
+        device_lock.acquire()
+        try:
+            session = self._sessions.get(device_id)
+            if session and not self._is_alive(session):
+                logger.info(f"♻️ Kết nối tới thiết bị ID {device_id} đã mất, đang kết nối lại...")
+                self._close_session(session)
+                session = None
+
+            if session is None:
+                conn, device_info = factory()
+                if not conn:
+                    device_lock.release()
+                    return None
+                session = PooledSession(device_id, conn, device_info or {})
+                with self._lock:
+                    self._sessions[device_id] = session
+            else:
+                logger.info(f"🔁 Dùng lại kết nối sẵn có tới thiết bị ID {device_id}")
+
+            session.last_used = time.time()
+            self._ensure_reaper()
+            return session.conn
+        except Exception:
+            device_lock.release()
+            raise
+
+    def release(self, device_id):
+        """Trả kết nối về pool (không ngắt kết nối)"""
+        session = self._sessions.get(device_id)
+        if session:
+            session.last_used = time.time()
+            if session.write_depth == 0 and not session.conn.is_enabled:
+                try:
+                    session.conn.enable_device()
+                except Exception as e:
+                    logger.warning(f"⚠️ Không thể bật lại thiết bị ID {device_id}: {str(e)}")
+                    self._close_session(session)
+        try:
+            self._get_device_lock(device_id).release()
+        except RuntimeError:
+            # Luồng hiện tại không giữ lock (release thừa)
+            pass
+
+    def reconnect(self, device_id, factory: Callable[[], Tuple[Optional[ZK], Dict]]) -> Optional[ZK]:
+        """
+        Đóng kết nối hiện tại và mở kết nối mới ngay (luồng gọi phải đang giữ kết nối).
+        Nếu đang trong write_batch thì thiết bị mới cũng được vô hiệu hóa.
+
+        Returns:
+            ZK object mới hoặc None nếu không kết nối lại được
+        """
+        old_session = self._sessions.get(device_id)
+        write_depth = old_session.write_depth if old_session else 0
+        if old_session:
+            self._close_session(old_session)
+
+        conn, device_info = factory()
+        if not conn:
+            return None
+        session = PooledSession(device_id, conn, device_info or {})
+        if write_depth:
+            conn.disable_device()
+            session.write_depth = write_depth
+        with self._lock:
+            self._sessions[device_id] = session
+        return conn
+
+    def invalidate(self, device_id):
+        """Đánh dấu kết nối cần kiểm tra lại trước lần dùng tiếp theo"""
+        session = self._sessions.get(device_id)
+        if session:
+            session.suspect = True
+
+    def get_device_info(self, device_id) -> Dict:
+        """Lấy thông tin thiết bị đã đọc khi tạo kết nối"""
+        session = self._sessions.get(device_id)
+        return session.device_info if session else {}
+
+    @contextmanager
+    def write_batch(self, device_id):
+        """
+        Vô hiệu hóa thiết bị trong suốt một lô thao tác ghi, bật lại khi xong.
+        Có thể lồng nhau, chỉ lớp ngoài cùng gửi lệnh disable/enable.
+        """
+        session = self._sessions.get(device_id)
+        if session is None:
+            yield None
+            return
+
+        if session.write_depth == 0:
+            session.conn.disable_device()
+        session.write_depth += 1
+        try:
+            yield session.conn
+        finally:
+            # Phiên có thể đã được kết nối lại trong lúc ghi
+            session = self._sessions.get(device_id)
+            if session is not None:
+                session.write_depth = max(session.write_depth - 1, 0)
+                if session.write_depth == 0:
+                    try:
+                        session.conn.enable_device()
+                    except Exception as e:
+                        logger.error(f"❌ Lỗi bật lại thiết bị ID {device_id}: {str(e)}")
+                        self.invalidate(device_id)
+                    session.last_used = time.time()
+
+    def _is_alive(self, session: PooledSession) -> bool:
+        """Kiểm tra kết nối còn sống, chỉ ping khi rảnh quá ping_interval"""
+        now = time.time()
+        if not session.suspect and now - max(session.last_used, session.last_ping) < self.ping_interval:
+            return True
+        try:
+            session.conn.get_time()
+            session.last_ping = now
+            session.suspect = False
+            return True
+        except Exception as e:
+            logger.debug(f"Ping thiết bị ID {session.device_id} thất bại: {str(e)}")
+            return False
+
+    def _close_session(self, session: PooledSession):
+        """Đóng một phiên kết nối và xóa khỏi pool"""
+        with self._lock:
+            if self._sessions.get(session.device_id) is session:
+                del self._sessions[session.device_id]
+        try:
+            if not session.conn.is_enabled:
+                session.conn.enable_device()
+            session.conn.disconnect()
+            logger.info(f"✅ Đã ngắt kết nối thiết bị ID: {session.device_id}")
+        except Exception as e:
+            logger.debug(f"Lỗi đóng kết nối thiết bị ID {session.device_id}: {str(e)}")
+
+    def close(self, device_id) -> bool:
+        """Đóng hẳn kết nối của một thiết bị"""
+        device_lock = self._get_device_lock(device_id)
+        if not device_lock.acquire(timeout=5):
+            logger.warning(f"⚠️ Thiết bị ID {device_id} đang bận, không thể đóng kết nối")
+            return False
+        try:
+            session = self._sessions.get(device_id)
+            if session:
+                self._close_session(session)
+            return True
+        finally:
+            device_lock.release()
+
+    def close_idle(self):
+        """Đóng các kết nối rảnh quá idle_timeout"""
+        now = time.time()
+        for device_id, session in list(self._sessions.items()):
+            if now - session.last_used < self.idle_timeout:
+                continue
+            device_lock = self._get_device_lock(device_id)
+            if not device_lock.acquire(blocking=False):
+                continue
+            try:
+                if self._sessions.get(device_id) is session:
+                    logger.info(f"💤 Đóng kết nối rảnh tới thiết bị ID {device_id}")
+                    self._close_session(session)
+            finally:
+                device_lock.release()
+
+    def close_all(self):
+        """Đóng tất cả kết nối và dừng luồng dọn dẹp"""
+        self._stop_event.set()
+        for device_id in list(self._sessions.keys()):
+            self.close(device_id)
+
+    def _ensure_reaper(self):
+        """Khởi động luồng nền đóng kết nối rảnh"""
+        if self._reaper and self._reaper.is_alive():
+            return
+        self._stop_event.clear()
+
+        def reaper_loop():
+            while not self._stop_event.wait(self.ping_interval):
+                try:
+                    self.close_idle()
+                except Exception as e:
+                    logger.error(f"❌ Lỗi dọn dẹp pool kết nối: {str(e)}")
+
+        self._reaper = threading.Thread(target=reaper_loop, daemon=True)
+        self._reaper.start()
@@ -0,0 +1,179 @@
+# device_shadow.py
+"""
+Module lưu bản sao (shadow) dữ liệu trên từng máy chấm công, theo serial.
+Mỗi thiết bị lưu danh sách users (uid, tên, quyền, thẻ, nhóm) và hash từng
+template vân tay, được cập nhật sau mỗi lần đồng bộ, tải vân tay, kiểm tra
+sai lệch hoặc đọc lại theo yêu cầu. Trạng thái, lập kế hoạch và báo cáo đọc từ
+shadow mà không cần kết nối thiết bị.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Any
+from config import DATA_PATHS
+
+logger = logging.getLogger(__name__)
+
+
+def template_hash(template: bytes) -> str:
+    """Hash ngắn của một template vân tay"""
+    return hashlib.blake2b(template, digest_size=8).hexdigest()
+
+
+def user_entry(uid: Optional[int], name: str, privilege: int, fingers: Optional[Dict[int, bytes]],
+               card: int = 0, group_id: str = '') -> Dict[str, Any]:
+    """
+    Bản ghi shadow của một user
+
+    Args:
+        fingers: ngón -> template; None nếu chưa biết vân tay của user
+    """
+    return {
+        'uid': uid,
+        'name': name,
+        'privilege': privilege,
+        'card': card,
+        'group_id': group_id,
+        'fingers': None if fingers is None else {str(fid): template_hash(t) for fid, t in fingers.items() if t}
+    }
+
+
+def employee_fingers(employee: Dict) -> Dict[int, bytes]:
+    """Template (đã giải mã base64) của nhân viên theo ngón"""
+    fingers = {}
+    for fp in employee.get('fingerprints', []):
+        if isinstance(fp, dict) and fp.get('template_data'):
+            try:
+                fingers[int(fp.get('finger_index', 0))] = base64.b64decode(fp['template_data'])
+            except Exception:
+                logger.warning(f"⚠️ Template ngón {fp.get('finger_index')} của {employee.get('employee')} không hợp lệ")
+    return fingers
+
+
+class DeviceShadowStore:
+    """Lưu shadow của các thiết bị trong một file JSON, key là serial"""
+
+    def __init__(self, shadow_path: Optional[str] = None):
+        self.shadow_path = shadow_path or DATA_PATHS["device_shadows"]
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._shadows = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            if os.path.exists(self.shadow_path):
+                with open(self.shadow_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Không thể tải shadow thiết bị: {str(e)}")
+        return {}
+
+    def flush(self):
+        """Ghi file nếu có thay đổi"""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.shadow_path) or ".", exist_ok=True)
+                tmp_path = self.shadow_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._shadows, f, ensure_ascii=False)
+                os.replace(tmp_path, self.shadow_path)
+                self._dirty = False
+            except Exception as e:
+                logger.error(f"❌ Lỗi lưu shadow thiết bị: {str(e)}")
+
+    def get(self, serial: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Shadow của thiết bị (bản sao), None nếu chưa có"""
+        if not serial:
+            return None
+        with self._lock:
+            shadow = self._shadows.get(serial)
+            if shadow is None:
+                return None
+            return dict(shadow, users={user_id: dict(entry) for user_id, entry in shadow['users'].items()})
+
+    def _touch(self, shadow: Dict[str, Any], device_config: Dict, source: str):
+        shadow['device_name'] = device_config.get('device_name', device_config.get('name', shadow.get('device_name')))
+        shadow['device_id'] = device_config.get('id', shadow.get('device_id'))
+        shadow['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        shadow['source'] = source
+        shadow['users_count'] = len(shadow['users'])
+        shadow['fingers_count'] = sum(len(entry['fingers'] or {}) for entry in shadow['users'].values())
+        self._dirty = True
+
+    def replace(self, serial: Optional[str], device_config: Dict, users: Dict[str, Dict[str, Any]], source: str):
+        """
+        Thay toàn bộ danh sách users của thiết bị. User có fingers None (chưa đọc
+        vân tay) giữ lại vân tay đã biết từ shadow cũ.
+        """
+        if not serial:
+            return
+        with self._lock:
+            previous = self._shadows.get(serial, {}).get('users', {})
+            merged = {}
+            for user_id, entry in users.items():
+                entry = dict(entry)
+                if entry.get('fingers') is None and user_id in previous:
+                    entry['fingers'] = previous[user_id].get('fingers')
+                merged[str(user_id)] = entry
+            shadow = self._shadows.setdefault(serial, {})
+            shadow.pop('partial', None)
+            shadow['users'] = merged
+            self._touch(shadow, device_config, source)
+
+    def update_users(self, serial: Optional[str], device_config: Dict, source: str,
+                     entries: Optional[Dict[str, Dict[str, Any]]] = None, removed: Iterable[str] = ()):
+        """
+        Cập nhật một phần: ghi đè các user trong entries (uid None giữ uid đã biết),
+        xóa các user trong removed
+        """
+        if not serial:
+            return
+        with self._lock:
+            shadow = self._shadows.get(serial)
+            if shadow is None:
+                # Chưa có ảnh đầy đủ của thiết bị: chỉ ghi nhận nếu có user mới
+                if not entries:
+                    return
+                shadow = self._shadows.setdefault(serial, {'users': {}, 'partial': True})
+            for user_id, entry in (entries or {}).items():
+                previous = shadow['users'].get(str(user_id))
+                if entry.get('uid') is None and previous:
+                    entry = dict(entry, uid=previous.get('uid'))
+                shadow['users'][str(user_id)] = entry
+            for user_id in removed:
+                shadow['users'].pop(str(user_id), None)
+            self._touch(shadow, device_config, source)
+
+    def invalidate(self, serial: Optional[str]):
+        """Xóa shadow của thiết bị (dữ liệu trên thiết bị không còn biết chắc)"""
+        with self._lock:
+            if serial and self._shadows.pop(serial, None) is not None:
+                self._dirty = True
+
+    def summaries(self) -> Dict[str, Dict[str, Any]]:
+        """Thông tin tóm tắt của các shadow (không kèm danh sách users)"""
+        with self._lock:
+            return {serial: {key: value for key, value in shadow.items() if key != 'users'}
+                    for serial, shadow in self._shadows.items()}
+
+    def device_users(self, serial: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        """Danh sách users theo định dạng của get_device_users, None nếu chưa có shadow"""
+        shadow = self.get(serial)
+        if shadow is None or shadow.get('partial'):
+            return None
+        return [{
+            'user_id': user_id,
+            'uid': entry.get('uid'),
+            'name': entry.get('name'),
+            'privilege': entry.get('privilege'),
+            'group_id': entry.get('group_id', ''),
+            'card': entry.get('card', 0),
+            'fingers': len(entry.get('fingers') or {})
+        } for user_id, entry in sorted(shadow['users'].items(), key=lambda item: (item[1].get('uid') or 0, item[0]))]
@@ -0,0 +1,281 @@
+# drift_audit.py
+"""
+Module kiểm tra sai lệch dữ liệu giữa các máy chấm công và dữ liệu local.
+Kết nối song song tới các thiết bị, đọc users và template theo luồng, chỉ giữ
+hash của từng template rồi so với hash tính từ all_fingerprints.json và giữa
+các thiết bị với nhau. Báo cáo gồm user thiếu, user thừa, ngón khác nhau,
+sai tên hoặc sai quyền. Kết quả đọc được ghi vào shadow thiết bị; chế độ
+offline kiểm tra trực tiếp trên shadow mà không kết nối thiết bị.
+"""
+
+import base64
+import json
+import os
+import logging
+import time
+import concurrent.futures
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+from zk import const
+from config import DATA_PATHS, DRIFT_AUDIT_CONFIG
+from core.data_manager import DataManager
+from core.template_stream import iter_templates
+from core.progress import progress_bus
+from core.device_shadow import template_hash
+
+logger = logging.getLogger(__name__)
+
+
+class DriftAuditor:
+    """So sánh hash template trên các thiết bị với dữ liệu local"""
+
+    def __init__(self, device_sync, report_path: Optional[str] = None):
+        """
+        Args:
+            device_sync: AttendanceDeviceSync (pool kết nối, quy tắc phân công)
+            report_path: File lưu báo cáo gần nhất
+        """
+        self.device_sync = device_sync
+        self.report_path = report_path or DATA_PATHS["drift_report"]
+        self.max_workers = DRIFT_AUDIT_CONFIG.get('max_workers', 8)
+
+    def _device_name_on_device(self, employee_name: str) -> str:
+        """Tên sẽ được ghi lên thiết bị khi đồng bộ (rút gọn, cắt theo 24 byte)"""
+        name = self.device_sync.shorted_name(employee_name or '', 24)
+        return name.encode('utf-8')[:24].decode('utf-8', errors='ignore').strip()
+
+    def local_digests(self, employees: Optional[List[Dict]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Hash dữ liệu local theo attendance_device_id
+
+        Returns:
+            Dict user_id -> {employee, name, privilege, fingers: {ngón: hash}}
+        """
+        if employees is None:
+            employees = list(DataManager().load_local_fingerprints().values())
+        digests = {}
+        for emp in employees:
+            user_id = str(emp.get('attendance_device_id') or '').strip()
+            if not user_id:
+                continue
+            fingers = {}
+            for fp in emp.get('fingerprints', []):
+                if isinstance(fp, dict) and fp.get('template_data'):
+                    try:
+                        fingers[int(fp.get('finger_index', 0))] = template_hash(base64.b64decode(fp['template_data']))
+                    except Exception:
+                        logger.warning(f"⚠️ Template ngón {fp.get('finger_index')} của {emp.get('employee')} không hợp lệ")
+            digests[user_id] = {
+                'employee': emp.get('employee'),
+                'name': self._device_name_on_device(emp.get('employee_name', '')),
+                'privilege': const.USER_ADMIN if emp.get('employee_name') == 'USER_ADMIN' else const.USER_DEFAULT,
+                'fingers': fingers
+            }
+        return digests
+
+    def device_digests(self, device_config: Dict) -> Dict[str, Any]:
+        """
+        Đọc users và hash template của một thiết bị
+
+        Returns:
+            Dict gồm device_name, serial, users (user_id -> {uid, name, privilege, card, group_id, fingers}),
+            seconds, error
+        """
+        device_id = device_config.get('id', 1)
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_id}"))
+        result = {'device_name': device_name, 'serial': None, 'users': {}, 'seconds': 0.0, 'error': None}
+        started = time.perf_counter()
+
+        zk = self.device_sync.connect_device(device_config)
+        if not zk:
+            result['error'] = "Không kết nối được"
+            return result
+
+        try:
+            result['serial'] = self.device_sync.pool.get_device_info(device_id).get('serial')
+            device_users = zk.get_users()
+            by_uid = {}
+            for user in device_users:
+                entry = {'uid': user.uid, 'name': user.name, 'privilege': user.privilege,
+                         'card': user.card, 'group_id': user.group_id, 'fingers': {}}
+                result['users'][str(user.user_id)] = entry
+                by_uid[user.uid] = entry
+            with progress_bus.job(f"Kiểm tra {device_name}", len(device_users)) as job:
+                for finger in iter_templates(zk):
+                    entry = by_uid.get(finger.uid)
+                    if entry is not None:
+                        entry['fingers'][finger.fid] = template_hash(finger.template)
+                    job.add_bytes(len(finger.template))
+                job.item_done(count=len(device_users))
+        except Exception as e:
+            logger.error(f"❌ Lỗi đọc dữ liệu {device_name}: {str(e)}")
+            self.device_sync.pool.invalidate(device_id)
+            result['error'] = str(e)
+        finally:
+            self.device_sync.disconnect_device(device_id)
+
+        result['seconds'] = round(time.perf_counter() - started, 2)
+        return result
+
+    def shadow_digests(self, device_config: Dict) -> Dict[str, Any]:
+        """Dữ liệu của thiết bị lấy từ shadow, cùng dạng với device_digests()"""
+        device_id = device_config.get('id', 1)
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_id}"))
+        serial = self.device_sync.metadata_cache.get_serial(device_config)
+        shadow = self.device_sync.shadow.get(serial)
+        if shadow is None or shadow.get('partial'):
+            return {'device_name': device_name, 'serial': serial, 'users': {},
+                    'seconds': 0.0, 'error': "Chưa có shadow, cần kiểm tra trực tiếp"}
+        users = {}
+        for user_id, entry in shadow['users'].items():
+            fingers = entry.get('fingers')
+            users[user_id] = dict(entry, fingers=None if fingers is None else
+                                  {int(fid): digest for fid, digest in fingers.items()})
+        return {'device_name': device_name, 'serial': serial, 'users': users, 'seconds': 0.0, 'error': None, 'updated_at': shadow.get('updated_at')}
+
+    @staticmethod
+    def shadow_entries(result: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Đổi users của device_digests() sang bản ghi shadow"""
+        return {user_id: dict(entry, fingers={str(fid): digest for fid, digest in entry['fingers'].items()})
+                for user_id, entry in result['users'].items()}
+
+    @staticmethod
+    def _finger_diff(expected: Dict[int, str], actual: Dict[int, str]) -> Optional[Dict[str, List[int]]]:
+        diff = {
+            'missing': sorted(set(expected) - set(actual)),
+            'extra': sorted(set(actual) - set(expected)),
+            'changed': sorted(fid for fid in set(expected) & set(actual) if expected[fid] != actual[fid])
+        }
+        return diff if any(diff.values()) else None
+
+    def compare_device(self, device_config: Dict, device: Dict[str, Any],
+                       local: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """So dữ liệu một thiết bị với dữ liệu local (theo quy tắc phân công của thiết bị)"""
+        targets = self.device_sync.assignment.compile(device_config)
+        expected = {user_id: item for user_id, item in local.items()
+                    if item['fingers'] and (targets is None or user_id in targets)}
+        actual = device['users']
+
+        report = {
+            'serial': device['serial'],
+            'error': device['error'],
+            'seconds': device['seconds'],
+            'users': len(actual),
+            'fingers': sum(len(item['fingers'] or {}) for item in actual.values()),
+            'missing': [],
+            'extra': [],
+            'fingers_differ': {},
+            'wrong_name': {},
+            'wrong_privilege': {}
+        }
+        if device['error']:
+            return report
+        report['missing'] = sorted(set(expected) - set(actual))
+        report['extra'] = sorted(set(actual) - set(expected))
+        for user_id in set(expected) & set(actual):
+            want, have = expected[user_id], actual[user_id]
+            # fingers None: shadow chưa biết vân tay của user này
+            diff = have['fingers'] is not None and self._finger_diff(want['fingers'], have['fingers'])
+            if diff:
+                report['fingers_differ'][user_id] = diff
+            if have['name'] != want['name']:
+                report['wrong_name'][user_id] = {'device': have['name'], 'expected': want['name']}
+            if have['privilege'] != want['privilege']:
+                report['wrong_privilege'][user_id] = {'device': have['privilege'], 'expected': want['privilege']}
+        return report
+
+    @staticmethod
+    def compare_devices(devices: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        So các thiết bị với nhau: user có mặt trên từ hai thiết bị trở lên nhưng
+        template khác nhau
+
+        Returns:
+            Dict user_id -> {tên thiết bị: {ngón: hash}}
+        """
+        presence: Dict[str, Dict[str, Dict[int, str]]] = {}
+        for device_name, device in devices.items():
+            for user_id, item in device['users'].items():
+                if item['fingers'] is not None:
+                    presence.setdefault(user_id, {})[device_name] = item['fingers']
+        return {
+            user_id: {device_name: {str(fid): digest for fid, digest in fingers.items()}
+                      for device_name, fingers in by_device.items()}
+            for user_id, by_device in presence.items()
+            if len(by_device) > 1 and len({tuple(sorted(f.items())) for f in by_device.values()}) > 1
+        }
+
+    def audit(self, devices: List[Dict], employees: Optional[List[Dict]] = None,
+              offline: bool = False) -> Dict[str, Any]:
+        """
+        Kiểm tra song song các thiết bị và lưu báo cáo sai lệch
+
+        Args:
+            devices: Danh sách cấu hình thiết bị
+            employees: Dữ liệu local (mặc định all_fingerprints.json)
+            offline: Kiểm tra trên shadow thay vì kết nối thiết bị
+
+        Returns:
+            Báo cáo gồm checked_at, offline, local_users, devices (theo tên thiết bị),
+            cross_device và summary
+        """
+        devices = [device for device in devices if device.get('enable', True)]
+        started = time.perf_counter()
+        local = self.local_digests(employees)
+
+        if offline:
+            results = [self.shadow_digests(device) for device in devices]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(devices) or 1))) as executor:
+                results = list(executor.map(self.device_digests, devices))
+            for device_config, result in zip(devices, results):
+                if not result['error']:
+                    self.device_sync.shadow.replace(result['serial'], device_config, self.shadow_entries(result), 'audit')
+            self.device_sync.shadow.flush()
+
+        device_reports = {}
+        for device_config, result in zip(devices, results):
+            device_reports[result['device_name']] = self.compare_device(device_config, result, local)
+            if result.get('updated_at'):
+                device_reports[result['device_name']]['shadow_updated_at'] = result['updated_at']
+        cross_device = self.compare_devices({result['device_name']: result for result in results
+                                             if not result['error']})
+
+        summary = {
+            'devices': len(devices),
+            'unreachable': sum(1 for report in device_reports.values() if report['error']),
+            'missing': sum(len(report['missing']) for report in device_reports.values()),
+            'extra': sum(len(report['extra']) for report in device_reports.values()),
+            'fingers_differ': sum(len(report['fingers_differ']) for report in device_reports.values()),
+            'wrong_name': sum(len(report['wrong_name']) for report in device_reports.values()),
+            'wrong_privilege': sum(len(report['wrong_privilege']) for report in device_reports.values()),
+            'cross_device': len(cross_device),
+            'seconds': round(time.perf_counter() - started, 2)
+        }
+        report = {
+            'checked_at': datetime.now().isoformat(timespec='seconds'),
+            'offline': offline,
+            'local_users': len(local),
+            'devices': device_reports,
+            'cross_device': cross_device,
+            'summary': summary
+        }
+        self._save(report)
+
+        drift = sum(value for key, value in summary.items() if key not in ('devices', 'seconds'))
+        if drift:
+            logger.warning(f"⚠️ Phát hiện sai lệch: thiếu {summary['missing']}, thừa {summary['extra']}, "
+                           f"khác vân tay {summary['fingers_differ']}, sai tên {summary['wrong_name']}, "
+                           f"sai quyền {summary['wrong_privilege']}, lệch giữa thiết bị {summary['cross_device']}, "
+                           f"không kết nối {summary['unreachable']}")
+        else:
+            logger.info(f"✅ {summary['devices']} thiết bị khớp dữ liệu local ({summary['seconds']}s)")
+        return report
+
+    def _save(self, report: Dict[str, Any]):
+        try:
+            os.makedirs(os.path.dirname(self.report_path) or ".", exist_ok=True)
+            with open(self.report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            logger.error(f"❌ Lỗi lưu báo cáo sai lệch: {str(e)}")
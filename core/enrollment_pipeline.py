@@ -0,0 +1,196 @@
+# enrollment_pipeline.py
+"""
+Module ghi xuyên khi đăng ký vân tay.
+Mỗi lần quét thành công được xử lý bất đồng bộ: lưu nhân viên đó vào file
+local, cập nhật vân tay của riêng nhân viên đó lên ERPNext và đẩy riêng user
+đó lên các máy chấm công được phân công qua hàng đợi ưu tiên. Trạng thái từng
+bước được báo lại theo từng ngón vừa quét.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Any
+from config import ENROLLMENT_PIPELINE_CONFIG, FINGER_MAPPING
+from core.priority_sync import PRIORITY_ENROLLMENT, PRIORITY_CHANGED
+
+logger = logging.getLogger(__name__)
+
+STEP_PENDING = 'pending'
+STEP_QUEUED = 'queued'
+STEP_OK = 'ok'
+STEP_FAILED = 'failed'
+STEP_SKIPPED = 'skipped'
+
+STEP_LABELS = {
+    STEP_PENDING: "đang chờ",
+    STEP_QUEUED: "đang đẩy",
+    STEP_OK: "xong",
+    STEP_FAILED: "lỗi",
+    STEP_SKIPPED: "bỏ qua"
+}
+
+
+def format_status(status: Dict[str, Any]) -> str:
+    """Một dòng mô tả trạng thái ghi xuyên của một ngón"""
+    devices = status['devices']
+    synced = sum(1 for state in devices.values() if state == STEP_OK)
+    text = (f"{status['employee']} - {status['finger_name']}: local {STEP_LABELS[status['local']]}, "
+            f"ERPNext {STEP_LABELS[status['erpnext']]}, máy chấm công {synced}/{len(devices)}")
+    if status['devices_note']:
+        text += f" ({status['devices_note']})"
+    if status['seconds'] is not None:
+        text += f" - {status['seconds']:.1f}s"
+    return text
+
+
+class EnrollmentPipeline:
+    """Lưu và đẩy ngay vân tay vừa quét, báo trạng thái theo từng ngón"""
+
+    def __init__(self, sync_scheduler, data_manager, erpnext_api,
+                 on_status: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Args:
+            sync_scheduler: SyncScheduler (danh sách thiết bị, hàng đợi ưu tiên, trạng thái đã đồng bộ)
+            data_manager: DataManager để ghi file local
+            erpnext_api: ERPNextAPI để cập nhật vân tay nhân viên
+            on_status: Callback nhận bản sao trạng thái mỗi khi một bước thay đổi
+        """
+        self.sync_scheduler = sync_scheduler
+        self.data_manager = data_manager
+        self.erpnext_api = erpnext_api
+        self.on_status = on_status
+        self.upload_erpnext = ENROLLMENT_PIPELINE_CONFIG.get('upload_erpnext', True)
+        self._executor = ThreadPoolExecutor(max_workers=ENROLLMENT_PIPELINE_CONFIG.get('workers', 2))
+        self._statuses: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        # Lưu local/ERPNext của cùng một nhân viên chạy tuần tự, bản sau không bị bản trước ghi đè
+        self._employee_locks: Dict[str, threading.Lock] = {}
+
+    def _employee_lock(self, employee_id: str) -> threading.Lock:
+        with self._lock:
+            return self._employee_locks.setdefault(employee_id, threading.Lock())
+
+    def _update(self, status: Dict[str, Any], **changes):
+        with self._lock:
+            for key, value in changes.items():
+                if key == 'devices':
+                    status['devices'].update(value)
+                else:
+                    status[key] = value
+            finished = (status['seconds'] is None and status['local'] != STEP_PENDING
+                        and status['erpnext'] != STEP_PENDING
+                        and all(state != STEP_QUEUED for state in status['devices'].values()))
+            if finished:
+                status['seconds'] = time.time() - status['started_at']
+            snapshot = dict(status, devices=dict(status['devices']))
+
+        if finished:
+            failed = STEP_FAILED in (snapshot['local'], snapshot['erpnext'], *snapshot['devices'].values())
+            (logger.warning if failed else logger.info)(f"⚡ {format_status(snapshot)}")
+        if self.on_status:
+            try:
+                self.on_status(snapshot)
+            except Exception as e:
+                logger.debug(f"Lỗi callback trạng thái ghi xuyên: {str(e)}")
+        if finished:
+            # Đã báo trạng thái cuối: bỏ khỏi danh sách để kiosk chạy lâu không giữ mãi từng ngón đã quét
+            with self._lock:
+                key = f"{status['employee']}:{status['finger_index']}"
+                if self._statuses.get(key) is status:
+                    del self._statuses[key]
+        return snapshot
+
+    def submit(self, employee: Dict, finger_index: int) -> Dict[str, Any]:
+        """
+        Nhận một ngón vừa quét thành công và xử lý bất đồng bộ
+
+        Args:
+            employee: Dữ liệu nhân viên kèm toàn bộ vân tay hiện có (đã gồm ngón vừa quét)
+            finger_index: Ngón vừa quét
+
+        Returns:
+            Trạng thái ban đầu của ngón (cập nhật dần qua on_status/status())
+        """
+        employee = dict(employee, fingerprints=[dict(fp) for fp in employee.get('fingerprints', [])
+                                                if isinstance(fp, dict) and fp.get('template_data')])
+        key = f"{employee['employee']}:{finger_index}"
+        status = {
+            'employee': employee['employee'],
+            'finger_index': finger_index,
+            'finger_name': FINGER_MAPPING.get(finger_index, f"Ngón {finger_index}"),
+            'local': STEP_PENDING,
+            'erpnext': STEP_PENDING,
+            'devices': {},
+            'devices_note': '',
+            'started_at': time.time(),
+            'seconds': None
+        }
+        with self._lock:
+            self._statuses[key] = status
+        self._executor.submit(self._run, employee, finger_index, status)
+        return dict(status, devices={})
+
+    def status(self, employee_id: str) -> List[Dict[str, Any]]:
+        """Trạng thái ghi xuyên các ngón đang xử lý của một nhân viên (ngón đã xong chỉ báo qua on_status)"""
+        with self._lock:
+            return [dict(status, devices=dict(status['devices'])) for status in self._statuses.values()
+                    if status['employee'] == employee_id]
+
+    def _run(self, employee: Dict, finger_index: int, status: Dict[str, Any]):
+        try:
+            with self._employee_lock(employee['employee']):
+                # 1. File local: chỉ nhân viên này
+                try:
+                    self.data_manager.save_employee_fingerprints(employee)
+                    self._update(status, local=STEP_OK)
+                except Exception as e:
+                    logger.error(f"❌ Lỗi lưu local vân tay của {employee['employee']}: {str(e)}")
+                    self._update(status, local=STEP_FAILED)
+
+                # 2. Máy chấm công: chỉ đưa user này vào hàng đợi ưu tiên (luồng đẩy của từng thiết bị
+                #    ghi sau), bước ERPNext bên dưới chạy tiếp ngay trong luồng này
+                self._push_devices(employee, finger_index, status)
+
+                # 3. ERPNext: chỉ nhân viên này
+                if not self.upload_erpnext or not self.erpnext_api or not employee.get('name'):
+                    self._update(status, erpnext=STEP_SKIPPED)
+                elif self.erpnext_api.update_employee_attendance(employee['name'], employee):
+                    self._update(status, erpnext=STEP_OK)
+                else:
+                    self._update(status, erpnext=STEP_FAILED)
+        except Exception as e:
+            logger.error(f"❌ Lỗi ghi xuyên vân tay của {employee['employee']}: {str(e)}")
+            self._update(status, erpnext=STEP_FAILED if status['erpnext'] == STEP_PENDING else status['erpnext'])
+
+    def _push_devices(self, employee: Dict, finger_index: int, status: Dict[str, Any]):
+        if not employee.get('attendance_device_id'):
+            self._update(status, devices_note="chưa có ID máy chấm công, cần lưu để gán ID")
+            return
+
+        def device_name(device: Dict) -> str:
+            return device.get('device_name', device.get('name', f"Device_{device.get('id', 1)}"))
+
+        def on_synced(device: Dict, _employee: Dict):
+            self._update(status, devices={device_name(device): STEP_OK})
+
+        def on_failed(device: Dict, _employee: Dict):
+            self._update(status, devices={device_name(device): STEP_FAILED})
+
+        other_fingers = [fp for fp in employee['fingerprints'] if fp.get('finger_index') != finger_index]
+        priority = PRIORITY_CHANGED if other_fingers else PRIORITY_ENROLLMENT
+        # Đánh dấu đang đẩy trước khi đưa vào hàng đợi để callback không đến trước trạng thái
+        devices = [device for device in self.sync_scheduler.devices_provider() if device.get('enable', True)]
+        assigned = [device for device in devices
+                    if self.sync_scheduler.device_sync.assignment.filter_employees(device, [employee])]
+        self._update(status, devices={device_name(device): STEP_QUEUED for device in assigned},
+                     devices_note='' if assigned else "không có thiết bị được phân công")
+        queued = self.sync_scheduler.prioritize(employee, priority, on_synced=on_synced, on_failed=on_failed)
+        missing = {device_name(device) for device in assigned} - {device_name(device) for device in queued}
+        if missing:
+            self._update(status, devices={name: STEP_FAILED for name in missing})
+
+    def shutdown(self):
+        """Dừng nhận việc mới, chờ các bước lưu đang chạy"""
+        self._executor.shutdown(wait=True)
@@ -220,6 +220,37 @@ class ERPNextAPI:
             logger.error(f"❌ Lỗi khi cập nhật vân tay cho {employee_name}: {str(e)}")
             return False
     
+    def create_employee_checkins(self, checkins: List[Dict[str, Any]]) -> bool:
+        """
+        Tạo nhiều Employee Checkin trong một request (frappe.client.insert_many)
+        
+        Args:
+            checkins: Danh sách checkin, mỗi phần tử gồm employee, time,
+                      device_id và log_type (tùy chọn)
+            
+        Returns:
+            True nếu tạo thành công toàn bộ lô
+        """
+        if not checkins:
+            return True
+        try:
+            docs = [dict(checkin, doctype="Employee Checkin") for checkin in checkins]
+            response = self.session.post(
+                f"{self.base_url}/api/method/frappe.client.insert_many",
+                json={"docs": docs}
+            )
+            
+            if response.status_code == 200:
+                logger.info(f"✅ Đã tạo {len(docs)} Employee Checkin")
+                return True
+            else:
+                logger.error(f"❌ Lỗi tạo Employee Checkin: {response.status_code} - {response.text}")
+                return False
+                
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi tạo Employee Checkin: {str(e)}")
+            return False
+    
     def log_sync_history(self, sync_type: str, device_name: str, 
                         employee_count: int, status: str, message: str = "") -> bool:
         """
@@ -0,0 +1,542 @@
+# fingerprint_pull.py
+"""
+Module tải vân tay từ máy chấm công về dữ liệu local.
+Dùng chung cho giao diện và dòng lệnh (không phụ thuộc Tk).
+
+Bộ nhớ: buffer template của thiết bị được đọc theo luồng (template_stream) và
+mỗi user được ghi ngay vào file tạm chỉ ghi nối (pull_staging) khi tách xong, nên
+trong lúc tải chỉ giữ hash vân tay của từng user. Bước merge đọc lại lần lượt
+từng nhân viên từ file tạm vào all_fingerprints.json (file JSON duy nhất được
+ghi lại toàn bộ, nên chỉ bước này giữ dữ liệu cỡ bằng file local).
+"""
+
+import os
+import json
+import base64
+import logging
+import time
+import concurrent.futures
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Set, Tuple
+from config import FINGER_MAPPING, DATA_PATHS, FINGERPRINT_PULL_CONFIG
+from core.template_stream import iter_user_templates, iter_user_fingers
+from core.progress import progress_bus
+from core.device_shadow import user_entry, employee_fingers, template_hash
+from core.pull_staging import PullStaging, PullStagingWriter
+from core.data_manager import _fingerprints_lock
+
+logger = logging.getLogger(__name__)
+
+
+class FingerprintPuller:
+    """Tải vân tay từ máy chấm công và merge vào all_fingerprints.json"""
+
+    def __init__(self, device_sync, data_manager):
+        self.device_sync = device_sync
+        self.data_manager = data_manager
+        self.device_stats: List[Dict] = []
+
+    def prepare_employee_mapping(self) -> Tuple[List[Dict], Dict[str, Dict]]:
+        """Chuẩn bị mapping employees và attendance_device_id"""
+        employees_to_load = []
+        attendance_device_mapping = {}
+
+        if not os.path.exists("data/employees.json"):
+            logger.warning("⚠️ Không tìm thấy file employees.json")
+            return employees_to_load, attendance_device_mapping
+
+        all_employees = self.data_manager.load_employees_from_local()
+
+        # Lọc nhân viên có attendance_device_id hợp lệ
+        for emp in all_employees:
+            attendance_id = emp.get('attendance_device_id')
+            if attendance_id and str(attendance_id).strip() and attendance_id != "0":
+                try:
+                    attendance_id_int = int(attendance_id)
+                    if attendance_id_int > 0:
+                        employees_to_load.append(emp)
+                        attendance_device_mapping[attendance_id] = emp
+                except ValueError:
+                    continue
+
+        logger.info(f"📋 Sẽ load vân tay cho {len(employees_to_load)} nhân viên có attendance_device_id hợp lệ")
+        return employees_to_load, attendance_device_mapping
+
+    def pull_from_devices(self, devices: List[Dict],
+                          attendance_device_mapping: Dict[str, Dict]) -> Tuple[PullStaging, int]:
+        """
+        Tải vân tay của các nhân viên cần load từ danh sách thiết bị (song song mỗi thiết bị
+        một luồng), sau đó merge kết quả theo merge_rule. Mỗi user được ghi ngay vào file
+        tạm (PullStaging) khi tách xong template, không giữ template trong bộ nhớ.
+
+        Returns:
+            Tuple (PullStaging: employee -> dữ liệu vân tay đã chọn, bên gọi close() sau khi dùng,
+            số nhân viên có vân tay)
+        """
+        self.device_stats = []
+        staging = PullStaging()
+        if not devices:
+            return staging, 0
+
+        max_workers = max(1, min(len(devices), FINGERPRINT_PULL_CONFIG.get('max_workers', 8)))
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map giữ thứ tự thiết bị để merge ổn định khi hòa
+            results = list(executor.map(
+                lambda item: self._pull_device(item[1], attendance_device_mapping, staging.writer(item[0])),
+                enumerate(devices)))
+        elapsed = time.perf_counter() - started
+        self.device_sync.shadow.flush()
+
+        self.device_stats = [
+            {key: result[key] for key in ('device_name', 'users', 'templates', 'seconds', 'error')}
+            for result in results
+        ]
+        selected = self.merge_device_results(results)
+        staging.select(selected)
+        total_loaded = len([employee_id for employee_id, source in selected.items()
+                            if results[source]['fingers'].get(employee_id)])
+        logger.info(f"⏱️ Đã tải từ {len(devices)} thiết bị trong {elapsed:.1f}s, {total_loaded} nhân viên có vân tay")
+        return staging, total_loaded
+
+    def _pull_device(self, device: Dict, attendance_device_mapping: Dict[str, Dict], sink: PullStagingWriter) -> Dict:
+        """Tải vân tay từ một thiết bị vào sink, trả về thống kê của thiết bị kèm hash vân tay từng nhân viên"""
+        device_name = device.get('device_name', device.get('name', f"Device_{device.get('id', 1)}"))
+        result = {'device_name': device_name, 'source': sink.source, 'fingers': {}, 'users': 0, 'templates': 0,
+                  'seconds': 0.0, 'error': None}
+        started = time.perf_counter()
+        logger.info(f"🔄 Đang kết nối với {device_name}...")
+
+        # Kết nối thiết bị
+        zk = self.device_sync.connect_device(device)
+        if not zk:
+            logger.error(f"❌ Không thể kết nối đến {device_name}")
+            result['error'] = "Không thể kết nối"
+            return result
+
+        try:
+            # Lấy users và map với attendance_device_id
+            device_users = zk.get_users()
+            target_users = [user for user in device_users if user.user_id in attendance_device_mapping]
+            result['users'] = len(target_users)
+
+            logger.info(f"🎯 Sẽ load vân tay cho {len(target_users)} users từ {device_name}")
+
+            # Load fingerprints với strategy tối ưu
+            complete_uids = set()
+            with progress_bus.job(f"Tải vân tay {device_name}", len(target_users)) as job:
+                self.load_fingerprints_optimized(
+                    zk, target_users, attendance_device_mapping, device_name, sink, job, complete_uids
+                )
+            result['fingers'] = sink.fingers
+            result['templates'] = sum(len(fingers) for fingers in result['fingers'].values())
+            self._update_shadow(device, device_users, attendance_device_mapping, result['fingers'], complete_uids)
+
+        except Exception as device_err:
+            logger.error(f"❌ Lỗi khi load dữ liệu từ {device_name}: {str(device_err)}")
+            result['error'] = str(device_err)
+            result['fingers'] = {}
+            sink.reset()
+        finally:
+            # Trả kết nối về pool
+            self.device_sync.disconnect_device(device.get('id', 1))
+
+        result['seconds'] = time.perf_counter() - started
+        rate = result['templates'] / result['seconds'] if result['seconds'] > 0 else 0
+        logger.info(f"⏱️ [{device_name}] {result['templates']} vân tay / {result['users']} users "
+                    f"trong {result['seconds']:.1f}s ({rate:.0f} vân tay/s)")
+        return result
+
+    def _update_shadow(self, device: Dict, device_users: List, attendance_device_mapping: Dict[str, Dict],
+                       fingers: Dict[str, Dict[int, str]], complete_uids: Set[int]):
+        """
+        Ghi danh sách users và hash vân tay vừa tải vào shadow của thiết bị. Chỉ users
+        đã đọc đủ vân tay (complete_uids) được ghi hash; users khác (không cần tải, tải
+        lỗi hoặc dở dang) giữ hash đã biết trong shadow
+        """
+        entries = {}
+        for user in device_users:
+            entry = user_entry(user.uid, user.name, user.privilege, None, user.card, user.group_id)
+            if user.user_id in attendance_device_mapping and int(user.uid) in complete_uids:
+                employee_id = attendance_device_mapping[user.user_id]['employee']
+                entry['fingers'] = {str(fid): digest for fid, digest in fingers.get(employee_id, {}).items()}
+            entries[str(user.user_id)] = entry
+        self.device_sync.shadow.replace(self.device_sync.pool.get_device_info(device.get('id', 1)).get('serial'),
+                                        device, entries, 'pull')
+
+    @staticmethod
+    def _fingerprint_signature(employee_data: Dict) -> frozenset:
+        """Tập (ngón, hash template) để so sánh dữ liệu vân tay local với dữ liệu tải về"""
+        return frozenset((fid, template_hash(template)) for fid, template in employee_fingers(employee_data).items())
+
+    def merge_device_results(self, results: List[Dict]) -> Dict[str, int]:
+        """
+        Chọn thiết bị nguồn cho từng nhân viên theo merge_rule (so sánh bằng hash vân tay)
+
+        - most_fingers: giữ bản của thiết bị có nhiều vân tay nhất
+        - newest: ưu tiên bản khác với dữ liệu local (vân tay vừa đăng ký/sửa trên thiết bị),
+          trong số đó giữ bản nhiều vân tay nhất
+
+        Khi hòa, thiết bị đứng trước trong danh sách được giữ.
+
+        Returns:
+            Dict employee -> source của thiết bị được chọn
+        """
+        merge_rule = FINGERPRINT_PULL_CONFIG.get('merge_rule', 'most_fingers')
+        local_signatures = {}
+        if merge_rule == 'newest':
+            local_signatures = {employee_id: self._fingerprint_signature(employee_data)
+                                for employee_id, employee_data in self.data_manager.load_local_fingerprints().items()}
+
+        def rank(employee_id: str, signature: frozenset) -> Tuple[int, int]:
+            if merge_rule == 'newest':
+                changed = local_signatures.get(employee_id) != signature
+                return int(changed), len(signature)
+            return 0, len(signature)
+
+        selected: Dict[str, int] = {}
+        signatures: Dict[str, frozenset] = {}
+        ranks: Dict[str, Tuple[int, int]] = {}
+        sources: Dict[str, str] = {}
+        conflicts = 0
+        for result in results:
+            for employee_id, fingers in result['fingers'].items():
+                signature = frozenset(fingers.items())
+                current_rank = rank(employee_id, signature)
+                if employee_id not in selected:
+                    selected[employee_id] = result['source']
+                    signatures[employee_id] = signature
+                    ranks[employee_id] = current_rank
+                    sources[employee_id] = result['device_name']
+                    continue
+                if signatures[employee_id] == signature:
+                    continue
+                conflicts += 1
+                if current_rank > ranks[employee_id]:
+                    logger.info(f"🔀 {employee_id}: dùng dữ liệu từ {result['device_name']} "
+                                f"thay cho {sources[employee_id]} ({merge_rule})")
+                    selected[employee_id] = result['source']
+                    signatures[employee_id] = signature
+                    ranks[employee_id] = current_rank
+                    sources[employee_id] = result['device_name']
+
+        if conflicts:
+            logger.info(f"🔀 {conflicts} nhân viên có vân tay khác nhau giữa các thiết bị, đã chọn theo {merge_rule}")
+        return selected
+
+    def load_fingerprints_optimized(self, zk, target_users, attendance_device_mapping, device_name, sink,
+                                    job=None, complete_uids: Optional[Set[int]] = None) -> int:
+        """
+        Load fingerprints với strategy tối ưu - Hybrid approach. Mỗi user được ghi vào sink
+        (PullStagingWriter) ngay khi xử lý xong.
+
+        Args:
+            sink: Nơi ghi dữ liệu vân tay từng nhân viên (add/reset)
+            complete_uids: Nếu có, được thêm uid của các user đã đọc đủ vân tay
+
+        Returns:
+            Số user đã ghi vào sink
+        """
+        if complete_uids is None:
+            complete_uids = set()
+
+        try:
+            # === STRATEGY 1: Đọc buffer template theo luồng, chỉ giữ target users ===
+            logger.info(f"🚀 [{device_name}] Thử load toàn bộ templates (Strategy 1)...")
+
+            users_by_uid = {int(user.uid): user for user in target_users}
+            seen_uids = set()
+            processed_count = 0
+            template_count = 0
+            for uid, templates in iter_user_templates(zk, users_by_uid.keys()):
+                user = users_by_uid[uid]
+                employee_info = attendance_device_mapping[user.user_id]
+                template_count += len(templates)
+                seen_uids.add(uid)
+
+                user_result = {}
+                fingerprint_count = self.process_user_templates(templates, employee_info, user_result)
+                sink.add(user_result[employee_info['employee']])
+                if job:
+                    job.item_done(employee_info['employee'], sum(len(t.template) for t in templates))
+                if fingerprint_count > 0:
+                    processed_count += 1
+                    logger.info(f"   ✅ [{processed_count}/{len(target_users)}] {employee_info['employee']} - {fingerprint_count} vân tay")
+                else:
+                    logger.warning(f"   ⚠️ [{processed_count + 1}/{len(target_users)}] {employee_info['employee']} - Không có vân tay")
+
+            for uid, user in users_by_uid.items():
+                if uid not in seen_uids:
+                    logger.warning(f"   ❌ User {user.user_id} (UID: {uid}) không có templates")
+
+            # Đã đọc hết bảng template: user không có template là không có vân tay
+            complete_uids.update(users_by_uid)
+            logger.info(f"✅ [{device_name}] Strategy 1 thành công - {template_count} templates, Processed {processed_count} users")
+            return len(seen_uids)
+
+        except Exception as bulk_error:
+            logger.warning(f"⚠️ [{device_name}] Strategy 1 failed: {str(bulk_error)}")
+            # Bỏ phần đã ghi dở của Strategy 1 trước khi tải lại từng user
+            sink.reset()
+
+            # === STRATEGY 2: Fallback to individual loading ===
+            logger.info(f"🔄 [{device_name}] Fallback to Strategy 2 (individual loading)...")
+
+            try:
+                if job:
+                    job.start(message="Strategy 2")
+                return self.load_fingerprints_individual(zk, target_users, attendance_device_mapping, device_name,
+                                                         sink, job, complete_uids)
+            except Exception as fallback_error:
+                logger.error(f"❌ [{device_name}] Strategy 2 cũng failed: {str(fallback_error)}")
+                sink.reset()
+                complete_uids.clear()
+                return 0
+
+    def process_user_templates(self, templates, employee_info, fingerprints_result) -> int:
+        """Process templates của 1 user"""
+        employee_id = employee_info['employee']
+
+        # Khởi tạo cấu trúc dữ liệu cho nhân viên
+        if employee_id not in fingerprints_result:
+            fingerprints_result[employee_id] = {
+                'name': employee_info.get('name', ''),
+                'employee': employee_id,
+                'employee_name': employee_info['employee_name'],
+                'attendance_device_id': employee_info.get('attendance_device_id', ''),
+                'password': '',  # Sẽ được set từ user data
+                'privilege': 0,  # Sẽ được set từ user data
+                'fingerprints': []
+            }
+
+        fingerprint_count = 0
+
+        # Process từng template
+        for template in templates:
+            try:
+                if hasattr(template, 'template') and template.template:
+                    finger_idx = template.fid  # finger ID
+
+                    # Validate finger index
+                    if 0 <= finger_idx <= 9:
+                        fingerprints_result[employee_id]['fingerprints'].append({
+                            'finger_index': finger_idx,
+                            'finger_name': FINGER_MAPPING.get(finger_idx, f"Ngón {finger_idx}"),
+                            'template_data': base64.b64encode(template.template).decode('utf-8'),
+                            'quality_score': 70
+                        })
+                        fingerprint_count += 1
+
+            except Exception as template_error:
+                logger.warning(f"   ⚠️ Lỗi xử lý template finger {template.fid}: {str(template_error)}")
+                continue
+
+        return fingerprint_count
+
+    def load_fingerprints_individual(self, zk, target_users, attendance_device_mapping, device_name, sink,
+                                     job=None, complete_uids: Optional[Set[int]] = None) -> int:
+        """
+        Fallback strategy: lấy template từng user trên một luồng duy nhất sở hữu kết nối,
+        dò đủ 10 ngón theo pipeline (iter_user_fingers). User còn ngón không nhận được phản
+        hồi rõ ràng bị bỏ qua (giữ dữ liệu local, không thêm vào complete_uids).
+        Mỗi user được ghi vào sink ngay khi đọc xong; trả về số user đã ghi.
+        """
+        written = 0
+        users_by_uid = {int(user.uid): user for user in target_users}
+        window = FINGERPRINT_PULL_CONFIG.get('pipeline_window', 20)
+
+        logger.info(f"🔄 [{device_name}] Lấy template từng user: {len(users_by_uid)} users, "
+                    f"{len(users_by_uid) * 10} lượt hỏi, pipeline {window} lệnh")
+
+        for i, (uid, templates, complete) in enumerate(iter_user_fingers(zk, users_by_uid, window), 1):
+            user = users_by_uid[uid]
+            employee_info = attendance_device_mapping[user.user_id]
+            employee_id = employee_info['employee']
+
+            if not complete:
+                logger.warning(f"   ⚠️ [{i}/{len(users_by_uid)}] {employee_id}: thiết bị không phản hồi đủ các ngón, bỏ qua")
+                if job:
+                    job.item_done(employee_id)
+                continue
+
+            # Khởi tạo data structure
+            employee_data = {
+                'name': employee_info.get('name', ''),
+                'employee': employee_id,
+                'employee_name': employee_info['employee_name'],
+                'attendance_device_id': str(user.user_id),
+                'password': user.password or '',
+                'privilege': user.privilege or 0,
+                'fingerprints': []
+            }
+
+            for template in sorted(templates, key=lambda t: t.fid):
+                employee_data['fingerprints'].append({
+                    'finger_index': template.fid,
+                    'finger_name': FINGER_MAPPING.get(template.fid, f"Ngón {template.fid}"),
+                    'template_data': base64.b64encode(template.template).decode('utf-8'),
+                    'quality_score': 70
+                })
+
+            sink.add(employee_data)
+            written += 1
+            if complete_uids is not None:
+                complete_uids.add(uid)
+            if job:
+                job.item_done(employee_id, sum(len(t.template) for t in templates))
+            if templates:
+                logger.info(f"   ✅ [{i}/{len(users_by_uid)}] Loaded {len(templates)} fingerprints for {employee_id}")
+            else:
+                logger.warning(f"   ⚠️ [{i}/{len(users_by_uid)}] No fingerprints found for {employee_id}")
+
+        return written
+
+    def save_and_merge(self, fingerprints_from_device: Mapping) -> int:
+        """
+        Merge dữ liệu tải từ máy chấm công vào all_fingerprints.json
+        (lưu thêm all_fingerprints_from_machine.json nếu bật save_machine_snapshot)
+
+        Args:
+            fingerprints_from_device: employee -> dữ liệu vân tay (dict hoặc PullStaging,
+                được đọc lần lượt từng nhân viên)
+
+        Returns:
+            Số lượng nhân viên sau khi merge
+        """
+        if FINGERPRINT_PULL_CONFIG.get('save_machine_snapshot', False):
+            os.makedirs("data", exist_ok=True)
+
+            # Ghi từng nhân viên thành một phần tử của mảng JSON, không dựng cả danh sách trong bộ nhớ
+            with open("data/all_fingerprints_from_machine.json", 'w', encoding='utf-8') as f:
+                f.write('[')
+                for index, employee_data in enumerate(fingerprints_from_device.values()):
+                    f.write(',\n' if index else '\n')
+                    json.dump(employee_data, f, ensure_ascii=False)
+                f.write('\n]\n')
+
+            logger.info(f"✅ Đã lưu {len(fingerprints_from_device)} nhân viên vào all_fingerprints_from_machine.json")
+
+        # Merge dữ liệu với employees.json vào all_fingerprints.json
+        return self.merge_fingerprints_data(fingerprints_from_device)
+
+    def merge_fingerprints_data(self, fingerprints_from_machine: Mapping) -> int:
+        """
+        Merge dữ liệu từ máy chấm công với employees.json vào all_fingerprints.json.
+        Đọc - merge - ghi trong cùng _fingerprints_lock với save_employee_fingerprints
+        (EnrollmentPipeline) và ghi file qua save_local_fingerprints (file tạm + os.replace)
+
+        Args:
+            fingerprints_from_machine: Dict dữ liệu vân tay từ máy chấm công
+
+        Returns:
+            int: Số lượng nhân viên sau khi merge
+        """
+        try:
+            # Load employees data
+            employees = self.data_manager.load_employees_from_local()
+            if employees:
+                logger.info(f"✅ Đã load {len(employees)} nhân viên từ employees.json")
+            else:
+                logger.warning("⚠️ Không tìm thấy file employees.json")
+
+            # Create dictionary of employees by ID for quick lookup
+            employees_dict = {emp.get('employee'): emp for emp in employees}
+
+            with _fingerprints_lock:
+                # Load existing fingerprints data (if any)
+                current_fingerprints = []
+                if os.path.exists(DATA_PATHS["fingerprints"]):
+                    with open(DATA_PATHS["fingerprints"], 'r', encoding='utf-8') as f:
+                        current_fingerprints = json.load(f)
+                    logger.info(f"✅ Đã load {len(current_fingerprints)} nhân viên từ all_fingerprints.json")
+
+                # First, add all current fingerprints to the merged data
+                merged_fingerprints = {}
+                for fp in current_fingerprints:
+                    employee_id = fp.get('employee')
+                    if employee_id:
+                        merged_fingerprints[employee_id] = fp
+
+                # Next, process fingerprints from machine and merge
+                for employee_id, fp_machine in fingerprints_from_machine.items():
+                    self._merge_employee(merged_fingerprints, employees_dict, employee_id, fp_machine)
+
+                self.data_manager.save_local_fingerprints(merged_fingerprints)
+
+            logger.info(f"✅ Đã merge và lưu {len(merged_fingerprints)} nhân viên vào all_fingerprints.json")
+            return len(merged_fingerprints)
+
+        except Exception as e:
+            logger.error(f"❌ Lỗi merge dữ liệu: {str(e)}")
+            raise e
+
+    @staticmethod
+    def _merge_employee(merged_fingerprints: Dict[str, Dict], employees_dict: Dict[str, Dict],
+                        employee_id: str, fp_machine: Dict):
+        """Merge vân tay của một nhân viên tải từ máy chấm công vào dữ liệu local"""
+        device_id = fp_machine.get('attendance_device_id')
+
+        # Skip if no employee ID or device ID
+        if not employee_id or not device_id:
+            return
+
+        # If employee exists in our records
+        if employee_id in employees_dict:
+            emp_data = employees_dict[employee_id]
+
+            # If we already have fingerprint data for this employee
+            if employee_id in merged_fingerprints:
+                existing_fp = merged_fingerprints[employee_id]
+
+                # Update the consistent fields
+                existing_fp['attendance_device_id'] = device_id
+                existing_fp['name'] = emp_data.get('name', '')
+                existing_fp['employee_name'] = emp_data.get('employee_name', '')
+
+                # Merge fingerprints arrays - replace with new data from machine
+                existing_fp['fingerprints'] = fp_machine.get('fingerprints', [])
+
+                # Update password and privilege if they exist in the machine data
+                if 'password' in fp_machine:
+                    existing_fp['password'] = fp_machine['password']
+                if 'privilege' in fp_machine:
+                    existing_fp['privilege'] = fp_machine['privilege']
+
+                logger.info(f"🔄 Updated existing fingerprint data for {employee_id}")
+
+            else:
+                # Create new entry using machine data but ensure consistent fields
+                new_fp = fp_machine.copy()
+                new_fp['employee'] = employee_id
+                new_fp['name'] = emp_data.get('name', '')
+                new_fp['employee_name'] = emp_data.get('employee_name', '')
+                new_fp['attendance_device_id'] = device_id
+
+                merged_fingerprints[employee_id] = new_fp
+                logger.info(f"➕ Added new fingerprint data for {employee_id}")
+        else:
+            # Employee not in our records - just add the machine data as is
+            merged_fingerprints[employee_id] = fp_machine
+            logger.warning(f"⚠️ Employee {employee_id} not found in employees.json, added anyway")
+
+    def pull(self, devices: List[Dict]) -> Optional[Dict[str, int]]:
+        """
+        Tải vân tay từ các thiết bị, lưu và merge vào dữ liệu local
+
+        Returns:
+            Dict thống kê (total_employees, total_loaded, merged_count, devices),
+            None nếu không có nhân viên nào để load
+        """
+        employees_to_load, attendance_device_mapping = self.prepare_employee_mapping()
+        if not employees_to_load:
+            return None
+
+        staging, total_loaded = self.pull_from_devices(devices, attendance_device_mapping)
+        with staging:
+            merged_count = self.save_and_merge(staging)
+        return {
+            'total_employees': len(employees_to_load),
+            'total_loaded': total_loaded,
+            'merged_count': merged_count,
+            'devices': self.device_stats
+        }
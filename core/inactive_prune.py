@@ -0,0 +1,155 @@
+# inactive_prune.py
+"""
+Module dọn nhân viên đã nghỉ khỏi máy chấm công.
+So users trên từng thiết bị (lấy từ shadow, không kết nối) với danh sách
+nhân viên Active trong employees.json; chế độ xem trước chỉ liệt kê, chế độ
+xóa mở một phiên ghi cho mỗi thiết bị, kiểm tra lại với users thực tế rồi xóa
+hàng loạt và chỉ làm mới dữ liệu thiết bị một lần. Các thiết bị chạy song song.
+"""
+
+import logging
+import concurrent.futures
+from struct import pack
+from typing import Dict, List, Optional, Set, Any
+from zk import const
+from config import INACTIVE_PRUNE_CONFIG
+from core.data_manager import DataManager
+
+logger = logging.getLogger(__name__)
+
+
+class InactivePruner:
+    """Tìm và xóa users không còn trong danh sách nhân viên Active"""
+
+    def __init__(self, device_sync):
+        """
+        Args:
+            device_sync: AttendanceDeviceSync (pool kết nối, shadow thiết bị)
+        """
+        self.device_sync = device_sync
+        self.max_workers = INACTIVE_PRUNE_CONFIG.get('max_workers', 8)
+        self.protect_admins = INACTIVE_PRUNE_CONFIG.get('protect_admins', True)
+        self.keep_user_ids = {str(user_id) for user_id in INACTIVE_PRUNE_CONFIG.get('keep_user_ids', [])}
+        self.max_ratio = INACTIVE_PRUNE_CONFIG.get('max_ratio', 0.5)
+
+    @staticmethod
+    def active_ids(employees: Optional[List[Dict]] = None) -> Set[str]:
+        """attendance_device_id của nhân viên Active (employees.json chỉ chứa nhân viên Active)"""
+        if employees is None:
+            employees = DataManager().load_employees_from_local()
+        return {str(emp.get('attendance_device_id')).strip() for emp in employees
+                if emp.get('attendance_device_id') and emp.get('status', 'Active') == 'Active'}
+
+    def _orphans(self, users: List[Dict], active: Set[str]) -> List[Dict]:
+        return [{'user_id': str(user['user_id']), 'uid': user['uid'], 'name': user['name']}
+                for user in users
+                if str(user['user_id']).strip() not in active
+                and str(user['user_id']) not in self.keep_user_ids
+                and not (self.protect_admins and user['privilege'] == const.USER_ADMIN)]
+
+    def _device_users(self, device_config: Dict, refresh: bool) -> Optional[List[Dict]]:
+        """Users của thiết bị theo shadow; đọc lại thiết bị nếu chưa có shadow hoặc refresh"""
+        serial = self.device_sync.metadata_cache.get_serial(device_config)
+        users = None if refresh else self.device_sync.shadow.device_users(serial)
+        if users is None and self.device_sync.refresh_shadow(device_config):
+            users = self.device_sync.shadow.device_users(self.device_sync.metadata_cache.get_serial(device_config))
+        return users
+
+    def prune_device(self, device_config: Dict, active: Set[str], dry_run: bool = True,
+                     refresh: bool = False, force: bool = False) -> Dict[str, Any]:
+        """
+        Xem trước hoặc xóa users đã nghỉ trên một thiết bị
+
+        Args:
+            device_config: Cấu hình thiết bị
+            active: attendance_device_id của nhân viên Active
+            dry_run: Chỉ liệt kê, không xóa
+            refresh: Đọc lại thiết bị thay vì dùng shadow
+            force: Bỏ qua giới hạn max_ratio
+
+        Returns:
+            Dict gồm device_name, users, orphans (user_id, uid, name), removed, error
+        """
+        device_id = device_config.get('id', 1)
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_id}"))
+        result = {'device_name': device_name, 'users': 0, 'orphans': [], 'removed': 0, 'error': None}
+
+        users = self._device_users(device_config, refresh)
+        if users is None:
+            result['error'] = "Không đọc được users của thiết bị"
+            return result
+        result['users'] = len(users)
+        result['orphans'] = self._orphans(users, active)
+        if dry_run or not result['orphans']:
+            return result
+
+        zk = self.device_sync.connect_device(device_config)
+        if not zk:
+            result['error'] = "Không kết nối được"
+            return result
+
+        removed = []
+        try:
+            with self.device_sync.pool.write_batch(device_id):
+                # Shadow có thể cũ: xác định lại danh sách cần xóa theo users thực tế
+                live_users = [{'user_id': user.user_id, 'uid': user.uid, 'name': user.name, 'privilege': user.privilege}
+                              for user in zk.get_users()]
+                result['users'] = len(live_users)
+                result['orphans'] = self._orphans(live_users, active)
+                if not force and live_users and len(result['orphans']) > self.max_ratio * len(live_users):
+                    result['error'] = (f"{len(result['orphans'])}/{len(live_users)} users không có trong danh sách "
+                                       f"nhân viên, vượt giới hạn {self.max_ratio:.0%}")
+                    logger.warning(f"⚠️ {device_name}: {result['error']}, không xóa (dùng force để bỏ qua)")
+                    return result
+                for orphan in result['orphans']:
+                    # Gửi lệnh xóa trực tiếp, làm mới dữ liệu một lần sau cả lô thay vì sau từng user
+                    cmd_response = zk._ZK__send_command(const.CMD_DELETE_USER, pack('h', orphan['uid']))
+                    if cmd_response.get('status'):
+                        removed.append(orphan['user_id'])
+                    else:
+                        logger.warning(f"⚠️ {device_name}: không xóa được user {orphan['user_id']}")
+                if removed:
+                    zk.refresh_data()
+        except Exception as e:
+            logger.error(f"❌ Lỗi dọn nhân viên đã nghỉ trên {device_name}: {str(e)}")
+            self.device_sync.pool.invalidate(device_id)
+            result['error'] = str(e)
+        finally:
+            self.device_sync.shadow.update_users(self.device_sync.pool.get_device_info(device_id).get('serial'),
+                                                 device_config, 'prune', removed=removed)
+            self.device_sync.disconnect_device(device_id)
+        self.device_sync.forget_removed_users(device_config, removed)
+
+        result['removed'] = len(removed)
+        if removed:
+            logger.info(f"🧹 Đã xóa {len(removed)} nhân viên đã nghỉ khỏi {device_name}")
+        return result
+
+    def prune(self, devices: List[Dict], employees: Optional[List[Dict]] = None, dry_run: bool = True,
+              refresh: bool = False, force: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Xem trước hoặc xóa users đã nghỉ trên các thiết bị (song song)
+
+        Returns:
+            Dict tên thiết bị -> kết quả prune_device()
+        """
+        active = self.active_ids(employees)
+        if not active:
+            logger.error("❌ Danh sách nhân viên Active trống, không dọn thiết bị")
+            return {}
+        devices = [device for device in devices if device.get('enable', True)]
+        if not devices:
+            return {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(devices)))) as executor:
+            results = list(executor.map(
+                lambda device: self.prune_device(device, active, dry_run, refresh, force), devices))
+        self.device_sync.shadow.flush()
+
+        orphans = sum(len(result['orphans']) for result in results)
+        if dry_run:
+            logger.info(f"🔍 Xem trước: {orphans} users không còn trong danh sách nhân viên trên {len(results)} thiết bị")
+        else:
+            logger.info(f"✅ Đã xóa {sum(result['removed'] for result in results)}/{orphans} users "
+                        f"đã nghỉ trên {len(results)} thiết bị")
+        return {result['device_name']: result for result in results}
@@ -0,0 +1,145 @@
+# priority_sync.py
+"""
+Module hàng đợi ưu tiên đồng bộ nhân viên đến máy chấm công.
+Nhân viên vừa đăng ký hoặc vừa đổi vân tay được đưa vào hàng đợi của từng
+thiết bị được phân công; lô đồng bộ đang chạy lấy các nhân viên này ra trước
+nhân viên kế tiếp của lô, nếu thiết bị rảnh thì một luồng riêng đẩy ngay.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Any
+from core.data_manager import employee_fingerprint_digest
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_ENROLLMENT = 0  # Nhân viên mới đăng ký vân tay
+PRIORITY_CHANGED = 1     # Nhân viên đổi/thêm vân tay
+
+
+class PrioritySyncQueue:
+    """Hàng đợi ưu tiên theo thiết bị, mỗi nhân viên chỉ giữ bản mới nhất"""
+
+    def __init__(self):
+        self._heaps: Dict[Any, List[Tuple[int, float, int, str]]] = {}
+        self._entries: Dict[Any, Dict[str, Tuple[int, float, int, Dict, Optional[Callable[[Dict, bool], None]]]]] = {}
+        self._draining = set()
+        self._pushed: Dict[Any, Dict[str, Tuple[float, str]]] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def push(self, device_id, employee: Dict, priority: int = PRIORITY_ENROLLMENT, delay: float = 0,
+             on_done: Optional[Callable[[Dict, bool], None]] = None) -> bool:
+        """
+        Đưa nhân viên vào hàng đợi của thiết bị (thay bản cũ nếu đã có)
+
+        Args:
+            device_id: ID thiết bị
+            employee: Dữ liệu nhân viên kèm vân tay
+            priority: Số nhỏ hơn được đẩy trước
+            delay: Chờ N giây trước khi đẩy để gộp các lần quét liên tiếp
+            on_done: Callback (employee, thành công hay không) sau khi đẩy; khi thay bản
+                cũ, callback của bản cũ vẫn được gọi cùng kết quả của bản mới
+
+        Returns:
+            True nếu thiết bị chưa có luồng đẩy, người gọi cần khởi động drain
+        """
+        with self._lock:
+            entries = self._entries.setdefault(device_id, {})
+            previous = entries.get(employee['employee'])
+            if previous is not None:
+                priority = min(priority, previous[0])
+                on_done = self._chain(previous[4], on_done)
+            entry = (priority, time.time() + delay, next(self._seq), employee, on_done)
+            entries[employee['employee']] = entry
+            heapq.heappush(self._heaps.setdefault(device_id, []), entry[:3] + (employee['employee'],))
+            if device_id in self._draining:
+                return False
+            self._draining.add(device_id)
+            return True
+
+    @staticmethod
+    def _chain(first: Optional[Callable[[Dict, bool], None]],
+               second: Optional[Callable[[Dict, bool], None]]) -> Optional[Callable[[Dict, bool], None]]:
+        if first is None or second is None:
+            return first or second
+
+        def chained(employee: Dict, ok: bool):
+            first(employee, ok)
+            second(employee, ok)
+        return chained
+
+    def pop(self, device_id) -> Optional[Tuple[Dict, Optional[Callable[[Dict, bool], None]]]]:
+        """Lấy nhân viên ưu tiên nhất đã đến hạn của thiết bị, None nếu không có"""
+        with self._lock:
+            heap = self._heaps.get(device_id, [])
+            entries = self._entries.get(device_id, {})
+            now = time.time()
+            while heap:
+                priority, ready_at, seq, employee_id = heap[0]
+                entry = entries.get(employee_id)
+                if entry is None or entry[2] != seq:
+                    # Bản cũ đã được thay bằng lần đưa vào sau
+                    heapq.heappop(heap)
+                    continue
+                if ready_at > now:
+                    # Phần tử đầu chưa đến hạn: tìm phần tử đã đến hạn khác
+                    ready = [item for item in heap if item[1] <= now and entries.get(item[3], (0, 0, -1))[2] == item[2]]
+                    if not ready:
+                        return None
+                    priority, ready_at, seq, employee_id = min(ready)
+                    heap.remove((priority, ready_at, seq, employee_id))
+                    heapq.heapify(heap)
+                else:
+                    heapq.heappop(heap)
+                entry = entries.pop(employee_id)
+                return entry[3], entry[4]
+            return None
+
+    def wait_time(self, device_id) -> Optional[float]:
+        """Số giây đến khi có nhân viên đến hạn (0 nếu đã có), None nếu hàng đợi trống"""
+        with self._lock:
+            entries = self._entries.get(device_id)
+            if not entries:
+                return None
+            return max(0.0, min(entry[1] for entry in entries.values()) - time.time())
+
+    def finish_drain(self, device_id) -> bool:
+        """Kết thúc luồng đẩy của thiết bị nếu hàng đợi trống (False: còn việc, chạy tiếp)"""
+        with self._lock:
+            if self._entries.get(device_id):
+                return False
+            self._draining.discard(device_id)
+            return True
+
+    def clear(self, device_id) -> List[Tuple[Dict, Optional[Callable[[Dict, bool], None]]]]:
+        """Bỏ toàn bộ hàng đợi của thiết bị (để lô đồng bộ thường xử lý), trả về các phần tử bị bỏ"""
+        with self._lock:
+            self._heaps.pop(device_id, None)
+            return [(entry[3], entry[4]) for entry in self._entries.pop(device_id, {}).values()]
+
+    def mark_pushed(self, device_id, employee: Dict):
+        """Ghi nhận thời điểm và dữ liệu vân tay của nhân viên vừa được đẩy ưu tiên lên thiết bị"""
+        with self._lock:
+            self._pushed.setdefault(device_id, {})[employee['employee']] = (
+                time.time(), employee_fingerprint_digest(employee))
+
+    def is_pushed(self, device_id, employee: Dict, since: float) -> bool:
+        """
+        Lô đồng bộ bắt đầu lúc since có bỏ qua nhân viên được không: bản đẩy ưu tiên
+        trùng dữ liệu của lô, hoặc được đẩy sau khi lô bắt đầu (dữ liệu của lô cũ hơn)
+        """
+        with self._lock:
+            pushed = self._pushed.get(device_id, {}).get(employee['employee'])
+        if pushed is None:
+            return False
+        pushed_at, digest = pushed
+        return pushed_at >= since or digest == employee_fingerprint_digest(employee)
+
+    def pending(self, device_id) -> int:
+        """Số nhân viên đang chờ đẩy lên thiết bị"""
+        with self._lock:
+            return len(self._entries.get(device_id, {}))
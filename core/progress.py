@@ -0,0 +1,181 @@
+# progress.py
+"""
+Module phát sự kiện tiến độ cho các tác vụ dài (đồng bộ, tải vân tay, đẩy chấm công).
+Tác vụ tạo một job từ progress_bus và báo từng mục hoàn thành/lỗi, số byte đã
+truyền; bus tính tốc độ (mục/giây), ETA và gửi sự kiện đến các subscriber
+(giao diện, dòng lệnh).
+"""
+
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_STARTED = 'job_started'
+ITEM_DONE = 'item_done'
+BYTES = 'bytes'
+ERROR = 'error'
+JOB_FINISHED = 'job_finished'
+
+
+class ProgressEvent:
+    """Một sự kiện tiến độ kèm số liệu của job tại thời điểm phát"""
+
+    __slots__ = ('kind', 'job_id', 'job_name', 'total', 'done', 'failed', 'bytes',
+                 'elapsed', 'rate', 'eta', 'message', 'timestamp')
+
+    def __init__(self, kind: str, job: 'ProgressJob', message: str = ''):
+        self.kind = kind
+        self.job_id = job.job_id
+        self.job_name = job.name
+        self.total = job.total
+        self.done = job.done
+        self.failed = job.failed
+        self.bytes = job.bytes
+        self.elapsed = job.elapsed
+        self.rate = job.rate
+        self.eta = job.eta
+        self.message = message
+        self.timestamp = time.time()
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"<ProgressEvent {self.kind} {self.job_name} {self.done}/{self.total}>"
+
+
+class ProgressJob:
+    """Theo dõi tiến độ một tác vụ"""
+
+    def __init__(self, bus: 'ProgressBus', job_id: int, name: str, total: Optional[int] = None):
+        self.bus = bus
+        self.job_id = job_id
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Số mục hoàn thành mỗi giây"""
+        elapsed = self.elapsed
+        return (self.done + self.failed) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Thời gian còn lại ước tính (giây), None nếu chưa biết tổng hoặc chưa có tốc độ"""
+        rate = self.rate
+        if not self.total or rate <= 0:
+            return None
+        return max(self.total - self.done - self.failed, 0) / rate
+
+    def start(self, total: Optional[int] = None, message: str = '') -> 'ProgressJob':
+        if total is not None:
+            self.total = total
+        with self._lock:
+            self.done = self.failed = self.bytes = 0
+        self.started_at = time.perf_counter()
+        self.bus.publish(ProgressEvent(JOB_STARTED, self, message))
+        return self
+
+    def item_done(self, message: str = '', nbytes: int = 0, count: int = 1):
+        """Một (hoặc count) mục hoàn thành"""
+        with self._lock:
+            self.done += count
+            self.bytes += nbytes
+        self.bus.publish(ProgressEvent(ITEM_DONE, self, message))
+
+    def add_bytes(self, nbytes: int, message: str = ''):
+        """Báo số byte đã truyền (không tính là một mục)"""
+        with self._lock:
+            self.bytes += nbytes
+        self.bus.publish(ProgressEvent(BYTES, self, message))
+
+    def error(self, message: str = '', item: bool = True):
+        """Một mục lỗi (item=False: lỗi chung của job, không tính vào số mục)"""
+        if item:
+            with self._lock:
+                self.failed += 1
+        self.bus.publish(ProgressEvent(ERROR, self, message))
+
+    def finish(self, message: str = ''):
+        if self.finished_at is not None:
+            return
+        self.finished_at = time.perf_counter()
+        self.bus.publish(ProgressEvent(JOB_FINISHED, self, message))
+
+    def __enter__(self) -> 'ProgressJob':
+        if self.started_at is None:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error(str(exc), item=False)
+        self.finish()
+        return False
+
+
+class ProgressBus:
+    """Phân phối sự kiện tiến độ đến các subscriber"""
+
+    def __init__(self):
+        self._subscribers: List[Callable[[ProgressEvent], None]] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Callable[[ProgressEvent], None]) -> Callable[[ProgressEvent], None]:
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback: Callable[[ProgressEvent], None]):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def job(self, name: str, total: Optional[int] = None) -> ProgressJob:
+        """Tạo job mới (gọi start() hoặc dùng with để phát sự kiện bắt đầu)"""
+        return ProgressJob(self, next(self._ids), name, total)
+
+    def publish(self, event: ProgressEvent):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.debug(f"Lỗi subscriber tiến độ: {str(e)}")
+
+
+def format_progress(event: ProgressEvent) -> str:
+    """Chuỗi tiến độ ngắn gọn: tên job, số mục, tốc độ, ETA"""
+    count = f"{event.done}/{event.total}" if event.total else str(event.done)
+    text = f"{event.job_name}: {count}"
+    if event.failed:
+        text += f" (lỗi {event.failed})"
+    text += f" | {event.rate:.1f}/s"
+    if event.bytes:
+        text += f" | {event.bytes / 1024:.0f} KB"
+    if event.kind == JOB_FINISHED:
+        text += f" | xong sau {event.elapsed:.1f}s"
+    elif event.eta is not None:
+        text += f" | còn ~{event.eta:.0f}s"
+    return text
+
+
+progress_bus = ProgressBus()
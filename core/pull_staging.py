@@ -0,0 +1,131 @@
+# pull_staging.py
+"""
+Module file tạm (JSON lines, chỉ ghi nối) cho dữ liệu vân tay tải từ máy chấm công.
+Mỗi user được ghi xuống ngay khi tách xong template, trong bộ nhớ chỉ giữ vị trí
+trong file và hash từng ngón (để merge giữa các thiết bị và cập nhật shadow), nên
+bộ nhớ không tăng theo số template tải về. Sau khi chọn nguồn cho từng nhân viên,
+dữ liệu được đọc lại lần lượt từng nhân viên khi merge vào all_fingerprints.json.
+"""
+
+import base64
+import json
+import os
+import logging
+import tempfile
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import DATA_PATHS
+from core.device_shadow import template_hash
+
+logger = logging.getLogger(__name__)
+
+
+class PullStagingWriter:
+    """Ghi dữ liệu của một thiết bị (nguồn) vào PullStaging"""
+
+    def __init__(self, staging: 'PullStaging', source: int):
+        self.staging = staging
+        self.source = source
+
+    def add(self, employee_data: Dict):
+        """Ghi vân tay của một nhân viên (gọi lại cùng nhân viên thì gộp thêm ngón)"""
+        self.staging.add(self.source, employee_data)
+
+    def reset(self):
+        """Bỏ toàn bộ dữ liệu đã ghi của nguồn này (tải lại bằng cách khác)"""
+        self.staging.reset(self.source)
+
+    @property
+    def fingers(self) -> Dict[str, Dict[int, str]]:
+        """employee -> {ngón: hash template} đã ghi của nguồn này"""
+        return self.staging.fingers(self.source)
+
+
+class PullStaging(Mapping):
+    """
+    File tạm chứa vân tay tải từ nhiều thiết bị. Sau select(), dùng như dict chỉ đọc
+    employee -> dữ liệu vân tay của nguồn đã chọn (đọc từ file khi truy cập)
+    """
+
+    def __init__(self, staging_dir: Optional[str] = None):
+        staging_dir = staging_dir or DATA_PATHS["pull_staging"]
+        os.makedirs(staging_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix='pull_', suffix='.jsonl', dir=staging_dir)
+        self._file = os.fdopen(fd, 'w+b')
+        self._lock = threading.Lock()
+        # nguồn -> employee -> danh sách (vị trí, độ dài) các dòng trong file
+        self._offsets: Dict[int, Dict[str, List[Tuple[int, int]]]] = {}
+        # nguồn -> employee -> {ngón: hash template}
+        self._fingers: Dict[int, Dict[str, Dict[int, str]]] = {}
+        self._selected: Dict[str, int] = {}
+
+    def writer(self, source: int) -> PullStagingWriter:
+        return PullStagingWriter(self, source)
+
+    def add(self, source: int, employee_data: Dict):
+        employee_id = employee_data['employee']
+        line = (json.dumps(employee_data, ensure_ascii=False) + '\n').encode('utf-8')
+        hashes = {}
+        for fp in employee_data.get('fingerprints', []):
+            hashes[int(fp['finger_index'])] = template_hash(base64.b64decode(fp['template_data']))
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(line)
+            self._offsets.setdefault(source, {}).setdefault(employee_id, []).append((offset, len(line)))
+            self._fingers.setdefault(source, {}).setdefault(employee_id, {}).update(hashes)
+
+    def reset(self, source: int):
+        with self._lock:
+            self._offsets.pop(source, None)
+            self._fingers.pop(source, None)
+
+    def fingers(self, source: int) -> Dict[str, Dict[int, str]]:
+        with self._lock:
+            return dict(self._fingers.get(source, {}))
+
+    def select(self, selected: Dict[str, int]):
+        """Chọn nguồn cho từng nhân viên (employee -> nguồn)"""
+        with self._lock:
+            self._file.flush()
+            self._selected = dict(selected)
+
+    def _read(self, source: int, employee_id: str) -> Dict:
+        employee_data = None
+        with self._lock:
+            for offset, size in self._offsets[source][employee_id]:
+                self._file.seek(offset)
+                part = json.loads(self._file.read(size).decode('utf-8'))
+                if employee_data is None:
+                    employee_data = part
+                else:
+                    # Template của user nằm ở nhiều đoạn của buffer: gộp ngón
+                    employee_data['fingerprints'].extend(part.get('fingerprints', []))
+        return employee_data
+
+    def __getitem__(self, employee_id: str) -> Dict:
+        return self._read(self._selected[employee_id], employee_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._selected)
+
+    def __len__(self) -> int:
+        return len(self._selected)
+
+    def close(self):
+        """Đóng và xóa file tạm"""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.close()
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                logger.debug(f"Không xóa được file tạm {self.path}: {str(e)}")
+
+    def __enter__(self) -> 'PullStaging':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,114 @@
+# punch_index.py
+"""
+Module chỉ mục chống trùng lượt chấm công trước khi đẩy lên ERPNext.
+Lưu (serial thiết bị, user_id, thời điểm) đã gửi vào SQLite, đồng thời giữ
+các ngày gần đây trong bộ nhớ (mỗi ngày một set) để tra cứu O(1).
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from config import DATA_PATHS, ATTENDANCE_PULL_CONFIG
+
+logger = logging.getLogger(__name__)
+
+PunchKey = Tuple[str, str, str]
+
+
+class PunchDedupIndex:
+    """Chỉ mục (serial, user_id, timestamp) các lượt chấm công đã gửi"""
+
+    def __init__(self, db_path: Optional[str] = None, retention_days: Optional[int] = None):
+        self.db_path = db_path or DATA_PATHS["punch_index"]
+        self.retention_days = retention_days or ATTENDANCE_PULL_CONFIG.get('dedup_retention_days', 62)
+        self._lock = threading.Lock()
+        self._days: Dict[str, Set[PunchKey]] = {}
+        self._last_prune = 0.0
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS punches ("
+            " day TEXT NOT NULL, serial TEXT NOT NULL, user_id TEXT NOT NULL, ts TEXT NOT NULL,"
+            " PRIMARY KEY (serial, user_id, ts)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_punches_day ON punches (day)")
+        self._conn.commit()
+        self.prune()
+
+    @staticmethod
+    def make_key(serial: str, attendance) -> PunchKey:
+        """Key của một lượt chấm công"""
+        return str(serial), str(attendance.user_id).strip(), attendance.timestamp.isoformat()
+
+    def _day_set(self, day: str) -> Set[PunchKey]:
+        """Set các lượt chấm công của một ngày, nạp từ SQLite ở lần dùng đầu"""
+        keys = self._days.get(day)
+        if keys is None:
+            rows = self._conn.execute("SELECT serial, user_id, ts FROM punches WHERE day = ?", (day,))
+            keys = {(serial, user_id, ts) for serial, user_id, ts in rows}
+            self._days[day] = keys
+        return keys
+
+    def contains(self, serial: str, attendance) -> bool:
+        """Lượt chấm công đã được gửi chưa"""
+        key = self.make_key(serial, attendance)
+        with self._lock:
+            return key in self._day_set(key[2][:10])
+
+    def filter_new(self, serial: str, attendances: Iterable) -> List:
+        """Bỏ các lượt chấm công đã gửi (kể cả trùng lặp trong cùng danh sách)"""
+        new_records = []
+        seen: Set[PunchKey] = set()
+        with self._lock:
+            for attendance in attendances:
+                key = self.make_key(serial, attendance)
+                if key in seen or key in self._day_set(key[2][:10]):
+                    continue
+                seen.add(key)
+                new_records.append(attendance)
+        return new_records
+
+    def add_many(self, serial: str, attendances: Iterable):
+        """Ghi nhận các lượt chấm công đã gửi thành công"""
+        keys = [self.make_key(serial, attendance) for attendance in attendances]
+        if not keys:
+            return
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO punches (day, serial, user_id, ts) VALUES (?, ?, ?, ?)",
+                    [(ts[:10], s, user_id, ts) for s, user_id, ts in keys]
+                )
+                self._conn.commit()
+            except Exception as e:
+                logger.error(f"❌ Lỗi ghi chỉ mục chấm công: {str(e)}")
+            for key in keys:
+                day = key[2][:10]
+                if day in self._days:
+                    self._days[day].add(key)
+        if time.time() - self._last_prune > 86400:
+            self.prune()
+
+    def prune(self):
+        """Xóa các lượt chấm công cũ hơn thời gian lưu giữ"""
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        with self._lock:
+            try:
+                deleted = self._conn.execute("DELETE FROM punches WHERE day < ?", (cutoff,)).rowcount
+                self._conn.commit()
+                if deleted:
+                    logger.info(f"🗑️ Đã dọn {deleted} lượt chấm công cũ khỏi chỉ mục chống trùng")
+            except Exception as e:
+                logger.error(f"❌ Lỗi dọn chỉ mục chấm công: {str(e)}")
+            for day in [day for day in self._days if day < cutoff]:
+                del self._days[day]
+            self._last_prune = time.time()
+
+    def close(self):
+        """Đóng kết nối SQLite"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,224 @@
+# punch_stream.py
+"""
+Module nhận lượt chấm công thời gian thực (live capture) từ máy chấm công.
+Mỗi thiết bị giữ một kết nối riêng ở chế độ nhận sự kiện, các lượt chấm công
+được gom lô và đẩy lên ERPNext trong vài giây; khi mất kết nối sẽ tự kết nối lại
+và bù các lượt chấm công bị lỡ từ log của thiết bị.
+
+Con trỏ log chỉ được dời khi bù từ log thiết bị (mỗi lần vào live capture).
+Lượt chấm công realtime chỉ đi qua chỉ mục chống trùng, nên lô realtime lỗi
+hoặc lượt chấm công rơi vào lúc vào lại live capture vẫn được lần bù sau đọc lại.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Any
+from config import LIVE_CAPTURE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class LivePunchStreamer:
+    """Nhận lượt chấm công realtime từ các thiết bị và đẩy lên ERPNext theo lô"""
+
+    def __init__(self, device_sync, devices_provider: Callable[[], List[Dict]]):
+        """
+        Args:
+            device_sync: AttendanceDeviceSync dùng để kết nối và đẩy checkin
+            devices_provider: Hàm trả về danh sách cấu hình thiết bị hiện tại
+        """
+        self.device_sync = device_sync
+        self.devices_provider = devices_provider
+        self.capture_timeout = LIVE_CAPTURE_CONFIG.get('capture_timeout', 5)
+        self.keepalive_interval = LIVE_CAPTURE_CONFIG.get('keepalive_interval', 1800)
+        self.backfill_retry = LIVE_CAPTURE_CONFIG.get('backfill_retry', 60)
+        self.flush_interval = LIVE_CAPTURE_CONFIG.get('flush_interval', 2)
+        self.reconnect_delay = LIVE_CAPTURE_CONFIG.get('reconnect_delay', 5)
+        self.max_reconnect_delay = LIVE_CAPTURE_CONFIG.get('max_reconnect_delay', 300)
+        self.map_refresh = LIVE_CAPTURE_CONFIG.get('employee_map_refresh', 600)
+
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._stop = threading.Event()
+        self._threads: Dict[Any, threading.Thread] = {}
+        self._connections: Dict[Any, Any] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._supervisor: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Bù từ log và đẩy lô realtime của cùng thiết bị không chạy song song (tránh gửi trùng)
+        self._post_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._backfill_needed: Dict[str, bool] = {}
+        self._employee_map: Dict[str, str] = {}
+        self._employee_map_at = 0.0
+
+    def _get_employee_map(self) -> Dict[str, str]:
+        """Bảng tra attendance_device_id -> employee, làm mới định kỳ"""
+        if not self._employee_map or time.time() - self._employee_map_at > self.map_refresh:
+            employee_map = self.device_sync.build_employee_map()
+            if employee_map:
+                self._employee_map = employee_map
+                self._employee_map_at = time.time()
+        return self._employee_map
+
+    def _stream_device(self, device: Dict):
+        """Giữ kết nối live capture tới một thiết bị, tự kết nối lại khi lỗi"""
+        device_id = device.get('id', 1)
+        device_name = device.get('device_name', device.get('name', f"Device_{device_id}"))
+        delay = self.reconnect_delay
+
+        while not self._stop.is_set():
+            # Kết nối riêng: live capture chiếm socket nên không dùng chung kết nối trong pool
+            zk, device_info = self.device_sync._open_connection(device)
+            if not zk:
+                logger.warning(f"⚠️ Live capture: không kết nối được {device_name}, thử lại sau {delay} giây")
+                if self._stop.wait(delay):
+                    break
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            delay = self.reconnect_delay
+            serial = device_info.get('serial')
+            cursor_key = self.device_sync.attendance_cursors.make_key(device, serial)
+            device_label = serial or device_name
+            with self._lock:
+                self._connections[device_id] = zk
+            try:
+                logger.info(f"📡 Đang nhận chấm công realtime từ {device_name}")
+                while not self._stop.is_set():
+                    # Mỗi lần vào live capture đều bù từ log: lượt chấm công lúc mất kết nối,
+                    # lúc vào lại live capture lần trước và các lô realtime bị lỗi
+                    self._backfill(zk, device, serial, cursor_key)
+                    self._capture_until_keepalive(zk, cursor_key, device_label)
+                    if self._stop.is_set():
+                        break
+                    # Kiểm tra kết nối còn sống giữa các phiên live capture
+                    zk.get_time()
+            except Exception as e:
+                logger.warning(f"⚠️ Live capture {device_name} bị ngắt: {str(e)}")
+            finally:
+                with self._lock:
+                    self._connections.pop(device_id, None)
+                try:
+                    zk.disconnect()
+                except Exception:
+                    pass
+
+            if self._stop.wait(delay):
+                break
+
+        logger.info(f"🔌 Dừng live capture {device_name}")
+
+    def _capture_until_keepalive(self, zk, cursor_key: str, device_label: str):
+        """
+        Nhận sự kiện trong một phiên live capture cho đến khi hết chu kỳ keepalive,
+        cần bù log (sau ít nhất backfill_retry giây) hoặc bị dừng. Mỗi lần vào live
+        capture pyzk tải lại toàn bộ bảng user nên phiên được giữ càng lâu càng tốt.
+        """
+        started = time.time()
+        for attendance in zk.live_capture(new_timeout=self.capture_timeout):
+            if attendance is not None:
+                self._queue.put((cursor_key, device_label, attendance))
+                logger.info(f"👆 {device_label}: user {attendance.user_id} chấm công lúc {attendance.timestamp}")
+            elapsed = time.time() - started
+            if self._stop.is_set() or elapsed >= self.keepalive_interval or \
+                    (self._backfill_needed.get(cursor_key) and elapsed >= self.backfill_retry):
+                # Thoát live capture đúng cách để thiết bị hủy đăng ký sự kiện
+                zk.end_live_capture = True
+
+    def _backfill(self, zk, device: Dict, serial: Optional[str], cursor_key: str):
+        """Bù các lượt chấm công còn thiếu từ log của thiết bị (theo con trỏ)"""
+        employee_map = self._get_employee_map()
+        with self._post_locks[cursor_key]:
+            posted, new_count = self.device_sync.pull_attendance_with_connection(zk, device, serial, employee_map)
+        if new_count:
+            logger.info(f"🧩 Bù {posted}/{new_count} lượt chấm công bị lỡ từ {serial or device.get('id')}")
+        # Con trỏ chỉ ghi nhận số bản ghi khi đã đẩy hết, lệch nghĩa là còn phải bù tiếp
+        cursor = self.device_sync.attendance_cursors.get(cursor_key)
+        self._backfill_needed[cursor_key] = cursor.get('records') != zk.records
+
+    def _flush_loop(self):
+        """Gom các lượt chấm công trong flush_interval rồi đẩy lên ERPNext"""
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                items = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.time() + self.flush_interval
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(items)
+
+    def _flush(self, items: List[tuple]):
+        """Đẩy một lô lượt chấm công, nhóm theo thiết bị"""
+        groups: Dict[tuple, List] = defaultdict(list)
+        for cursor_key, device_label, attendance in items:
+            groups[(cursor_key, device_label)].append(attendance)
+
+        employee_map = self._get_employee_map()
+        for (cursor_key, device_label), attendances in groups.items():
+            attendances.sort(key=lambda a: a.timestamp)
+            try:
+                if not employee_map:
+                    raise RuntimeError("chưa có danh sách nhân viên")
+                # Không dời con trỏ: lô lỗi (và các lô sau nó) vẫn nằm sau con trỏ để bù từ log
+                with self._post_locks[cursor_key]:
+                    _, completed = self.device_sync._post_attendance_batches(
+                        cursor_key, attendances, employee_map, device_label, advance_cursor=False)
+            except Exception as e:
+                logger.error(f"❌ Lỗi đẩy chấm công realtime của {device_label}: {str(e)}")
+                completed = False
+            if not completed:
+                # Thoát live capture sau backfill_retry giây để bù lô lỗi từ log thiết bị
+                self._backfill_needed[cursor_key] = True
+
+    def _supervise(self):
+        """Tạo luồng live capture cho thiết bị mới, khởi động lại luồng đã dừng"""
+        while not self._stop.is_set():
+            try:
+                for device in self.devices_provider():
+                    device_id = device.get('id', 1)
+                    if not device.get('enable', True):
+                        continue
+                    thread = self._threads.get(device_id)
+                    if thread and thread.is_alive():
+                        continue
+                    thread = threading.Thread(target=self._stream_device, args=(dict(device),), daemon=True)
+                    self._threads[device_id] = thread
+                    thread.start()
+            except Exception as e:
+                logger.error(f"❌ Lỗi quản lý live capture: {str(e)}")
+            self._stop.wait(LIVE_CAPTURE_CONFIG.get('refresh_interval', 30))
+
+    def start(self):
+        """Bật nhận chấm công realtime trong luồng nền"""
+        if self._supervisor and self._supervisor.is_alive():
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+        logger.info("📡 Đã bật nhận chấm công realtime từ máy chấm công")
+
+    def stop(self, timeout: float = 10):
+        """Dừng nhận sự kiện và đẩy nốt các lượt chấm công còn trong hàng đợi"""
+        self._stop.set()
+        with self._lock:
+            connections = list(self._connections.values())
+        for zk in connections:
+            zk.end_live_capture = True
+        if self._flusher:
+            self._flusher.join(timeout)
+
+    def is_streaming(self, device_id) -> bool:
+        """Thiết bị có đang ở chế độ live capture không"""
+        with self._lock:
+            return device_id in self._connections
@@ -0,0 +1,95 @@
+# sync_checkpoint.py
+"""
+Module nhật ký checkpoint cho đồng bộ đến máy chấm công.
+Ghi lại từng nhân viên đã được xác nhận trên thiết bị để lần chạy sau
+(sau khi lỗi hoặc bị ngắt) tiếp tục từ chỗ dừng thay vì làm lại từ đầu.
+"""
+
+import json
+import os
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from config import DATA_PATHS, SYNC_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class SyncCheckpointJournal:
+    """Nhật ký checkpoint (JSON lines) của một thiết bị"""
+
+    def __init__(self, device_config: Dict, checkpoint_dir: Optional[str] = None):
+        checkpoint_dir = checkpoint_dir or DATA_PATHS["checkpoints"]
+        self.device_id = device_config.get('id', 1)
+        self.path = os.path.join(checkpoint_dir, f"device_{self.device_id}.jsonl")
+        self.max_age = SYNC_CONFIG.get('checkpoint_max_age', 86400)
+        self._lock = threading.Lock()
+        self.confirmed: Dict[str, str] = self._load()
+
+    def _load(self) -> Dict[str, str]:
+        """Đọc các nhân viên đã xác nhận từ nhật ký (bỏ qua dòng ghi dở)"""
+        confirmed = {}
+        if not os.path.exists(self.path):
+            return confirmed
+        try:
+            if time.time() - os.path.getmtime(self.path) > self.max_age:
+                logger.info(f"🗑️ Checkpoint thiết bị ID {self.device_id} đã quá hạn, bắt đầu lại từ đầu")
+                self.clear()
+                return confirmed
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        confirmed[entry['employee']] = entry['digest']
+                    except (ValueError, KeyError):
+                        continue
+            if confirmed:
+                logger.info(f"📌 Tiếp tục đồng bộ thiết bị ID {self.device_id} từ checkpoint: "
+                            f"{len(confirmed)} nhân viên đã xác nhận")
+        except Exception as e:
+            logger.warning(f"⚠️ Không thể đọc checkpoint thiết bị ID {self.device_id}: {str(e)}")
+        return confirmed
+
+    def is_confirmed(self, employee_id: str, digest: str) -> bool:
+        """Nhân viên đã được xác nhận trên thiết bị với đúng dữ liệu hiện tại chưa"""
+        return self.confirmed.get(employee_id) == digest
+
+    def confirm(self, employee_id: str, digest: str):
+        """Ghi nhận nhân viên đã được xác nhận trên thiết bị"""
+        with self._lock:
+            self.confirmed[employee_id] = digest
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'employee': employee_id, 'digest': digest, 'ts': time.time()}) + "\n")
+                    f.flush()
+            except Exception as e:
+                logger.error(f"❌ Lỗi ghi checkpoint thiết bị ID {self.device_id}: {str(e)}")
+
+    def forget(self, employee_ids: Iterable[str]):
+        """Bỏ các nhân viên khỏi nhật ký (vừa bị xóa khỏi thiết bị, lần sau phải đẩy lại)"""
+        with self._lock:
+            forgotten = [employee_id for employee_id in employee_ids
+                         if self.confirmed.pop(employee_id, None) is not None]
+            if not forgotten:
+                return
+            try:
+                # Ghi lại nhật ký chỉ gồm các nhân viên còn lại
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for employee_id, digest in self.confirmed.items():
+                        f.write(json.dumps({'employee': employee_id, 'digest': digest, 'ts': time.time()}) + "\n")
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.error(f"❌ Lỗi ghi checkpoint thiết bị ID {self.device_id}: {str(e)}")
+
+    def clear(self):
+        """Xóa nhật ký (khi lần chạy hoàn tất hoặc dữ liệu thiết bị bị xóa)"""
+        with self._lock:
+            self.confirmed = {}
+            try:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+            except Exception as e:
+                logger.error(f"❌ Lỗi xóa checkpoint thiết bị ID {self.device_id}: {str(e)}")
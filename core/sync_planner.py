@@ -0,0 +1,143 @@
+# sync_planner.py
+"""
+Module lập kế hoạch đồng bộ theo dung lượng máy chấm công.
+Trước khi ghi, đọc dung lượng và số lượng hiện tại của thiết bị (read_sizes),
+ước tính số user/vân tay sau đồng bộ và thời gian truyền, rồi cắt bớt hoặc từ
+chối kế hoạch nếu vượt dung lượng thay vì để save_user_template lỗi giữa chừng.
+"""
+
+import logging
+from typing import Dict, List
+from config import SYNC_PLANNER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+USER_RECORD_SIZE = 72
+# Số lệnh cho mỗi nhân viên: get_users x2, set_user, gửi buffer template, lưu template, xóa user cũ
+COMMANDS_PER_EMPLOYEE = 6
+
+
+class SyncPlanner:
+    """Kiểm tra và điều chỉnh danh sách nhân viên theo dung lượng thiết bị"""
+
+    def __init__(self, device_sync):
+        self.device_sync = device_sync
+        self.policy = SYNC_PLANNER_CONFIG.get('overflow_policy', 'trim')
+        self.reserve_users = SYNC_PLANNER_CONFIG.get('reserve_users', 0)
+        self.reserve_fingers = SYNC_PLANNER_CONFIG.get('reserve_fingers', 0)
+        self.command_latency = SYNC_PLANNER_CONFIG.get('command_latency', 0.05)
+        self.bytes_per_second = SYNC_PLANNER_CONFIG.get('bytes_per_second', 100000)
+
+    @staticmethod
+    def _finger_count(employee: Dict) -> int:
+        return len({fp.get('finger_index') for fp in employee.get('fingerprints', [])
+                    if isinstance(fp, dict) and fp.get('template_data')})
+
+    @staticmethod
+    def template_bytes(employee: Dict) -> int:
+        """Số byte template của nhân viên (tính từ độ dài base64)"""
+        return sum(len(fp.get('template_data', '')) * 3 // 4
+                   for fp in employee.get('fingerprints', []) if isinstance(fp, dict))
+
+    def _capacity(self, device_config: Dict, zk) -> Dict:
+        """Dung lượng và số lượng hiện tại (đọc trực tiếp, dùng cache nếu lỗi)"""
+        try:
+            zk.read_sizes()
+            return {
+                'users': zk.users, 'fingers': zk.fingers,
+                'users_cap': zk.users_cap, 'fingers_cap': zk.fingers_cap
+            }
+        except Exception as e:
+            logger.warning(f"⚠️ Không đọc được dung lượng thiết bị, dùng thông tin đã lưu: {str(e)}")
+            return self.device_sync.get_device_capabilities(device_config)
+
+    def _device_fingers(self, device_config: Dict) -> Dict[str, int]:
+        """Số vân tay của từng user trên thiết bị theo shadow (user chưa biết vân tay không có trong dict)"""
+        shadow = self.device_sync.shadow.get(self.device_sync.metadata_cache.get_serial(device_config))
+        if not shadow:
+            return {}
+        return {user_id: len(entry['fingers']) for user_id, entry in shadow['users'].items()
+                if entry.get('fingers') is not None}
+
+    def estimate_seconds(self, employees: List[Dict], device_users: int, existing: int) -> float:
+        """Ước tính thời gian đồng bộ (giây)"""
+        if not employees:
+            return 0.0
+        template_bytes = sum(self.template_bytes(emp) for emp in employees)
+        # Mỗi nhân viên đọc lại danh sách user hai lần
+        users_bytes = 2 * len(employees) * (device_users + len(employees) // 2) * USER_RECORD_SIZE
+        return (len(employees) * COMMANDS_PER_EMPLOYEE * self.command_latency
+                + (template_bytes + users_bytes) / float(self.bytes_per_second)
+                + existing * 0.5)
+
+    def plan(self, device_config: Dict, zk, employees: List[Dict]) -> Dict:
+        """
+        Lập kế hoạch đồng bộ
+
+        Returns:
+            Dict gồm ok, employees (danh sách sẽ đồng bộ), skipped (bị cắt do hết dung lượng),
+            users_after, fingers_after, users_cap, fingers_cap, estimated_seconds, reason
+        """
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_config.get('id', 1)}"))
+        capacity = self._capacity(device_config, zk)
+        users_cap = capacity.get('users_cap') or 0
+        fingers_cap = capacity.get('fingers_cap') or 0
+        users_now = capacity.get('users') or 0
+        fingers_now = capacity.get('fingers') or 0
+
+        try:
+            existing_ids = {str(user.user_id) for user in zk.get_users()}
+        except Exception as e:
+            logger.warning(f"⚠️ Không đọc được danh sách user của {device_name}: {str(e)}")
+            existing_ids = set()
+        device_fingers = self._device_fingers(device_config)
+
+        # Nhân viên đã có trên thiết bị chỉ thay vân tay nên xếp trước, không tốn thêm slot user
+        ordered = sorted(employees, key=lambda emp: str(emp.get('attendance_device_id')) not in existing_ids)
+        users_limit = users_cap - self.reserve_users if users_cap else None
+        fingers_limit = fingers_cap - self.reserve_fingers if fingers_cap else None
+
+        planned, skipped = [], []
+        users_after, fingers_after = users_now, fingers_now
+        for emp in ordered:
+            is_new = str(emp.get('attendance_device_id')) not in existing_ids
+            add_users = 1 if is_new else 0
+            # Nhân viên đã có: chỉ tính phần vân tay nhiều hơn trên thiết bị (chưa biết thì tính đủ)
+            add_fingers = self._finger_count(emp)
+            if not is_new:
+                add_fingers = max(0, add_fingers - device_fingers.get(str(emp.get('attendance_device_id')), 0))
+            if ((users_limit is not None and users_after + add_users > users_limit) or
+                    (fingers_limit is not None and fingers_after + add_fingers > fingers_limit)):
+                skipped.append(emp)
+                continue
+            planned.append(emp)
+            users_after += add_users
+            fingers_after += add_fingers
+
+        existing_count = sum(1 for emp in planned if str(emp.get('attendance_device_id')) in existing_ids)
+        result = {
+            'ok': True,
+            'employees': planned,
+            'skipped': skipped,
+            'users_after': users_after,
+            'fingers_after': fingers_after,
+            'users_cap': users_cap,
+            'fingers_cap': fingers_cap,
+            'estimated_seconds': self.estimate_seconds(planned, users_now, existing_count),
+            'reason': ''
+        }
+
+        if skipped:
+            result['reason'] = (f"Vượt dung lượng: {len(skipped)}/{len(employees)} nhân viên không còn chỗ "
+                                f"(user {users_now}/{users_cap}, vân tay {fingers_now}/{fingers_cap})")
+            if self.policy == 'reject':
+                result['ok'] = False
+                result['employees'] = []
+                logger.error(f"❌ {device_name}: từ chối kế hoạch đồng bộ - {result['reason']}")
+                return result
+            logger.warning(f"⚠️ {device_name}: cắt bớt kế hoạch đồng bộ - {result['reason']}")
+
+        logger.info(f"📐 Kế hoạch {device_name}: {len(planned)} nhân viên, sau đồng bộ "
+                    f"{users_after}/{users_cap} user, {fingers_after}/{fingers_cap} vân tay, "
+                    f"ước tính {result['estimated_seconds']:.0f}s")
+        return result
@@ -0,0 +1,305 @@
+# sync_scheduler.py
+"""
+Module lập lịch đồng bộ vân tay nền đến máy chấm công.
+Mỗi thiết bị được đồng bộ tăng dần theo sync_interval riêng, có jitter,
+backoff khi lỗi và không bao giờ chạy hai job cùng lúc trên một thiết bị.
+Nhân viên vừa quét vân tay được đẩy ngay qua hàng đợi ưu tiên, trước lô tự động.
+"""
+
+import json
+import os
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Any
+from config import DATA_PATHS, SCHEDULER_CONFIG
+from core.data_manager import employee_fingerprint_digest
+from core.priority_sync import PRIORITY_ENROLLMENT
+
+logger = logging.getLogger(__name__)
+
+
+def _drop_synced(synced: Dict[str, str], employee_ids: Optional[Iterable[str]]) -> bool:
+    """Bỏ các nhân viên (hoặc tất cả nếu employee_ids là None) khỏi danh sách đã đồng bộ"""
+    if employee_ids is None:
+        changed = bool(synced)
+        synced.clear()
+        return changed
+    return any([synced.pop(employee_id, None) is not None for employee_id in employee_ids])
+
+
+def forget_synced_state(device: Dict, employee_ids: Optional[Iterable[str]] = None,
+                        state_path: Optional[str] = None) -> bool:
+    """
+    Quên các nhân viên đã đồng bộ lên thiết bị ngay trong file trạng thái, dùng khi
+    không có SyncScheduler đang chạy (không tạo scheduler chỉ để reset trạng thái)
+
+    Args:
+        device: Cấu hình thiết bị
+        employee_ids: Chỉ quên các nhân viên này (None: quên tất cả)
+        state_path: File trạng thái (mặc định DATA_PATHS["sync_state"])
+
+    Returns:
+        True nếu trạng thái có thay đổi
+    """
+    state_path = state_path or DATA_PATHS["sync_state"]
+    key = SyncScheduler.device_key(device)
+    try:
+        if not os.path.exists(state_path):
+            return False
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if not _drop_synced(state.get(key, {}).get('synced', {}), employee_ids):
+            return False
+        with open(state_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=4)
+    except Exception as e:
+        logger.error(f"❌ Lỗi reset trạng thái lịch đồng bộ: {str(e)}")
+        return False
+    logger.info(f"🔄 Đã reset trạng thái đồng bộ tự động của thiết bị ID {key}")
+    return True
+
+
+class SyncScheduler:
+    """Bộ lập lịch đồng bộ nền theo sync_interval của từng thiết bị"""
+
+    def __init__(self, device_sync, devices_provider: Callable[[], List[Dict]],
+                 employees_provider: Callable[[], List[Dict]], state_path: Optional[str] = None):
+        """
+        Args:
+            device_sync: AttendanceDeviceSync dùng để đồng bộ
+            devices_provider: Hàm trả về danh sách cấu hình thiết bị hiện tại
+            employees_provider: Hàm trả về danh sách nhân viên kèm vân tay hiện tại
+            state_path: Đường dẫn file lưu trạng thái lần chạy
+        """
+        self.device_sync = device_sync
+        self.devices_provider = devices_provider
+        self.employees_provider = employees_provider
+        self.state_path = state_path or DATA_PATHS["sync_state"]
+        self.jitter = SCHEDULER_CONFIG.get('jitter', 0.1)
+        self.max_backoff = SCHEDULER_CONFIG.get('max_backoff', 3600)
+        self.default_interval = SCHEDULER_CONFIG.get('default_interval', 300)
+        self.state: Dict[str, Dict[str, Any]] = self._load_state()
+        self._state_lock = threading.Lock()
+        self._device_locks: Dict[str, threading.Lock] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Xóa/khôi phục thiết bị qua device_sync sẽ reset trạng thái đã đồng bộ tại đây
+        device_sync.sync_scheduler = self
+
+    @staticmethod
+    def device_key(device: Dict) -> str:
+        """Key trạng thái của thiết bị"""
+        return str(device.get('id', 1))
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        """Tải trạng thái lần chạy từ file local"""
+        try:
+            if os.path.exists(self.state_path):
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Không thể tải trạng thái lịch đồng bộ: {str(e)}")
+        return {}
+
+    def _save_state(self):
+        """Lưu trạng thái lần chạy xuống file local"""
+        try:
+            with self._state_lock:
+                data = json.dumps(self.state, ensure_ascii=False, indent=4)
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(self.state_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+        except Exception as e:
+            logger.error(f"❌ Lỗi lưu trạng thái lịch đồng bộ: {str(e)}")
+
+    def _device_state(self, device: Dict) -> Dict[str, Any]:
+        """Lấy (hoặc tạo) trạng thái của một thiết bị"""
+        key = self.device_key(device)
+        with self._state_lock:
+            if key not in self.state:
+                self.state[key] = {
+                    'last_run': None,
+                    'last_success': None,
+                    'next_run': None,
+                    'failures': 0,
+                    'last_result': None,
+                    'synced': {}
+                }
+            return self.state[key]
+
+    def forget_device(self, device: Dict, employee_ids: Optional[Iterable[str]] = None):
+        """
+        Quên các nhân viên đã đồng bộ lên thiết bị (thiết bị vừa bị xóa hoặc khôi phục,
+        hoặc employee_ids vừa bị xóa khỏi thiết bị) để lần sau đẩy lại
+        """
+        key = self.device_key(device)
+        with self._state_lock:
+            state = self.state.get(key)
+            if not state or not _drop_synced(state.get('synced', {}), employee_ids):
+                return
+        self._save_state()
+        logger.info(f"🔄 Đã reset trạng thái đồng bộ tự động của thiết bị ID {key}")
+
+    def _get_device_lock(self, device: Dict) -> threading.Lock:
+        key = self.device_key(device)
+        with self._state_lock:
+            if key not in self._device_locks:
+                self._device_locks[key] = threading.Lock()
+            return self._device_locks[key]
+
+    def _interval(self, device: Dict) -> int:
+        return int(device.get('sync_interval') or self.default_interval)
+
+    def _next_run_after_success(self, device: Dict) -> float:
+        interval = self._interval(device)
+        return time.time() + interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _next_run_after_failure(self, device: Dict, failures: int) -> float:
+        interval = self._interval(device)
+        delay = min(interval * (2 ** failures), self.max_backoff)
+        return time.time() + delay * (1 + random.uniform(0, self.jitter))
+
+    def is_busy(self, device: Dict) -> bool:
+        """Thiết bị có đang chạy job đồng bộ không"""
+        return self._get_device_lock(device).locked()
+
+    def pending_employees(self, device: Dict) -> List[Dict]:
+        """Danh sách nhân viên đã thay đổi kể từ lần đồng bộ thành công gần nhất"""
+        synced = self._device_state(device).get('synced', {})
+        pending = []
+        for emp in self.device_sync.assignment.filter_employees(device, self.employees_provider()):
+            if not emp.get('fingerprints') or not emp.get('attendance_device_id'):
+                continue
+            if synced.get(emp.get('employee')) != employee_fingerprint_digest(emp):
+                pending.append(emp)
+        return pending
+
+    def prioritize(self, employee: Dict, priority: int = PRIORITY_ENROLLMENT,
+                   on_synced: Optional[Callable[[Dict, Dict], None]] = None,
+                   on_failed: Optional[Callable[[Dict, Dict], None]] = None) -> List[Dict]:
+        """
+        Đẩy ngay nhân viên vừa đăng ký/đổi vân tay lên các thiết bị được phân công,
+        trước các nhân viên còn lại của lô đồng bộ
+
+        Args:
+            on_synced, on_failed: Callback (device_config, employee) theo kết quả từng thiết bị
+
+        Returns:
+            Danh sách thiết bị nhận nhân viên vào hàng đợi ưu tiên
+        """
+        def mark_synced(device, synced_employee):
+            state = self._device_state(device)
+            with self._state_lock:
+                state['synced'][synced_employee['employee']] = employee_fingerprint_digest(synced_employee)
+            self._save_state()
+            if on_synced:
+                on_synced(device, synced_employee)
+
+        return self.device_sync.enqueue_priority(employee, self.devices_provider(), priority,
+                                                 on_synced=mark_synced, on_failed=on_failed)
+
+    def run_device(self, device: Dict) -> bool:
+        """
+        Chạy một job đồng bộ tăng dần cho thiết bị (bỏ qua nếu thiết bị đang bận)
+
+        Returns:
+            True nếu job chạy thành công
+        """
+        device_lock = self._get_device_lock(device)
+        if not device_lock.acquire(blocking=False):
+            logger.info(f"⏭️ Thiết bị ID {device.get('id')} đang có job đồng bộ, bỏ qua")
+            return False
+
+        device_name = device.get('device_name', device.get('name', f"Device_{device.get('id', 1)}"))
+        state = self._device_state(device)
+        try:
+            state['last_run'] = time.time()
+            # Đo lại TCP/UDP định kỳ khi giữ khóa thiết bị để không trùng job đồng bộ
+            tuner = self.device_sync.transport_tuner
+            if tuner.is_due(device):
+                tuner.calibrate(device)
+            pending = self.pending_employees(device)
+            if not pending:
+                logger.debug(f"{device_name}: không có thay đổi cần đồng bộ")
+                success, total, ok = 0, 0, True
+            else:
+                logger.info(f"⏰ Đồng bộ tự động {len(pending)} nhân viên thay đổi đến {device_name}")
+
+                def mark_synced(employee):
+                    with self._state_lock:
+                        state['synced'][employee['employee']] = employee_fingerprint_digest(employee)
+
+                success, total = self.device_sync.sync_all_to_device(device, pending, on_employee_synced=mark_synced)
+                # Không đồng bộ được nhân viên nào (kể cả không kết nối được) thì tính là lỗi
+                ok = success > 0
+
+            state['last_result'] = [success, total]
+            if ok:
+                state['failures'] = 0
+                state['last_success'] = time.time()
+                state['next_run'] = self._next_run_after_success(device)
+            else:
+                state['failures'] = state.get('failures', 0) + 1
+                state['next_run'] = self._next_run_after_failure(device, state['failures'])
+                logger.warning(f"⚠️ Đồng bộ tự động đến {device_name} thất bại lần {state['failures']}, "
+                               f"thử lại sau {int(state['next_run'] - time.time())} giây")
+            return ok
+        except Exception as e:
+            logger.error(f"❌ Lỗi job đồng bộ tự động đến {device_name}: {str(e)}")
+            state['failures'] = state.get('failures', 0) + 1
+            state['next_run'] = self._next_run_after_failure(device, state['failures'])
+            return False
+        finally:
+            device_lock.release()
+            self._save_state()
+
+    def run_now(self, device_id) -> bool:
+        """Yêu cầu đồng bộ ngay một thiết bị ở lần quét lịch tiếp theo"""
+        for device in self.devices_provider():
+            if device.get('id') == device_id:
+                self._device_state(device)['next_run'] = time.time()
+                return True
+        return False
+
+    def _due_devices(self) -> List[Dict]:
+        """Các thiết bị đã đến lượt đồng bộ"""
+        now = time.time()
+        due = []
+        for device in self.devices_provider():
+            if not device.get('enable', True) or self._interval(device) <= 0:
+                continue
+            state = self._device_state(device)
+            if state.get('next_run') is None:
+                # Lần đầu: rải đều thời điểm chạy để tránh dồn tất cả thiết bị cùng lúc
+                state['next_run'] = now + random.uniform(0, self.jitter * self._interval(device))
+            if state['next_run'] <= now and not self.is_busy(device):
+                # Đẩy lịch tạm thời để lần quét sau không tạo job trùng
+                state['next_run'] = now + self._interval(device)
+                due.append(device)
+        return due
+
+    def start(self):
+        """Chạy bộ lập lịch trong luồng nền"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        tick = SCHEDULER_CONFIG.get('tick', 5)
+
+        def loop():
+            while not self._stop.wait(tick):
+                try:
+                    for device in self._due_devices():
+                        threading.Thread(target=self.run_device, args=(device,), daemon=True).start()
+                except Exception as e:
+                    logger.error(f"❌ Lỗi bộ lập lịch đồng bộ: {str(e)}")
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+        logger.info("⏰ Đã bật lịch đồng bộ tự động đến máy chấm công")
+
+    def stop(self):
+        """Dừng bộ lập lịch"""
+        self._stop.set()
+        self._save_state()
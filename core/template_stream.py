@@ -0,0 +1,252 @@
+# template_stream.py
+"""
+Module đọc template vân tay từ máy chấm công theo luồng.
+zk.get_templates() giữ toàn bộ buffer và danh sách Finger của cả thiết bị trong
+bộ nhớ; ở đây buffer được đọc từng chunk (lệnh 1503/1504) và tách template ngay
+khi đủ bản ghi, nên bộ nhớ chỉ cỡ một chunk dù thiết bị có bao nhiêu user.
+
+Dùng các hàm nội bộ của pyzk 0.9 (__send_command, __read_chunk, __recieve_chunk,
+__create_header) vì pyzk không có API đọc buffer theo từng phần hay gửi nhiều lệnh
+liên tiếp không chờ phản hồi.
+"""
+
+import logging
+from struct import pack, unpack
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from zk import ZK, const
+from zk.base import Finger
+from zk.exception import ZKErrorResponse, ZKNetworkError
+
+logger = logging.getLogger(__name__)
+
+CMD_READ_BUFFER = 1503
+CMD_GET_USER_TEMPLATE = 88
+TCP_MAX_CHUNK = 0xFFC0
+UDP_MAX_CHUNK = 16 * 1024
+
+
+def iter_buffer_chunks(zk: ZK, command: int, fct: int = 0, ext: int = 0) -> Iterator[bytes]:
+    """
+    Đọc buffer của một lệnh theo từng chunk (tương đương zk.read_with_buffer
+    nhưng không ghép toàn bộ dữ liệu)
+    """
+    max_chunk = TCP_MAX_CHUNK if zk.tcp else UDP_MAX_CHUNK
+    cmd_response = zk._ZK__send_command(CMD_READ_BUFFER, pack('<bhii', 1, command, fct, ext), 1024)
+    if not cmd_response.get('status'):
+        raise ZKErrorResponse("RWB Not supported")
+
+    if cmd_response['code'] == const.CMD_DATA:
+        # Dữ liệu nhỏ được trả thẳng trong phản hồi
+        data = zk._ZK__data
+        if zk.tcp and len(data) < zk._ZK__tcp_length - 8:
+            data = data + zk._ZK__recieve_raw_data(zk._ZK__tcp_length - 8 - len(data))
+        yield data
+        return
+
+    size = unpack('I', zk._ZK__data[1:5])[0]
+    start = 0
+    try:
+        while start < size:
+            chunk_size = min(max_chunk, size - start)
+            yield zk._ZK__read_chunk(start, chunk_size)
+            start += chunk_size
+    finally:
+        # Giải phóng buffer trên thiết bị kể cả khi bên gọi dừng giữa chừng
+        zk.free_data()
+
+
+def iter_template_records(chunks: Iterable[bytes], uids: Optional[Set[int]] = None) -> Iterator[Finger]:
+    """
+    Tách template từ các đoạn của buffer template (4 byte tổng kích thước, sau đó
+    các bản ghi size, uid, ngón, valid, template), chỉ tạo Finger cho các uid cần lấy
+    """
+    buffer = bytearray()
+    total_size = None
+    for chunk in chunks:
+        buffer.extend(chunk)
+        offset = 0
+        if total_size is None:
+            if len(buffer) < 4:
+                continue
+            total_size = unpack('i', buffer[:4])[0]
+            offset = 4
+        while total_size > 0 and len(buffer) - offset >= 6:
+            size, uid, fid, valid = unpack('HHbb', buffer[offset:offset + 6])
+            if size < 6:
+                raise ZKErrorResponse(f"Bản ghi template không hợp lệ (size {size})")
+            if len(buffer) - offset < size:
+                break
+            if uids is None or uid in uids:
+                yield Finger(uid, fid, valid, bytes(buffer[offset + 6:offset + size]))
+            offset += size
+            total_size -= size
+        del buffer[:offset]
+
+
+def iter_templates(zk: ZK, uids: Optional[Set[int]] = None) -> Iterator[Finger]:
+    """
+    Duyệt template vân tay trên thiết bị, chỉ tạo Finger cho các uid cần lấy
+
+    Args:
+        zk: Kết nối thiết bị
+        uids: Tập uid cần lấy (None: tất cả)
+    """
+    zk.read_sizes()
+    if zk.fingers == 0:
+        return
+    yield from iter_template_records(iter_buffer_chunks(zk, const.CMD_DB_RRQ, const.FCT_FINGERTMP), uids)
+
+
+def iter_user_templates(zk: ZK, uids: Optional[Iterable[int]] = None) -> Iterator[Tuple[int, List[Finger]]]:
+    """
+    Gom template liên tiếp của cùng một uid, trả về (uid, danh sách Finger).
+    Thiết bị thường lưu template theo từng user; nếu một uid xuất hiện lại
+    ở đoạn sau thì sẽ được trả thêm một lần nữa.
+    """
+    uid_filter = {int(uid) for uid in uids} if uids is not None else None
+    current_uid = None
+    current: List[Finger] = []
+    for finger in iter_templates(zk, uid_filter):
+        if finger.uid != current_uid and current:
+            yield current_uid, current
+            current = []
+        current_uid = finger.uid
+        current.append(finger)
+    if current:
+        yield current_uid, current
+
+
+class _ReplyReader:
+    """
+    Đọc lần lượt gói phản hồi trên socket của kết nối pyzk: TCP tách theo khung
+    (8 byte đầu + độ dài, chỉ đọc đúng số byte của khung), UDP mỗi datagram một gói
+    """
+
+    def __init__(self, zk: ZK):
+        self.sock = zk._ZK__sock
+        self.tcp = zk.tcp
+
+    def _recv_exact(self, size: int) -> bytes:
+        chunks = []
+        while size > 0:
+            chunk = self.sock.recv(size)
+            if not chunk:
+                raise ZKNetworkError("Thiết bị đóng kết nối")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def next(self) -> Tuple[int, int, bytes]:
+        """Gói tiếp theo: (mã phản hồi, reply_id, dữ liệu)"""
+        if self.tcp:
+            magic1, magic2, length = unpack('<HHI', self._recv_exact(8))
+            if magic1 != const.MACHINE_PREPARE_DATA_1 or magic2 != const.MACHINE_PREPARE_DATA_2:
+                raise ZKNetworkError("TCP packet invalid")
+            packet = self._recv_exact(length)
+        else:
+            packet = self.sock.recv(65535)
+        if len(packet) < 8:
+            raise ZKNetworkError("Gói phản hồi không hợp lệ")
+        code, _, _, reply_id = unpack('<4H', packet[:8])
+        return code, reply_id, packet[8:]
+
+
+def _template_from_reply(uid: int, fid: int, data: bytes) -> Finger:
+    # Giống zk.get_user_template: bỏ byte cuối và 6 byte 0 đệm
+    template = data[:-1]
+    if template[-6:] == b'\x00' * 6:
+        template = template[:-6]
+    return Finger(uid, fid, 1, template)
+
+
+def fetch_templates_pipelined(zk: ZK, requests: List[Tuple[int, int]],
+                              window: int = 20) -> Dict[Tuple[int, int], Optional[Finger]]:
+    """
+    Lấy template nhiều ngón (lệnh 88) theo kiểu pipeline: gửi liền một cửa sổ lệnh
+    rồi mới đọc phản hồi, khớp theo reply_id, nên mỗi cửa sổ chỉ tốn khoảng một
+    vòng mạng thay vì một vòng cho mỗi ngón.
+
+    Returns:
+        (uid, ngón) -> Finger (có template) hoặc None (thiết bị trả lời không có template).
+        Lượt không nhận được phản hồi rõ ràng (UDP mất gói, hết thời gian chờ) không có
+        trong kết quả để bên gọi hỏi lại.
+    """
+    window = max(1, window)
+    reader = _ReplyReader(zk)
+    session_id = zk._ZK__session_id
+    results: Dict[Tuple[int, int], Optional[Finger]] = {}
+    for start in range(0, len(requests), window):
+        pending: Dict[int, Tuple[int, int]] = {}
+        reply_id = zk._ZK__reply_id
+        try:
+            for uid, fid in requests[start:start + window]:
+                buf = zk._ZK__create_header(CMD_GET_USER_TEMPLATE, pack('hb', uid, fid), session_id, reply_id)
+                reply_id = unpack('<4H', buf[:8])[3]
+                pending[reply_id] = (uid, fid)
+                if zk.tcp:
+                    zk._ZK__sock.send(zk._ZK__create_tcp_top(buf))
+                else:
+                    zk._ZK__sock.sendto(buf, zk._ZK__address)
+        finally:
+            # Các lệnh pyzk sau tiếp tục dãy reply_id
+            zk._ZK__reply_id = reply_id
+
+        prepared: Dict[int, bytearray] = {}
+        answered = 0
+        try:
+            while answered < len(pending):
+                code, rid, data = reader.next()
+                key = pending.get(rid)
+                if key is None or key in results:
+                    continue
+                if code == const.CMD_PREPARE_DATA:
+                    prepared[rid] = bytearray()
+                elif code == const.CMD_DATA and rid in prepared:
+                    prepared[rid].extend(data)
+                    continue
+                elif code == const.CMD_DATA:
+                    results[key] = _template_from_reply(key[0], key[1], data)
+                elif code == const.CMD_ACK_OK and rid in prepared:
+                    results[key] = _template_from_reply(key[0], key[1], bytes(prepared.pop(rid)))
+                elif code in (const.CMD_ACK_ERROR, const.CMD_ACK_OK):
+                    results[key] = None
+                else:
+                    continue
+                if code != const.CMD_PREPARE_DATA:
+                    answered += 1
+        except OSError as e:
+            if zk.tcp:
+                # Luồng TCP đã lệch so với các lệnh đã gửi, không dùng tiếp kết nối được
+                raise ZKNetworkError(str(e))
+            logger.debug(f"Hết thời gian chờ {len(pending) - answered} phản hồi template (UDP)")
+    return results
+
+
+def iter_user_fingers(zk: ZK, uids: Iterable[int], window: int = 20,
+                      attempts: int = 3) -> Iterator[Tuple[int, List[Finger], bool]]:
+    """
+    Lấy template từng user (dò đủ 10 ngón vì pyzk không đọc được danh sách ngón của
+    một user) trên một kết nối duy nhất. Các lệnh được gửi theo pipeline (xem
+    fetch_templates_pipelined); ngón chưa có phản hồi rõ ràng được hỏi lại tối đa attempts lần.
+
+    Returns:
+        Iterator (uid, danh sách Finger, complete). complete=False nếu còn ngón không nhận
+        được phản hồi rõ ràng: không được coi ngón đó là không tồn tại.
+    """
+    uids = [int(uid) for uid in uids]
+    # Mỗi nhóm user vừa một số cửa sổ lệnh, trả kết quả theo nhóm để bộ nhớ không tăng theo số user
+    group_size = max(1, window // 10) * 10
+    for start in range(0, len(uids), group_size):
+        group = uids[start:start + group_size]
+        remaining = [(uid, fid) for uid in group for fid in range(10)]
+        results: Dict[Tuple[int, int], Optional[Finger]] = {}
+        for _ in range(attempts):
+            results.update(fetch_templates_pipelined(zk, remaining, window))
+            remaining = [key for key in remaining if key not in results]
+            if not remaining:
+                break
+        missing = {uid for uid, _ in remaining}
+        for uid in group:
+            fingers = [results[(uid, fid)] for fid in range(10)
+                       if results.get((uid, fid)) is not None and results[(uid, fid)].template]
+            yield uid, fingers, uid not in missing
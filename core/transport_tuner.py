@@ -0,0 +1,201 @@
+# transport_tuner.py
+"""
+Module chọn giao thức TCP/UDP cho từng máy chấm công theo tốc độ đo được.
+Đo thời gian kết nối và tốc độ đọc buffer (danh sách user và một phần template)
+qua cả hai giao thức, lưu lựa chọn nhanh hơn theo serial thiết bị và đo lại
+định kỳ. Thiết bị có khóa "transport" ("tcp"/"udp") trong cấu hình được giữ nguyên.
+"""
+
+import json
+import os
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Any
+from zk import ZK, const
+from config import DATA_PATHS, TRANSPORT_TUNING_CONFIG
+from core.device_metadata import DeviceMetadataCache
+from core.template_stream import iter_buffer_chunks
+
+logger = logging.getLogger(__name__)
+
+
+class TransportTuner:
+    """Đo và lưu giao thức nhanh nhất của từng thiết bị"""
+
+    def __init__(self, device_sync, profiles_path: Optional[str] = None):
+        """
+        Args:
+            device_sync: AttendanceDeviceSync (dùng metadata cache và pool kết nối)
+            profiles_path: Đường dẫn file lưu kết quả đo
+        """
+        self.device_sync = device_sync
+        self.profiles_path = profiles_path or DATA_PATHS["transport_profiles"]
+        self.enabled = TRANSPORT_TUNING_CONFIG.get('enabled', True)
+        self.recheck_interval = TRANSPORT_TUNING_CONFIG.get('recheck_interval', 7 * 86400)
+        self.sample_bytes = TRANSPORT_TUNING_CONFIG.get('sample_bytes', 512 * 1024)
+        self.min_gain = TRANSPORT_TUNING_CONFIG.get('min_gain', 0.1)
+        self._lock = threading.Lock()
+        self._profiles = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            if os.path.exists(self.profiles_path):
+                with open(self.profiles_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Không thể tải kết quả đo giao thức: {str(e)}")
+        return {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.profiles_path) or ".", exist_ok=True)
+            with open(self.profiles_path, 'w', encoding='utf-8') as f:
+                json.dump(self._profiles, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            logger.error(f"❌ Lỗi lưu kết quả đo giao thức: {str(e)}")
+
+    @staticmethod
+    def is_pinned(device_config: Dict) -> bool:
+        """Thiết bị đã chỉ định giao thức cố định trong cấu hình"""
+        return str(device_config.get('transport', 'auto')).lower() in ('tcp', 'udp')
+
+    def get_profile(self, device_config: Dict) -> Optional[Dict[str, Any]]:
+        """Kết quả đo của thiết bị (tra serial từ metadata cache, chưa có thì theo địa chỉ)"""
+        serial = self.device_sync.metadata_cache.get_serial(device_config)
+        with self._lock:
+            if serial:
+                profile = self._profiles.get(serial)
+            else:
+                address = DeviceMetadataCache.make_key(device_config)
+                profile = next((p for p in self._profiles.values() if p.get('address') == address), None)
+        return dict(profile) if profile else None
+
+    def apply(self, device_config: Dict) -> Dict:
+        """Trả về cấu hình thiết bị với force_udp theo giao thức đã chọn"""
+        if self.is_pinned(device_config):
+            return dict(device_config, force_udp=str(device_config['transport']).lower() == 'udp')
+        if not self.enabled:
+            return device_config
+        profile = self.get_profile(device_config)
+        if not profile or profile.get('force_udp') is None:
+            return device_config
+        return dict(device_config, force_udp=profile['force_udp'])
+
+    def is_due(self, device_config: Dict) -> bool:
+        """Thiết bị chưa được đo hoặc kết quả đo đã cũ"""
+        if not self.enabled or self.is_pinned(device_config):
+            return False
+        profile = self.get_profile(device_config)
+        return not profile or time.time() - profile.get('checked_at', 0) > self.recheck_interval
+
+    def _measure(self, device_config: Dict, force_udp: bool) -> Optional[Dict[str, Any]]:
+        """Đo thời gian kết nối và tốc độ đọc buffer qua một giao thức"""
+        transport = 'udp' if force_udp else 'tcp'
+        device_ip = device_config.get('ip', device_config.get('ip_address', ''))
+        zk = ZK(
+            device_ip,
+            port=device_config.get('port', 4370),
+            timeout=device_config.get('timeout', 10),
+            password=device_config.get('password', 0),
+            force_udp=force_udp,
+            ommit_ping=device_config.get('ommit_ping', True)
+        )
+        conn = None
+        try:
+            started = time.perf_counter()
+            conn = zk.connect()
+            connect_seconds = time.perf_counter() - started
+            serial = conn.get_serialnumber()
+            conn.read_sizes()
+
+            nbytes = 0
+            started = time.perf_counter()
+            reads = [(const.CMD_USERTEMP_RRQ, const.FCT_USER)]
+            if conn.fingers:
+                reads.append((const.CMD_DB_RRQ, const.FCT_FINGERTMP))
+            for command, fct in reads:
+                chunks = iter_buffer_chunks(conn, command, fct)
+                try:
+                    for chunk in chunks:
+                        nbytes += len(chunk)
+                        if nbytes >= self.sample_bytes:
+                            break
+                finally:
+                    chunks.close()
+                if nbytes >= self.sample_bytes:
+                    break
+            read_seconds = time.perf_counter() - started
+
+            result = {
+                'serial': serial,
+                'connect': round(connect_seconds, 3),
+                'bytes': nbytes,
+                'seconds': round(read_seconds, 3),
+                'throughput': round(nbytes / read_seconds) if read_seconds > 0 else 0
+            }
+            logger.info(f"   📶 {transport.upper()}: kết nối {connect_seconds * 1000:.0f} ms, "
+                        f"đọc {nbytes / 1024:.0f} KB trong {read_seconds:.2f}s ({result['throughput'] / 1024:.0f} KB/s)")
+            return result
+        except Exception as e:
+            logger.warning(f"   ⚠️ {transport.upper()}: không đo được - {str(e)}")
+            return None
+        finally:
+            if conn:
+                try:
+                    conn.disconnect()
+                except Exception:
+                    pass
+
+    def calibrate(self, device_config: Dict) -> Optional[Dict[str, Any]]:
+        """
+        Đo cả TCP và UDP, lưu giao thức nhanh hơn theo serial thiết bị
+
+        Returns:
+            Kết quả đo (force_udp, tcp, udp, checked_at) hoặc None nếu không đo được
+        """
+        device_id = device_config.get('id', 1)
+        device_name = device_config.get('device_name', device_config.get('name', f"Device_{device_id}"))
+        logger.info(f"📶 Đang đo tốc độ TCP/UDP của {device_name}...")
+
+        # Đóng kết nối trong pool để phép đo không tranh socket với kết nối cũ
+        if not self.device_sync.pool.close(device_id):
+            return None
+        results = {'tcp': self._measure(device_config, False), 'udp': self._measure(device_config, True)}
+        measured = {name: result for name, result in results.items() if result}
+        if not measured:
+            logger.error(f"❌ Không đo được giao thức nào của {device_name}")
+            return None
+
+        serial = next(result['serial'] for result in measured.values())
+        # Giao thức đang dùng: theo lần đo trước nếu có, nếu không theo cấu hình
+        with self._lock:
+            previous = self._profiles.get(serial)
+        force_udp = previous['force_udp'] if previous else device_config.get('force_udp', True)
+        current = 'udp' if force_udp else 'tcp'
+        best = max(measured, key=lambda name: measured[name]['throughput'])
+        # Chỉ đổi giao thức khi nhanh hơn rõ rệt, tránh đổi qua lại do dao động đo
+        if best != current and current in measured:
+            if measured[best]['throughput'] < measured[current]['throughput'] * (1 + self.min_gain):
+                best = current
+
+        profile = {
+            'force_udp': best == 'udp',
+            'address': DeviceMetadataCache.make_key(device_config),
+            'tcp': results['tcp'],
+            'udp': results['udp'],
+            'checked_at': time.time()
+        }
+        with self._lock:
+            self._profiles[serial] = profile
+            self._save()
+        logger.info(f"✅ {device_name} ({serial}): dùng {best.upper()}")
+        return profile
+
+    def calibrate_due(self, devices: List[Dict]) -> int:
+        """Đo lại các thiết bị chưa có hoặc đã cũ kết quả đo, trả về số thiết bị đã đo"""
+        count = 0
+        for device in devices:
+            if device.get('enable', True) and self.is_due(device) and self.calibrate(device):
+                count += 1
+        return count
@@ -0,0 +1,249 @@
+# usb_provisioning.py
+"""
+Module tạo file nạp dữ liệu qua USB cho máy chấm công mới.
+Từ dữ liệu vân tay local, ghi file user (bản ghi 72 byte như bảng user của
+thiết bị) và file template fp10 (mỗi bản ghi: size, pin, ngón, valid, template)
+để nạp hàng loạt user từ USB thay vì đẩy qua mạng. Kèm bộ kiểm tra file và
+bước nạp thử vào máy giả lập rồi đọc lại qua pyzk để đối chiếu.
+"""
+
+import base64
+import logging
+import os
+from struct import pack, unpack
+from typing import Dict, List, Optional, Tuple, Any
+from zk import ZK, const
+from config import USB_PROVISIONING_CONFIG
+from core.data_manager import DataManager
+
+logger = logging.getLogger(__name__)
+
+USER_RECORD_FORMAT = '<HB8s24sIx7sx24s'
+USER_RECORD_SIZE = 72
+TEMPLATE_HEADER_FORMAT = '<HHbb'
+TEMPLATE_HEADER_SIZE = 6
+
+
+class UsbProvisioner:
+    """Tạo, kiểm tra và nạp thử file USB của máy chấm công"""
+
+    def __init__(self, device_sync):
+        """
+        Args:
+            device_sync: AttendanceDeviceSync (dùng quy tắc phân công, rút gọn tên, dung lượng đã cache)
+        """
+        self.device_sync = device_sync
+        self.user_file = USB_PROVISIONING_CONFIG.get('user_file', 'user.dat')
+        self.template_file = USB_PROVISIONING_CONFIG.get('template_file', 'template.fp10')
+        self.first_uid = USB_PROVISIONING_CONFIG.get('first_uid', 1)
+        self.max_template_size = USB_PROVISIONING_CONFIG.get('max_template_size', 2048)
+        self.encoding = USB_PROVISIONING_CONFIG.get('encoding', 'UTF-8')
+
+    def _encode(self, text: str, size: int) -> bytes:
+        """Mã hóa chuỗi, cắt theo số byte mà không làm vỡ ký tự nhiều byte"""
+        raw = str(text or '').encode(self.encoding, errors='ignore')
+        while len(raw) > size:
+            text = text[:-1]
+            raw = text.encode(self.encoding, errors='ignore')
+        return raw
+
+    def _employees(self, employees: Optional[List[Dict]], device_config: Optional[Dict]) -> List[Dict]:
+        if employees is None:
+            employees = [emp for emp in DataManager().load_local_fingerprints().values()
+                         if emp.get('fingerprints') and emp.get('attendance_device_id')]
+        if device_config:
+            employees = self.device_sync.assignment.filter_employees(device_config, employees)
+        return sorted(employees, key=lambda emp: (len(str(emp['attendance_device_id'])),
+                                                  str(emp['attendance_device_id'])))
+
+    def build(self, employees: Optional[List[Dict]] = None, device_config: Optional[Dict] = None) -> Dict[str, Any]:
+        """
+        Đóng gói nhân viên thành dữ liệu file user và template
+
+        Returns:
+            Dict gồm user_data, template_data (bytes), users, fingers,
+            skipped (mã nhân viên bị bỏ qua) và expected (attendance_device_id -> dữ liệu đã ghi)
+        """
+        user_records, template_records = [], []
+        expected, skipped = {}, []
+        uid = self.first_uid
+        for emp in self._employees(employees, device_config):
+            user_id = str(emp['attendance_device_id']).strip()
+            if user_id in expected or len(user_id.encode()) > 24:
+                logger.warning(f"⚠️ Bỏ qua {emp.get('employee')}: attendance_device_id {user_id} trùng hoặc quá dài")
+                skipped.append(emp.get('employee'))
+                continue
+
+            fingers = {}
+            for fp in emp.get('fingerprints', []):
+                if not isinstance(fp, dict) or not fp.get('template_data'):
+                    continue
+                try:
+                    template = base64.b64decode(fp['template_data'])
+                except Exception as e:
+                    logger.warning(f"⚠️ Template ngón {fp.get('finger_index')} của {emp.get('employee')} lỗi: {str(e)}")
+                    continue
+                fid = int(fp.get('finger_index', -1))
+                if 0 <= fid <= 9 and 0 < len(template) <= self.max_template_size:
+                    fingers[fid] = template
+            if not fingers:
+                skipped.append(emp.get('employee'))
+                continue
+
+            name = self.device_sync.shorted_name(emp.get('employee_name') or '', 24)
+            privilege = const.USER_ADMIN if emp.get('employee_name') == 'USER_ADMIN' else const.USER_DEFAULT
+            password = str(emp.get('password') or '')
+            user_records.append(pack(USER_RECORD_FORMAT, uid, privilege, self._encode(password, 8),
+                                     self._encode(name, 24), 0, b'', user_id.encode()))
+            for fid, template in sorted(fingers.items()):
+                template_records.append(pack(TEMPLATE_HEADER_FORMAT, len(template) + TEMPLATE_HEADER_SIZE, uid, fid, 1)
+                                        + template)
+            expected[user_id] = {
+                'uid': uid,
+                'name': self._encode(name, 24).decode(self.encoding, errors='ignore'),
+                'privilege': privilege,
+                'fingers': fingers
+            }
+            uid += 1
+
+        return {
+            'user_data': b''.join(user_records),
+            'template_data': b''.join(template_records),
+            'users': len(user_records),
+            'fingers': len(template_records),
+            'skipped': skipped,
+            'expected': expected
+        }
+
+    def export(self, output_dir: str, employees: Optional[List[Dict]] = None,
+               device_config: Optional[Dict] = None) -> Dict[str, Any]:
+        """
+        Ghi file user và template vào thư mục (thư mục gốc của USB)
+
+        Returns:
+            Kết quả build() kèm đường dẫn user_file, template_file
+        """
+        result = self.build(employees, device_config)
+        os.makedirs(output_dir, exist_ok=True)
+        result['user_file'] = os.path.join(output_dir, self.user_file)
+        result['template_file'] = os.path.join(output_dir, self.template_file)
+        with open(result['user_file'], 'wb') as f:
+            f.write(result['user_data'])
+        with open(result['template_file'], 'wb') as f:
+            f.write(result['template_data'])
+        logger.info(f"💾 Đã tạo file USB: {result['users']} users, {result['fingers']} vân tay "
+                    f"({len(result['template_data']) / 1024:.0f} KB) tại {output_dir}")
+        if result['skipped']:
+            logger.warning(f"⚠️ Bỏ qua {len(result['skipped'])} nhân viên (trùng mã chấm công hoặc không có vân tay hợp lệ)")
+        return result
+
+    def _read_files(self, directory: str) -> Tuple[bytes, bytes]:
+        with open(os.path.join(directory, self.user_file), 'rb') as f:
+            user_data = f.read()
+        with open(os.path.join(directory, self.template_file), 'rb') as f:
+            template_data = f.read()
+        return user_data, template_data
+
+    def validate(self, directory: str, device_config: Optional[Dict] = None) -> Dict[str, Any]:
+        """
+        Kiểm tra file USB: kích thước bản ghi, uid/user_id trùng, template thuộc user
+        có trong file, ngón 0-9 không trùng và dung lượng thiết bị (nếu có cấu hình)
+
+        Returns:
+            Dict gồm ok, users, fingers, errors
+        """
+        errors = []
+        try:
+            user_data, template_data = self._read_files(directory)
+        except OSError as e:
+            return {'ok': False, 'users': 0, 'fingers': 0, 'errors': [f"Không đọc được file: {str(e)}"]}
+
+        if len(user_data) % USER_RECORD_SIZE:
+            errors.append(f"{self.user_file}: {len(user_data)} byte không chia hết cho {USER_RECORD_SIZE}")
+        uids, user_ids = set(), set()
+        for offset in range(0, len(user_data) - len(user_data) % USER_RECORD_SIZE, USER_RECORD_SIZE):
+            uid, _, _, _, _, _, user_id = unpack(USER_RECORD_FORMAT, user_data[offset:offset + USER_RECORD_SIZE])
+            user_id = user_id.split(b'\x00')[0].decode(errors='ignore')
+            if uid == 0 or uid in uids:
+                errors.append(f"{self.user_file}: uid {uid} không hợp lệ hoặc trùng")
+            if not user_id or user_id in user_ids:
+                errors.append(f"{self.user_file}: user_id '{user_id}' (uid {uid}) rỗng hoặc trùng")
+            uids.add(uid)
+            user_ids.add(user_id)
+
+        fingers = set()
+        offset = 0
+        while offset < len(template_data):
+            if len(template_data) - offset < TEMPLATE_HEADER_SIZE:
+                errors.append(f"{self.template_file}: dư {len(template_data) - offset} byte cuối file")
+                break
+            size, uid, fid, _ = unpack(TEMPLATE_HEADER_FORMAT, template_data[offset:offset + TEMPLATE_HEADER_SIZE])
+            if size <= TEMPLATE_HEADER_SIZE or offset + size > len(template_data):
+                errors.append(f"{self.template_file}: bản ghi tại byte {offset} có kích thước {size} không hợp lệ")
+                break
+            if size - TEMPLATE_HEADER_SIZE > self.max_template_size:
+                errors.append(f"{self.template_file}: template uid {uid} ngón {fid} dài {size - TEMPLATE_HEADER_SIZE} byte")
+            if uid not in uids:
+                errors.append(f"{self.template_file}: template của uid {uid} không có trong {self.user_file}")
+            if not 0 <= fid <= 9 or (uid, fid) in fingers:
+                errors.append(f"{self.template_file}: uid {uid} ngón {fid} không hợp lệ hoặc trùng")
+            fingers.add((uid, fid))
+            offset += size
+
+        if device_config:
+            capabilities = self.device_sync.get_device_capabilities(device_config)
+            if capabilities.get('users_cap') and len(uids) > capabilities['users_cap']:
+                errors.append(f"Vượt dung lượng user: {len(uids)}/{capabilities['users_cap']}")
+            if capabilities.get('fingers_cap') and len(fingers) > capabilities['fingers_cap']:
+                errors.append(f"Vượt dung lượng vân tay: {len(fingers)}/{capabilities['fingers_cap']}")
+
+        return {'ok': not errors, 'users': len(uids), 'fingers': len(fingers), 'errors': errors}
+
+    def verify_round_trip(self, directory: str, expected: Dict[str, Dict]) -> Dict[str, Any]:
+        """
+        Nạp file vào máy giả lập như nạp từ USB, đọc lại qua pyzk và đối chiếu với
+        dữ liệu đã đóng gói (expected của build()/export())
+
+        Returns:
+            Dict gồm ok, users, fingers, mismatches
+        """
+        from utils.zk_emulator import ZKDeviceEmulator
+
+        user_data, template_data = self._read_files(directory)
+        fingers_total = sum(len(item['fingers']) for item in expected.values())
+        emulator = ZKDeviceEmulator(port=0, users_cap=max(len(expected), 1), fingers_cap=max(fingers_total, 1))
+        emulator.import_usb(user_data, template_data)
+        emulator.start()
+        conn = None
+        mismatches = []
+        try:
+            conn = ZK(emulator.host, port=emulator.port, timeout=10, force_udp=False, ommit_ping=True).connect()
+            users = {user.uid: user for user in conn.get_users()}
+            templates = {}
+            for finger in conn.get_templates():
+                templates.setdefault(finger.uid, {})[finger.fid] = finger.template
+
+            read_back = {str(user.user_id): user for user in users.values()}
+            for user_id, item in expected.items():
+                user = read_back.get(user_id)
+                if not user:
+                    mismatches.append(f"Thiếu user {user_id}")
+                    continue
+                if user.uid != item['uid'] or user.name != item['name'] or user.privilege != item['privilege']:
+                    mismatches.append(f"User {user_id}: uid/tên/quyền khác sau khi nạp")
+                if templates.get(user.uid, {}) != item['fingers']:
+                    mismatches.append(f"User {user_id}: template khác sau khi nạp")
+            for user_id in set(read_back) - set(expected):
+                mismatches.append(f"User {user_id} không có trong dữ liệu gốc")
+            result = {'ok': not mismatches, 'users': len(users),
+                      'fingers': sum(len(item) for item in templates.values()), 'mismatches': mismatches}
+        finally:
+            if conn:
+                conn.disconnect()
+            emulator.stop()
+
+        if result['ok']:
+            logger.info(f"✅ Nạp thử file USB khớp dữ liệu gốc: {result['users']} users, {result['fingers']} vân tay")
+        else:
+            logger.error(f"❌ Nạp thử file USB có {len(mismatches)} sai lệch")
+        return result
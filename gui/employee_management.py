@@ -8,7 +8,10 @@ from tkinter import ttk, messagebox
 import logging
 from typing import Dict, List, Optional
 from config import FINGER_MAPPING
+from core.fingerprint_pull import FingerprintPuller
+from core.progress import progress_bus, format_progress, ITEM_DONE, BYTES
 import threading
+import time
 import json
 
 logger = logging.getLogger(__name__)
@@ -19,7 +22,9 @@ class EmployeeTab:
     def __init__(self, parent, main_app):
         self.parent = parent
         self.main_app = main_app
+        self._last_progress_update = 0.0
         self.create_widgets()
+        progress_bus.subscribe(self.on_progress_event)
     
     def create_widgets(self):
         """Tạo các widget cho tab nhân viên với layout cân đối"""
@@ -217,6 +222,11 @@ class EmployeeTab:
                                     width=250)
         self.sync_btn.pack(pady=(5, 10))
         
+        # Tiến độ tác vụ đang chạy (đồng bộ, tải vân tay, đẩy chấm công)
+        self.progress_label = ctk.CTkLabel(sync_frame, text="", font=ctk.CTkFont(size=11),
+                                           wraplength=280, justify="left")
+        self.progress_label.pack(padx=10, pady=(0, 5))
+        
         # Device selection với enhanced status display
         device_selection_frame = ctk.CTkScrollableFrame(sync_frame, height=120)
         device_selection_frame.pack(fill="x", padx=10, pady=5)
@@ -240,6 +250,19 @@ class EmployeeTab:
         self.device_checkboxes = {}
         self.update_device_sync_section() 
     
+    def on_progress_event(self, event):
+        """Hiển thị tiến độ, giới hạn tần suất cập nhật giao diện"""
+        now = time.time()
+        if event.kind in (ITEM_DONE, BYTES) and now - self._last_progress_update < 0.3:
+            return
+        self._last_progress_update = now
+        text = format_progress(event)
+        try:
+            if self.main_app.root and self.main_app.root.winfo_exists():
+                self.main_app.root.after(0, lambda: self.progress_label.configure(text=text))
+        except Exception:
+            pass
+    
     def update_device_sync_section(self):
         """Cập nhật section đồng bộ với device status chi tiết"""
         # Clear existing checkboxes
@@ -428,14 +451,6 @@ class EmployeeTab:
         logger.addHandler(handler)
     def load_fingerprints_from_device(self):
         """Tải vân tay từ máy chấm công với tối ưu tốc độ - Strategy hybrid"""
-        import os
-        import base64
-        import json
-        import threading
-        import concurrent.futures
-        from tkinter import messagebox
-        from config import FINGER_MAPPING
-        
         if not self.main_app.attendance_devices:
             messagebox.showwarning("Cảnh báo", "Chưa tải danh sách máy chấm công!")
             return
@@ -450,56 +465,41 @@ class EmployeeTab:
         
         def load_thread():
             try:
-                # 1. Load danh sách employees từ employees.json để lọc
-                employees_to_load, attendance_device_mapping = self._prepare_employee_mapping()
+                puller = FingerprintPuller(self.main_app.device_sync, self.main_app.data_manager)
+                stats = puller.pull(self.main_app.attendance_devices)
                 
-                if not employees_to_load:
+                if stats is None:
                     self.main_app.root.after(0, lambda: [
                         self.load_from_device_btn.configure(text="📥 Tải vân tay từ MCC", state="normal"),
                         messagebox.showinfo("Thông báo", "Không có nhân viên nào có attendance_device_id hợp lệ để load!")
                     ])
                     return
                 
-                # 2. Load dữ liệu từ từng thiết bị với strategy tối ưu
-                device_sync = self.main_app.device_sync
-                fingerprints_from_device = {}
-                total_loaded = 0
+                # Load lại dữ liệu vân tay trong ứng dụng
+                self.main_app.current_fingerprints = self.main_app.data_manager.load_local_fingerprints()
                 
-                for device in self.main_app.attendance_devices:
-                    device_name = device.get('device_name', device.get('name', f"Device_{device.get('id', 1)}"))
-                    logger.info(f"🔄 Đang kết nối với {device_name}...")
-                    
-                    # Kết nối thiết bị
-                    zk = device_sync.connect_device(device)
-                    if not zk:
-                        logger.error(f"❌ Không thể kết nối đến {device_name}")
-                        continue
-                    
-                    try:
-                        # Lấy users và map với attendance_device_id
-                        device_users = zk.get_users()
-                        target_users = [user for user in device_users if user.user_id in attendance_device_mapping]
-                        
-                        logger.info(f"🎯 Sẽ load vân tay cho {len(target_users)} users từ {device_name}")
-                        
-                        # Load fingerprints với strategy tối ưu
-                        device_fingerprints = self._load_fingerprints_optimized(
-                            zk, target_users, attendance_device_mapping, device_name
-                        )
-                        
-                        # Merge dữ liệu
-                        fingerprints_from_device.update(device_fingerprints)
-                        total_loaded += len([fp for fp in device_fingerprints.values() if fp.get('fingerprints')])
-                        
-                    except Exception as device_err:
-                        logger.error(f"❌ Lỗi khi load dữ liệu từ {device_name}: {str(device_err)}")
-                    finally:
-                        # Ngắt kết nối
-                        device_id = device.get('id', 1)
-                        device_sync.disconnect_device(device_id)
+                device_lines = "".join(
+                    f"• {device['device_name']}: "
+                    + (f"lỗi ({device['error']})" if device['error'] else
+                       f"{device['templates']} vân tay trong {device['seconds']:.1f}s")
+                    + "\n"
+                    for device in stats['devices']
+                )
+                success_msg = (
+                    f"🚀 Load dữ liệu vân tay thành công!\n\n"
+                    f"📊 Kết quả chi tiết:\n"
+                    f"• Nhân viên cần load: {stats['total_employees']}\n"
+                    f"• Nhân viên có vân tay: {stats['total_loaded']}\n"
+                    f"• Tổng sau khi merge: {stats['merged_count']}\n\n"
+                    f"🖥️ Theo máy chấm công:\n{device_lines}"
+                )
                 
-                # 3. Lưu và merge dữ liệu
-                self._save_and_merge_fingerprints(fingerprints_from_device, len(employees_to_load), total_loaded)
+                self.main_app.root.after(0, lambda: [
+                    self.load_from_device_btn.configure(text="📥 Tải vân tay từ MCC", state="normal"),
+                    self.update_finger_button_colors(),
+                    self.update_employee_list(),
+                    messagebox.showinfo("Thành công", success_msg)
+                ])
                 
             except Exception as e:
                 logger.error(f"❌ Lỗi tải vân tay từ máy chấm công: {str(e)}")
@@ -511,274 +511,6 @@ class EmployeeTab:
         # Run in thread
         threading.Thread(target=load_thread, daemon=True).start()
 
-    def _prepare_employee_mapping(self):
-        """Chuẩn bị mapping employees và attendance_device_id"""
-        import os
-        import json
-        
-        employees_to_load = []
-        attendance_device_mapping = {}
-        
-        try:
-            if os.path.exists("data/employees.json"):
-                with open("data/employees.json", 'r', encoding='utf-8') as f:
-                    all_employees = json.load(f)
-                
-                # Lọc nhân viên có attendance_device_id hợp lệ
-                for emp in all_employees:
-                    attendance_id = emp.get('attendance_device_id')
-                    if attendance_id and str(attendance_id).strip() and attendance_id != "0":
-                        try:
-                            attendance_id_int = int(attendance_id)
-                            if attendance_id_int > 0:
-                                employees_to_load.append(emp)
-                                attendance_device_mapping[attendance_id] = emp
-                        except ValueError:
-                            continue
-                
-                logger.info(f"📋 Sẽ load vân tay cho {len(employees_to_load)} nhân viên có attendance_device_id hợp lệ")
-            else:
-                logger.warning("⚠️ Không tìm thấy file employees.json")
-                
-        except Exception as e:
-            logger.error(f"❌ Lỗi đọc file employees.json: {str(e)}")
-            raise e
-        
-        return employees_to_load, attendance_device_mapping
-
-    def _load_fingerprints_optimized(self, zk, target_users, attendance_device_mapping, device_name):
-        """Load fingerprints với strategy tối ưu - Hybrid approach"""
-        import base64
-        from config import FINGER_MAPPING
-        
-        fingerprints_result = {}
-        
-        try:
-            # === STRATEGY 1: Bulk load toàn bộ templates ===
-            logger.info(f"🚀 [{device_name}] Thử load toàn bộ templates (Strategy 1)...")
-            
-            # Load toàn bộ templates một lần
-            all_templates = zk.get_templates()
-            logger.info(f"✅ [{device_name}] Đã load {len(all_templates)} templates")
-            
-            # Group templates theo user_id
-            templates_by_user = {}
-            for template in all_templates:
-                uid = template.uid
-                if uid not in templates_by_user:
-                    templates_by_user[uid] = []
-                templates_by_user[uid].append(template)
-            
-            logger.info(f"📊 [{device_name}] Grouped templates cho {len(templates_by_user)} users")
-            
-            # Process chỉ target users
-            processed_count = 0
-            for user in target_users:
-                uid = int(user.uid)
-                user_id = user.user_id
-                employee_info = attendance_device_mapping[user_id]
-                
-                if uid in templates_by_user:
-                    fingerprint_count = self._process_user_templates(
-                        templates_by_user[uid], employee_info, fingerprints_result
-                    )
-                    
-                    if fingerprint_count > 0:
-                        processed_count += 1
-                        logger.info(f"   ✅ [{processed_count}/{len(target_users)}] {employee_info['employee']} - {fingerprint_count} vân tay")
-                    else:
-                        logger.warning(f"   ⚠️ [{processed_count + 1}/{len(target_users)}] {employee_info['employee']} - Không có vân tay")
-                else:
-                    logger.warning(f"   ❌ User {user_id} (UID: {uid}) không có templates")
-            
-            logger.info(f"✅ [{device_name}] Strategy 1 thành công - Processed {processed_count} users")
-            return fingerprints_result
-            
-        except Exception as bulk_error:
-            logger.warning(f"⚠️ [{device_name}] Strategy 1 failed: {str(bulk_error)}")
-            
-            # === STRATEGY 2: Fallback to individual loading ===
-            logger.info(f"🔄 [{device_name}] Fallback to Strategy 2 (individual loading)...")
-            
-            try:
-                return self._load_fingerprints_individual(zk, target_users, attendance_device_mapping, device_name)
-            except Exception as fallback_error:
-                logger.error(f"❌ [{device_name}] Strategy 2 cũng failed: {str(fallback_error)}")
-                return {}
-
-    def _process_user_templates(self, templates, employee_info, fingerprints_result):
-        """Process templates của 1 user"""
-        import base64
-        from config import FINGER_MAPPING
-        
-        employee_id = employee_info['employee']
-        
-        # Khởi tạo cấu trúc dữ liệu cho nhân viên
-        if employee_id not in fingerprints_result:
-            fingerprints_result[employee_id] = {
-                'name': employee_info.get('name', ''),
-                'employee': employee_id,
-                'employee_name': employee_info['employee_name'],
-                'attendance_device_id': employee_info.get('attendance_device_id', ''),
-                'password': '',  # Sẽ được set từ user data
-                'privilege': 0,  # Sẽ được set từ user data
-                'fingerprints': []
-            }
-        
-        fingerprint_count = 0
-        
-        # Process từng template
-        for template in templates:
-            try:
-                if hasattr(template, 'template') and template.template:
-                    finger_idx = template.fid  # finger ID
-                    
-                    # Validate finger index
-                    if 0 <= finger_idx <= 9:
-                        # Convert template to base64
-                        template_b64 = base64.b64encode(template.template).decode('utf-8')
-                        
-                        # Get finger name
-                        finger_name = FINGER_MAPPING.get(finger_idx, f"Ngón {finger_idx}")
-                        
-                        # Add to fingerprints
-                        fingerprints_result[employee_id]['fingerprints'].append({
-                            'finger_index': finger_idx,
-                            'finger_name': finger_name,
-                            'template_data': template_b64,
-                            'quality_score': 70
-                        })
-                        
-                        fingerprint_count += 1
-                    
-            except Exception as template_error:
-                logger.warning(f"   ⚠️ Lỗi xử lý template finger {template.fid}: {str(template_error)}")
-                continue
-        
-        return fingerprint_count
-
-    def _load_fingerprints_individual(self, zk, target_users, attendance_device_mapping, device_name):
-        """Fallback strategy: Load individual với threading có giới hạn"""
-        import concurrent.futures
-        import base64
-        from config import FINGER_MAPPING
-        
-        fingerprints_result = {}
-        
-        def safe_get_template(uid, finger_idx):
-            """Wrapper an toàn cho get_user_template"""
-            try:
-                return zk.get_user_template(uid, finger_idx)
-            except Exception as e:
-                logger.debug(f"   Template UID {uid} finger {finger_idx} failed: {str(e)}")
-                return None
-        
-        # Process từng user với limited threading
-        for i, user in enumerate(target_users, 1):
-            uid = int(user.uid)
-            user_id = user.user_id
-            employee_info = attendance_device_mapping[user_id]
-            
-            logger.info(f"   👤 [{i}/{len(target_users)}] Loading {employee_info['employee']} (UID: {uid})")
-            
-            # Khởi tạo data structure
-            employee_id = employee_info['employee']
-            if employee_id not in fingerprints_result:
-                fingerprints_result[employee_id] = {
-                    'name': employee_info.get('name', ''),
-                    'employee': employee_id,
-                    'employee_name': employee_info['employee_name'],
-                    'attendance_device_id': str(user_id),
-                    'password': user.password or '',
-                    'privilege': user.privilege or 0,
-                    'fingerprints': []
-                }
-            
-            # Load 10 fingers với threading
-            fingerprint_count = 0
-            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-                future_to_finger = {
-                    executor.submit(safe_get_template, uid, finger_idx): finger_idx 
-                    for finger_idx in range(10)
-                }
-                
-                for future in concurrent.futures.as_completed(future_to_finger, timeout=30):
-                    finger_idx = future_to_finger[future]
-                    try:
-                        template = future.result(timeout=5)
-                        
-                        if template and hasattr(template, 'template') and template.template:
-                            # Convert template to base64
-                            template_b64 = base64.b64encode(template.template).decode('utf-8')
-                            finger_name = FINGER_MAPPING.get(finger_idx, f"Ngón {finger_idx}")
-                            
-                            fingerprints_result[employee_id]['fingerprints'].append({
-                                'finger_index': finger_idx,
-                                'finger_name': finger_name,
-                                'template_data': template_b64,
-                                'quality_score': 70
-                            })
-                            
-                            fingerprint_count += 1
-                            
-                    except Exception as finger_error:
-                        logger.debug(f"   Finger {finger_idx} processing failed: {str(finger_error)}")
-                        continue
-            
-            if fingerprint_count > 0:
-                logger.info(f"   ✅ Loaded {fingerprint_count} fingerprints for {employee_id}")
-            else:
-                logger.warning(f"   ⚠️ No fingerprints found for {employee_id}")
-        
-        return fingerprints_result
-
-    def _save_and_merge_fingerprints(self, fingerprints_from_device, total_employees, total_loaded):
-        """Lưu và merge dữ liệu fingerprints"""
-        import os
-        import json
-        
-        try:
-            os.makedirs("data", exist_ok=True)
-            
-            # Convert dict to list để lưu file
-            fingerprints_list = list(fingerprints_from_device.values())
-            
-            with open("data/all_fingerprints_from_machine.json", 'w', encoding='utf-8') as f:
-                json.dump(fingerprints_list, f, ensure_ascii=False, indent=4)
-            
-            logger.info(f"✅ Đã lưu {len(fingerprints_list)} nhân viên vào all_fingerprints_from_machine.json")
-            
-            # Merge dữ liệu với employees.json vào all_fingerprints.json
-            merged_count = self.merge_fingerprints_data(fingerprints_from_device)
-            
-            # Load lại dữ liệu vân tay trong ứng dụng
-            self.main_app.current_fingerprints = self.main_app.data_manager.load_local_fingerprints()
-            
-            # Update UI
-            success_msg = (
-                f"🚀 Load dữ liệu vân tay thành công!\n\n"
-                f"📊 Kết quả chi tiết:\n"
-                f"• Nhân viên cần load: {total_employees}\n"
-                f"• Nhân viên có vân tay: {total_loaded}\n"
-                f"• Tổng sau khi merge: {merged_count}\n\n"
-                f"✅ Đã sử dụng strategy tối ưu bulk-load!"
-            )
-            
-            self.main_app.root.after(0, lambda: [
-                self.load_from_device_btn.configure(text="📥 Tải vân tay từ MCC", state="normal"),
-                self.update_finger_button_colors(),
-                self.update_employee_list(),
-                messagebox.showinfo("Thành công", success_msg)
-            ])
-            
-        except Exception as save_err:
-            logger.error(f"❌ Lỗi lưu/merge dữ liệu: {str(save_err)}")
-            self.main_app.root.after(0, lambda: [
-                self.load_from_device_btn.configure(text="📥 Tải vân tay từ MCC", state="normal"),
-                messagebox.showerror("Lỗi", f"Lỗi lưu/merge dữ liệu: {str(save_err)}")
-            ])
-
-
     def manual_connect_scanner(self):
         """Kết nối scanner thủ công"""
         if self.main_app.scanner_connected:
@@ -1099,101 +831,5 @@ class EmployeeTab:
         Returns:
             int: Số lượng nhân viên sau khi merge
         """
-        try:
-            import os
-            import json
-            
-            # Load employees data
-            employees = []
-            if os.path.exists("data/employees.json"):
-                with open("data/employees.json", 'r', encoding='utf-8') as f:
-                    employees = json.load(f)
-                logger.info(f"✅ Đã load {len(employees)} nhân viên từ employees.json")
-            else:
-                logger.warning("⚠️ Không tìm thấy file employees.json")
-            
-            # Create dictionary of employees by ID for quick lookup
-            employees_dict = {emp.get('employee'): emp for emp in employees}
-            employees_by_device_id = {emp.get('attendance_device_id'): emp for emp in employees 
-                                    if emp.get('attendance_device_id')}
-            
-            # Load existing fingerprints data (if any)
-            current_fingerprints = []
-            if os.path.exists("data/all_fingerprints.json"):
-                with open("data/all_fingerprints.json", 'r', encoding='utf-8') as f:
-                    current_fingerprints = json.load(f)
-                logger.info(f"✅ Đã load {len(current_fingerprints)} nhân viên từ all_fingerprints.json")
-            
-            # Create dictionary of current fingerprints by employee ID
-            current_fingerprints_dict = {fp.get('employee'): fp for fp in current_fingerprints}
-            
-            # Process and merge data
-            merged_fingerprints = {}
-            
-            # First, add all current fingerprints to the merged data
-            for fp in current_fingerprints:
-                employee_id = fp.get('employee')
-                if employee_id:
-                    merged_fingerprints[employee_id] = fp
-            
-            # Next, process fingerprints from machine and merge
-            for employee_id, fp_machine in fingerprints_from_machine.items():
-                device_id = fp_machine.get('attendance_device_id')
-                
-                # Skip if no employee ID or device ID
-                if not employee_id or not device_id:
-                    continue
-                
-                # If employee exists in our records
-                if employee_id in employees_dict:
-                    emp_data = employees_dict[employee_id]
-                    
-                    # If we already have fingerprint data for this employee
-                    if employee_id in merged_fingerprints:
-                        # Get existing fingerprint data
-                        existing_fp = merged_fingerprints[employee_id]
-                        
-                        # Update the consistent fields
-                        existing_fp['attendance_device_id'] = device_id
-                        existing_fp['name'] = emp_data.get('name', '')
-                        existing_fp['employee_name'] = emp_data.get('employee_name', '')
-                        
-                        # Merge fingerprints arrays - replace with new data from machine
-                        existing_fp['fingerprints'] = fp_machine.get('fingerprints', [])
-                        
-                        # Update password and privilege if they exist in the machine data
-                        if 'password' in fp_machine:
-                            existing_fp['password'] = fp_machine['password']
-                        if 'privilege' in fp_machine:
-                            existing_fp['privilege'] = fp_machine['privilege']
-                        
-                        logger.info(f"🔄 Updated existing fingerprint data for {employee_id}")
-                        
-                    else:
-                        # Create new entry using machine data but ensure consistent fields
-                        new_fp = fp_machine.copy()
-                        new_fp['employee'] = employee_id
-                        new_fp['name'] = emp_data.get('name', '')
-                        new_fp['employee_name'] = emp_data.get('employee_name', '')
-                        new_fp['attendance_device_id'] = device_id
-                        
-                        merged_fingerprints[employee_id] = new_fp
-                        logger.info(f"➕ Added new fingerprint data for {employee_id}")
-                else:
-                    # Employee not in our records - just add the machine data as is
-                    merged_fingerprints[employee_id] = fp_machine
-                    logger.warning(f"⚠️ Employee {employee_id} not found in employees.json, added anyway")
-            
-            # Convert dictionary back to list for saving
-            merged_fingerprints_list = list(merged_fingerprints.values())
-            
-            # Save the merged data
-            with open("data/all_fingerprints.json", 'w', encoding='utf-8') as f:
-                json.dump(merged_fingerprints_list, f, ensure_ascii=False, indent=4)
-            
-            logger.info(f"✅ Đã merge và lưu {len(merged_fingerprints_list)} nhân viên vào all_fingerprints.json")
-            return len(merged_fingerprints_list)
-            
-        except Exception as e:
-            logger.error(f"❌ Lỗi merge dữ liệu: {str(e)}")
-            raise e
+        puller = FingerprintPuller(self.main_app.device_sync, self.main_app.data_manager)
+        return puller.merge_fingerprints_data(fingerprints_from_machine)
@@ -17,12 +17,18 @@ from typing import List, Dict, Optional
 from PIL import Image, ImageTk
 
 # Import các module của dự án
-from config import UI_CONFIG, LOG_CONFIG, FINGER_MAPPING, APP_INFO
+from config import (UI_CONFIG, LOG_CONFIG, FINGER_MAPPING, APP_INFO, SCHEDULER_CONFIG, LIVE_CAPTURE_CONFIG, SYNC_CONFIG,
+                    ENROLLMENT_PIPELINE_CONFIG)
 from utils.logger import setup_logger
 from core.erpnext_api import ERPNextAPI
 from core.fingerprint_scanner import FingerprintScanner
 from core.attendance_device_sync import AttendanceDeviceSync
 from core.data_manager import DataManager
+from core.device_monitor import DeviceHealthMonitor
+from core.sync_scheduler import SyncScheduler
+from core.priority_sync import PRIORITY_ENROLLMENT, PRIORITY_CHANGED
+from core.enrollment_pipeline import EnrollmentPipeline, format_status
+from core.punch_stream import LivePunchStreamer
 from gui.employee_management import EmployeeTab
 from gui.dialogs import AttendanceIDDialog
 
@@ -55,6 +61,22 @@ class FingerprintApp:
         self.erpnext_api = ERPNextAPI()
         self.scanner = FingerprintScanner()
         self.device_sync = AttendanceDeviceSync(self.erpnext_api)
+        self.health_monitor = DeviceHealthMonitor(on_status_change=self.on_device_status_change)
+        self.sync_scheduler = SyncScheduler(
+            self.device_sync,
+            devices_provider=lambda: list(self.attendance_devices),
+            employees_provider=lambda: list(self.current_fingerprints.values())
+        )
+        self.punch_streamer = LivePunchStreamer(
+            self.device_sync,
+            devices_provider=lambda: list(self.attendance_devices)
+        )
+        self.enrollment_pipeline = None
+        if ENROLLMENT_PIPELINE_CONFIG.get('write_through', False):
+            self.enrollment_pipeline = EnrollmentPipeline(
+                self.sync_scheduler, self.data_manager, self.erpnext_api,
+                on_status=self.on_enrollment_status
+            )
         
         # Khởi tạo dữ liệu
         self.employees = []
@@ -75,6 +97,14 @@ class FingerprintApp:
         # Tạo giao diện
         self.create_ui()
         
+        # Bật lịch đồng bộ tự động đến máy chấm công
+        if SCHEDULER_CONFIG.get("enabled", False):
+            self.sync_scheduler.start()
+        
+        # Nhận chấm công realtime và đẩy lên ERPNext
+        if LIVE_CAPTURE_CONFIG.get("enabled", False):
+            self.punch_streamer.start()
+        
         # Set fullscreen
         self.root.after(100, self.set_fullscreen)
         
@@ -192,38 +222,25 @@ class FingerprintApp:
         return True
     
     def check_device_connections(self):
-        """Kiểm tra kết nối đến các máy chấm công"""
-        import socket
-        
-        self.device_status = {}
+        """Kiểm tra đồng thời kết nối đến các máy chấm công và bật giám sát nền"""
+        try:
+            self.device_status = self.health_monitor.check_all(self.attendance_devices)
+        except Exception as e:
+            logger.error(f"❌ Lỗi kiểm tra kết nối máy chấm công: {str(e)}")
+            self.device_status = {device.get('id'): "error" for device in self.attendance_devices}
         
-        for device in self.attendance_devices:
-            device_id = device.get('id')
-            ip = device.get('ip', device.get('ip_address', ''))
-            port = device.get('port', 4370)
-            device_name = device.get('device_name', device.get('name', f'Device_{device_id}'))
-            
-            try:
-                # Tạo socket với timeout ngắn
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(1)  # Giảm timeout xuống 1 giây
-                
-                # Thử kết nối
-                result = sock.connect_ex((ip, port))
-                sock.close()
-                
-                if result == 0:
-                    self.device_status[device_id] = "connected"
-                    logger.info(f"✅ {device_name} ({ip}) - Kết nối thành công")
-                else:
-                    self.device_status[device_id] = "disconnected"
-                    logger.warning(f"❌ {device_name} ({ip}) - Mất kết nối")
-            except Exception as e:
-                self.device_status[device_id] = "error"
-                logger.error(f"❌ {device_name} ({ip}) - Lỗi kết nối: {str(e)}")
-            
-            # Cập nhật UI sau mỗi thiết bị
-            self.root.after(0, lambda: self.employee_tab.update_device_sync_section())
+        # Giám sát liên tục theo sync_interval của từng thiết bị
+        self.health_monitor.start(lambda: self.attendance_devices)
+    
+    def on_device_status_change(self, device_id, status, health):
+        """Cập nhật UI khi trạng thái một máy chấm công thay đổi"""
+        if self.device_status.get(device_id) == status:
+            return
+        self.device_status[device_id] = status
+        self.root.after(0, lambda: [
+            self.employee_tab.update_device_sync_section(),
+            self.update_ui_state()
+        ])
     
     def connect_scanner(self) -> bool:
         """Kết nối máy quét vân tay"""
@@ -270,13 +287,7 @@ class FingerprintApp:
     
     def save_employees_to_local(self):
         """Lưu danh sách nhân viên vào file local"""
-        try:
-            os.makedirs("data", exist_ok=True)
-            with open("data/employees.json", 'w', encoding='utf-8') as f:
-                json.dump(self.employees, f, ensure_ascii=False, indent=4)
-            logger.info(f"✅ Đã lưu {len(self.employees)} nhân viên vào file local")
-        except Exception as e:
-            logger.error(f"❌ Lỗi lưu danh sách nhân viên local: {str(e)}")
+        self.data_manager.save_employees_to_local(self.employees)
     
     def update_ui_state(self):
         """Cập nhật trạng thái giao diện"""
@@ -318,6 +329,7 @@ class FingerprintApp:
                     
                     # Lưu vào dữ liệu hiện tại
                     employee_id = self.selected_employee['employee']
+                    enrolled = bool(self.current_fingerprints.get(employee_id, {}).get('fingerprints'))
                     
                     if employee_id not in self.current_fingerprints:
                         self.current_fingerprints[employee_id] = {
@@ -351,6 +363,15 @@ class FingerprintApp:
                     ])
                     
                     logger.info(f"✅ Đã quét thành công vân tay {finger_name} cho {employee_id}")
+                    
+                    # Ghi xuyên: lưu local, ERPNext và máy chấm công chỉ cho nhân viên này
+                    if self.enrollment_pipeline:
+                        self.enrollment_pipeline.submit(self.current_fingerprints[employee_id],
+                                                        self.selected_finger_index)
+                    # Đẩy ngay lên các máy chấm công được phân công, trước lô đồng bộ
+                    elif SYNC_CONFIG.get('priority_push', True):
+                        self.sync_scheduler.prioritize(self.current_fingerprints[employee_id],
+                                                       PRIORITY_CHANGED if enrolled else PRIORITY_ENROLLMENT)
                 else:
                     self.root.after(0, lambda: messagebox.showerror("Lỗi", "Quét vân tay thất bại!"))
                     
@@ -361,6 +382,15 @@ class FingerprintApp:
         # Chạy trong thread riêng
         threading.Thread(target=scan_thread, daemon=True).start()
     
+    def on_enrollment_status(self, status):
+        """Hiển thị trạng thái ghi xuyên của ngón vừa quét"""
+        text = format_status(status)
+        try:
+            if self.root and self.root.winfo_exists() and hasattr(self.employee_tab, 'progress_label'):
+                self.root.after(0, lambda: self.employee_tab.progress_label.configure(text=text))
+        except Exception:
+            pass
+    
     def save_fingerprints(self):
         """Lưu dữ liệu vân tay"""
         try:
@@ -478,12 +508,12 @@ class FingerprintApp:
                     device_name = device.get('device_name', device.get('name', 'Unknown'))
                     logger.info(f"🔄 Đồng bộ đến thiết bị: {device_name}")
                     success, total = self.device_sync.sync_to_device(device, employees_to_sync)
-                    results[device_name] = (success, total)
+                    results[device_name] = (success, total, self.device_sync.capacity_note(device))
                 
                 # Log kết quả
                 result_text = "Kết quả đồng bộ:\n"
-                for device_name, (success, total) in results.items():
-                    result_text += f"• {device_name}: {success}/{total} nhân viên\n"
+                for device_name, (success, total, note) in results.items():
+                    result_text += f"• {device_name}: {success}/{total} nhân viên{note}\n"
                 logger.info(result_text)
                 
             except Exception as e:
@@ -523,6 +553,11 @@ class FingerprintApp:
                 if self.scanner_connected:
                     self.scanner.disconnect()
                 
+                self.health_monitor.stop()
+                self.sync_scheduler.stop()
+                self.punch_streamer.stop()
+                if self.enrollment_pipeline:
+                    self.enrollment_pipeline.shutdown()
                 self.device_sync.disconnect_all_devices()
                 
                 logger.info("👋 Đã đóng ứng dụng")
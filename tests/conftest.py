@@ -0,0 +1,17 @@
+# conftest.py
+"""Cấu hình chung cho pytest: import module của repo, chạy trong thư mục tạm"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Chạy test trong thư mục tạm để các file data/ không ghi vào repo"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    return tmp_path
@@ -0,0 +1,69 @@
+# test_usb_provisioning.py
+"""Tạo file USB từ dữ liệu vân tay local, kiểm tra file và nạp thử vào máy giả lập"""
+
+import base64
+import json
+from struct import pack, unpack
+
+import pytest
+
+from core.attendance_device_sync import AttendanceDeviceSync
+from core.usb_provisioning import UsbProvisioner, USER_RECORD_FORMAT, USER_RECORD_SIZE
+
+
+@pytest.fixture
+def provisioner(workdir):
+    employees = [{
+        'employee': f"HR-EMP-{index:05d}",
+        'employee_name': f"Nguyễn Văn {index}",
+        'attendance_device_id': str(index),
+        'password': '',
+        'fingerprints': [{'finger_index': finger,
+                          'template_data': base64.b64encode(bytes([index, finger]) * (200 + index)).decode()}
+                         for finger in ((0, 6) if index % 2 else (1,))]
+    } for index in range(1, 13)]
+    with open("data/all_fingerprints.json", 'w', encoding='utf-8') as f:
+        json.dump(employees, f, ensure_ascii=False)
+    device_sync = AttendanceDeviceSync(None)
+    yield UsbProvisioner(device_sync)
+    device_sync.disconnect_all_devices()
+
+
+def test_export_validate_round_trip(provisioner, workdir):
+    output = str(workdir / "usb")
+    result = provisioner.export(output)
+    assert (result['users'], result['fingers'], result['skipped']) == (12, 18, [])
+
+    validation = provisioner.validate(output)
+    assert validation['ok'], validation['errors']
+    assert (validation['users'], validation['fingers']) == (12, 18)
+
+    round_trip = provisioner.verify_round_trip(output, result['expected'])
+    assert round_trip['ok'], round_trip['mismatches']
+    assert (round_trip['users'], round_trip['fingers']) == (12, 18)
+
+
+def test_validate_rejects_duplicate_uid(provisioner, workdir):
+    output = workdir / "usb"
+    provisioner.export(str(output))
+    user_file = output / provisioner.user_file
+    user_data = bytearray(user_file.read_bytes())
+    # Bản ghi thứ hai dùng lại uid của bản ghi đầu
+    first_uid = unpack(USER_RECORD_FORMAT, bytes(user_data[:USER_RECORD_SIZE]))[0]
+    user_data[USER_RECORD_SIZE:USER_RECORD_SIZE + 2] = pack('<H', first_uid)
+    user_file.write_bytes(bytes(user_data))
+
+    validation = provisioner.validate(str(output))
+    assert not validation['ok']
+    assert any(f"uid {first_uid} không hợp lệ hoặc trùng" in error for error in validation['errors'])
+
+
+def test_validate_rejects_truncated_template(provisioner, workdir):
+    output = workdir / "usb"
+    provisioner.export(str(output))
+    template_file = output / provisioner.template_file
+    template_file.write_bytes(template_file.read_bytes()[:-10])
+
+    validation = provisioner.validate(str(output))
+    assert not validation['ok']
+    assert any("không hợp lệ" in error and provisioner.template_file in error for error in validation['errors'])
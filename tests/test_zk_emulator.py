@@ -0,0 +1,78 @@
+# test_zk_emulator.py
+"""Đồng bộ và tải vân tay qua pyzk với máy chấm công giả lập (TCP và UDP)"""
+
+import base64
+
+import pytest
+
+from utils.zk_emulator import ZKDeviceEmulator
+from core.attendance_device_sync import AttendanceDeviceSync
+from core.fingerprint_pull import FingerprintPuller
+from core.data_manager import DataManager
+
+
+def make_employee(index: int, fingers=(0, 5)) -> dict:
+    return {
+        'employee': f"HR-EMP-{index:05d}",
+        'employee_name': f"Nhân viên {index}",
+        'attendance_device_id': str(index),
+        'password': '',
+        'fingerprints': [{'finger_index': finger,
+                          'template_data': base64.b64encode(bytes([index % 251, finger]) * 300).decode()}
+                         for finger in fingers]
+    }
+
+
+@pytest.fixture
+def emulator():
+    device = ZKDeviceEmulator(port=0, serial="EMU-TEST").start()
+    yield device
+    device.stop()
+
+
+@pytest.fixture
+def device_sync(workdir):
+    sync = AttendanceDeviceSync(None)
+    yield sync
+    sync.disconnect_all_devices()
+
+
+@pytest.mark.parametrize("force_udp", [False, True], ids=["tcp", "udp"])
+def test_sync_then_pull_round_trip(emulator, device_sync, force_udp):
+    device = emulator.device_config(1, force_udp=force_udp)
+    employees = [make_employee(index) for index in range(1, 41)]
+
+    assert device_sync.sync_all_to_device(device, employees) == (40, 40)
+    assert len(emulator.users) == 40
+    assert len(emulator.templates) == 80
+
+    mapping = {emp['attendance_device_id']: emp for emp in employees}
+    pulled, loaded = FingerprintPuller(device_sync, DataManager()).pull_from_devices([device], mapping)
+    with pulled:
+        assert loaded == 40
+        for emp in employees:
+            fingers = {fp['finger_index']: fp['template_data'] for fp in pulled[emp['employee']]['fingerprints']}
+            assert fingers == {fp['finger_index']: fp['template_data'] for fp in emp['fingerprints']}
+
+
+@pytest.mark.parametrize("force_udp", [False, True], ids=["tcp", "udp"])
+def test_populated_device_users_and_templates(emulator, device_sync, force_udp):
+    emulator.populate(users=3000, fingers_per_user=1, template_size=64, records=200)
+    device = emulator.device_config(2, force_udp=force_udp)
+
+    zk = device_sync.connect_device(device)
+    assert zk is not None
+    try:
+        assert device_sync.pool.get_device_info(2).get('serial') == "EMU-TEST"
+        users = zk.get_users()
+        templates = zk.get_templates()
+        attendances = zk.get_attendance()
+    finally:
+        device_sync.disconnect_device(2)
+
+    assert len(users) == 3000
+    assert len(templates) == 3000
+    assert len(attendances) == 200
+    uid = users[-1].uid
+    template = next(t for t in templates if t.uid == uid)
+    assert template.template == emulator.templates[(uid, 0)]
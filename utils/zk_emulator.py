@@ -0,0 +1,608 @@
+# zk_emulator.py
+"""
+Giả lập máy chấm công ZKTeco chạy local để đo tải đường đồng bộ.
+Hỗ trợ phần giao thức ZK mà pyzk dùng (TCP và UDP): kết nối, vô hiệu hóa/bật
+thiết bị, đọc/ghi user, template vân tay, đọc theo buffer (1503/1504), log chấm
+công và sự kiện realtime. Có thể cấu hình độ trễ, tỉ lệ mất gói và dung lượng.
+
+Ví dụ:
+    python -m utils.zk_emulator --users 3000 --fingers-per-user 2 --records 20000 --latency-ms 5
+"""
+
+import argparse
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime
+from struct import pack, unpack
+from typing import Dict, List, Optional, Tuple
+from zk import const
+from zk.base import make_commkey
+
+logger = logging.getLogger(__name__)
+
+# Lệnh không có trong zk.const nhưng pyzk sử dụng
+CMD_READ_BUFFER = 1503
+CMD_READ_CHUNK = 1504
+CMD_GET_USER_TEMPLATE = 88
+CMD_SAVE_USERTEMPS = 110
+CMD_DELETE_TEMPLATE_BY_PIN = 134
+
+TCP_MAX_CHUNK = 0xFFC0
+UDP_DATA_SIZE = 1024
+
+
+def _checksum(packet: bytes) -> int:
+    """Checksum gói tin ZK (giống zkemsdk.c)"""
+    checksum = 0
+    length = len(packet)
+    index = 0
+    while length > 1:
+        checksum += packet[index] | (packet[index + 1] << 8)
+        if checksum > const.USHRT_MAX:
+            checksum -= const.USHRT_MAX
+        index += 2
+        length -= 2
+    if length:
+        checksum += packet[-1]
+    while checksum > const.USHRT_MAX:
+        checksum -= const.USHRT_MAX
+    checksum = ~checksum
+    while checksum < 0:
+        checksum += const.USHRT_MAX
+    return checksum
+
+
+def _encode_time(t: datetime) -> int:
+    """Mã hóa thời gian theo định dạng của máy chấm công"""
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+
+class _Session:
+    """Phiên kết nối của một client tới máy giả lập"""
+
+    def __init__(self, session_id: int, tcp: bool, send):
+        self.session_id = session_id
+        self.tcp = tcp
+        self.send = send
+        self.authenticated = False
+        self.write_buffer = bytearray()
+        self.read_buffer = b''
+        self.event_flags = 0
+        self.lock = threading.Lock()
+
+
+class ZKDeviceEmulator:
+    """Máy chấm công giả lập phục vụ cả TCP và UDP trên cùng một cổng"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 4370, serial: str = 'EMU0000001',
+                 device_name: str = 'F21lite-EMU', platform: str = 'ZLM60_TFT', firmware: str = 'Ver 6.60 Emulator',
+                 fp_version: int = 10, password: int = 0, users_cap: int = 3000, fingers_cap: int = 3000,
+                 rec_cap: int = 100000, latency_ms: float = 0, loss: float = 0, bandwidth: Optional[int] = None):
+        """
+        Args:
+            host, port: Địa chỉ lắng nghe
+            serial, device_name, platform, firmware, fp_version: Thông tin định danh trả về cho client
+            password: Mật khẩu kết nối (0: không yêu cầu)
+            users_cap, fingers_cap, rec_cap: Dung lượng thiết bị
+            latency_ms: Độ trễ trước mỗi phản hồi
+            loss: Tỉ lệ mất gói (UDP: bỏ phản hồi; TCP: trễ thêm như truyền lại)
+            bandwidth: Giới hạn băng thông (byte/giây), None là không giới hạn
+        """
+        self.host = host
+        self.port = port
+        self.serial = serial
+        self.device_name = device_name
+        self.platform = platform
+        self.firmware = firmware
+        self.fp_version = fp_version
+        self.password = password
+        self.users_cap = users_cap
+        self.fingers_cap = fingers_cap
+        self.rec_cap = rec_cap
+        self.latency = latency_ms / 1000.0
+        self.loss = loss
+        self.bandwidth = bandwidth
+
+        # Dữ liệu thiết bị
+        self.users: Dict[int, Dict] = {}
+        self.templates: Dict[Tuple[int, int], bytes] = {}
+        self.attendance: List[Tuple[int, str, datetime, int, int]] = []
+        self.enabled = True
+        self.stats = {'commands': 0, 'bytes_out': 0, 'dropped': 0}
+
+        self._lock = threading.RLock()
+        self._sessions: Dict[object, _Session] = {}
+        self._stop = threading.Event()
+        self._tcp_sock: Optional[socket.socket] = None
+        self._udp_sock: Optional[socket.socket] = None
+        self._threads: List[threading.Thread] = []
+
+    # Dữ liệu giả lập
+
+    def populate(self, users: int, fingers_per_user: int = 2, records: int = 0,
+                 template_size: int = 512, first_user_id: int = 1):
+        """Tạo dữ liệu tổng hợp: users, template và log chấm công"""
+        rng = random.Random(users * 31 + fingers_per_user)
+        with self._lock:
+            for index in range(users):
+                uid = len(self.users) + 1
+                user_id = str(first_user_id + index)
+                self.users[uid] = {
+                    'uid': uid, 'user_id': user_id, 'name': f"NV {user_id}",
+                    'privilege': const.USER_DEFAULT, 'password': '', 'group_id': '1', 'card': 0
+                }
+                for fid in range(fingers_per_user):
+                    self.templates[(uid, fid)] = bytes(rng.getrandbits(8) for _ in range(template_size))
+            uids = list(self.users)
+            start = time.time() - records * 60
+            for index in range(records):
+                uid = rng.choice(uids)
+                ts = datetime.fromtimestamp(int(start + index * 60))
+                self.attendance.append((uid, self.users[uid]['user_id'], ts, 1, index % 2))
+
+    def import_usb(self, user_data: bytes, template_data: bytes) -> Tuple[int, int]:
+        """
+        Nạp file user.dat (bản ghi 72 byte) và template fp10 (size, pin, ngón, valid, template)
+        như khi thiết bị nhập dữ liệu từ USB. User trùng uid được ghi đè.
+
+        Returns:
+            (số user, số template đã nạp)
+        """
+        users = templates = 0
+        with self._lock:
+            for offset in range(0, len(user_data) - len(user_data) % 72, 72):
+                uid, privilege, password, name, card, group_id, user_id = unpack(
+                    '<HB8s24sIx7sx24s', user_data[offset:offset + 72])
+                if self._set_user(uid, privilege, self._cstr(password), self._cstr(name), card,
+                                  self._cstr(group_id), self._cstr(user_id)):
+                    users += 1
+            offset = 0
+            while offset + 6 <= len(template_data):
+                size, uid, fid, valid = unpack('<HHbb', template_data[offset:offset + 6])
+                if size <= 6:
+                    break
+                if uid in self.users and ((uid, fid) in self.templates or len(self.templates) < self.fingers_cap):
+                    self.templates[(uid, fid)] = template_data[offset + 6:offset + size]
+                    templates += 1
+                offset += size
+        return users, templates
+
+    def punch(self, user_id: str, timestamp: Optional[datetime] = None, punch: int = 0):
+        """Giả lập một lượt chấm công, gửi sự kiện cho các phiên đang live capture"""
+        timestamp = (timestamp or datetime.now()).replace(microsecond=0)
+        with self._lock:
+            uid = next((u['uid'] for u in self.users.values() if u['user_id'] == str(user_id)), 0)
+            self.attendance.append((uid, str(user_id), timestamp, 1, punch))
+            sessions = [s for s in self._sessions.values() if s.event_flags & const.EF_ATTLOG]
+        timehex = pack('6B', timestamp.year - 2000, timestamp.month, timestamp.day,
+                       timestamp.hour, timestamp.minute, timestamp.second)
+        data = pack('<24sBB6s4s', str(user_id).encode(), 1, punch, timehex, b'\x00' * 4)
+        for session in sessions:
+            try:
+                self._send(session, const.CMD_REG_EVENT, data, 0)
+            except OSError:
+                pass
+
+    # Đóng gói dữ liệu trả về
+
+    def _users_buffer(self) -> bytes:
+        records = b''.join(
+            pack('<HB8s24sIx7sx24s', u['uid'], u['privilege'], u['password'].encode(), u['name'].encode(),
+                 int(u['card']), str(u['group_id']).encode(), u['user_id'].encode())
+            for u in sorted(self.users.values(), key=lambda u: u['uid'])
+        )
+        return pack('I', len(records)) + records
+
+    def _templates_buffer(self) -> bytes:
+        records = b''.join(
+            pack('HHbb%is' % len(template), len(template) + 6, uid, fid, 1, template)
+            for (uid, fid), template in sorted(self.templates.items())
+        )
+        return pack('i', len(records)) + records
+
+    def _attendance_buffer(self) -> bytes:
+        records = b''.join(
+            pack('<H24sB4sB8s', uid, user_id.encode(), status, pack('<I', _encode_time(ts)), punch, b'\x00' * 8)
+            for uid, user_id, ts, status, punch in self.attendance
+        )
+        return pack('I', len(records)) + records
+
+    def _sizes(self) -> bytes:
+        fields = [0] * 20
+        fields[4] = len(self.users)
+        fields[6] = len(self.templates)
+        fields[8] = len(self.attendance)
+        fields[14] = self.fingers_cap
+        fields[15] = self.users_cap
+        fields[16] = self.rec_cap
+        fields[17] = self.fingers_cap - len(self.templates)
+        fields[18] = self.users_cap - len(self.users)
+        fields[19] = self.rec_cap - len(self.attendance)
+        return pack('20i', *fields) + pack('3i', 0, 0, 0)
+
+    def _set_user(self, uid: int, privilege: int, password: str, name: str, card: int,
+                  group_id: str, user_id: str) -> bool:
+        if uid not in self.users and len(self.users) >= self.users_cap:
+            return False
+        self.users[uid] = {
+            'uid': uid, 'user_id': user_id, 'name': name, 'privilege': privilege,
+            'password': password, 'group_id': group_id, 'card': card
+        }
+        return True
+
+    @staticmethod
+    def _cstr(raw: bytes) -> str:
+        return raw.split(b'\x00')[0].decode(errors='ignore')
+
+    def _parse_user(self, raw: bytes) -> Optional[Tuple]:
+        """Đọc user từ gói CMD_USER_WRQ (28/72 byte) hoặc phần user của gói lưu template (29/73 byte)"""
+        if len(raw) in (29, 73) and raw[0] == 2:
+            raw = raw[1:]
+            if len(raw) == 72:
+                uid, privilege, password, name, card, _, group_id, user_id = unpack('<HB8s24sIB7sx24s', raw)
+                return uid, privilege, self._cstr(password), self._cstr(name), card, self._cstr(group_id), self._cstr(user_id)
+            uid, privilege, password, name, card, group_id, _, user_id = unpack('<HB5s8sIxBhI', raw)
+            return uid, privilege, self._cstr(password), self._cstr(name), card, str(group_id), str(user_id)
+        if len(raw) >= 72:
+            uid, privilege, password, name, card, group_id, user_id = unpack('<HB8s24s4sx7sx24s', raw[:72])
+            return (uid, privilege, self._cstr(password), self._cstr(name), unpack('<I', card)[0],
+                    self._cstr(group_id), self._cstr(user_id))
+        if len(raw) >= 28:
+            uid, privilege, password, name, card, group_id, _, user_id = unpack('HB5s8sIxBHI', raw[:28])
+            return uid, privilege, self._cstr(password), self._cstr(name), card, str(group_id), str(user_id)
+        return None
+
+    def _save_user_templates(self, buffer: bytes) -> bool:
+        """Xử lý gói lưu user kèm template (lệnh 110 sau khi gửi buffer), một hoặc nhiều user"""
+        user_len, table_len, fpack_len = unpack('III', buffer[:12])
+        upack = buffer[12:12 + user_len]
+        record_size = 73 if user_len % 73 == 0 else 29
+        for offset in range(0, user_len, record_size):
+            user = self._parse_user(upack[offset:offset + record_size])
+            if not user or not self._set_user(*user):
+                return False
+        table = buffer[12 + user_len:12 + user_len + table_len]
+        fpack = buffer[12 + user_len + table_len:12 + user_len + table_len + fpack_len]
+        for offset in range(0, len(table), 8):
+            _, uid, fnum, tstart = unpack('<bHbI', table[offset:offset + 8])
+            fid = fnum - 0x10
+            size = unpack('H', fpack[tstart:tstart + 2])[0]
+            template = fpack[tstart + 2:tstart + 2 + size]
+            if template:
+                if (uid, fid) not in self.templates and len(self.templates) >= self.fingers_cap:
+                    return False
+                self.templates[(uid, fid)] = template
+            else:
+                self.templates.pop((uid, fid), None)
+        return True
+
+    def _delete_user(self, uid: int) -> bool:
+        if self.users.pop(uid, None) is None:
+            return False
+        for key in [key for key in self.templates if key[0] == uid]:
+            del self.templates[key]
+        return True
+
+    # Xử lý lệnh
+
+    def _data_replies(self, session: _Session, payload: bytes) -> List[Tuple[int, bytes]]:
+        """Trả dữ liệu: TCP một gói CMD_DATA, UDP chia gói nếu vượt 1024 byte"""
+        if session.tcp or len(payload) <= UDP_DATA_SIZE:
+            return [(const.CMD_DATA, payload)]
+        replies = [(const.CMD_PREPARE_DATA, pack('I', len(payload)))]
+        for start in range(0, len(payload), UDP_DATA_SIZE):
+            replies.append((const.CMD_DATA, payload[start:start + UDP_DATA_SIZE]))
+        replies.append((const.CMD_ACK_OK, b''))
+        return replies
+
+    def _option(self, key: str) -> str:
+        options = {
+            '~SerialNumber': self.serial,
+            '~Platform': self.platform,
+            '~DeviceName': self.device_name,
+            '~ZKFPVersion': str(self.fp_version),
+            'MAC': '00:17:61:00:00:01',
+            '~ExtendFmt': '0',
+            '~UserExtFmt': '0',
+            'FaceFunOn': '0',
+            'CompatOldFirmware': '0',
+            'IPAddress': self.host,
+        }
+        return options.get(key, '')
+
+    def handle_command(self, session: _Session, command: int, data: bytes) -> List[Tuple[int, bytes]]:
+        """Xử lý một lệnh, trả về danh sách (mã phản hồi, dữ liệu)"""
+        ok = [(const.CMD_ACK_OK, b'')]
+        error = [(const.CMD_ACK_ERROR, b'')]
+
+        if command == const.CMD_CONNECT:
+            if self.password:
+                return [(const.CMD_ACK_UNAUTH, b'')]
+            session.authenticated = True
+            return ok
+        if command == const.CMD_AUTH:
+            if data == make_commkey(self.password, session.session_id):
+                session.authenticated = True
+                return ok
+            return [(const.CMD_ACK_UNAUTH, b'')]
+        if not session.authenticated:
+            return [(const.CMD_ACK_UNAUTH, b'')]
+
+        with self._lock:
+            if command == const.CMD_EXIT:
+                return ok
+            if command == const.CMD_ENABLEDEVICE:
+                self.enabled = True
+                return ok
+            if command == const.CMD_DISABLEDEVICE:
+                self.enabled = False
+                return ok
+            if command == const.CMD_GET_VERSION:
+                return [(const.CMD_ACK_OK, self.firmware.encode() + b'\x00')]
+            if command == const.CMD_OPTIONS_RRQ:
+                key = self._cstr(data)
+                return [(const.CMD_ACK_OK, f"{key}={self._option(key)}".encode() + b'\x00')]
+            if command == const.CMD_GET_FREE_SIZES:
+                return [(const.CMD_ACK_OK, self._sizes())]
+            if command == const.CMD_GET_TIME:
+                return [(const.CMD_ACK_OK, pack('<I', _encode_time(datetime.now())))]
+            if command == const.CMD_USER_WRQ:
+                user = self._parse_user(data)
+                return ok if user and self._set_user(*user) else error
+            if command == const.CMD_DELETE_USER:
+                self._delete_user(unpack('h', data[:2])[0])
+                return ok
+            if command == const.CMD_DELETE_USERTEMP:
+                uid, fid = unpack('hb', data[:3])
+                return ok if self.templates.pop((uid, fid), None) is not None else error
+            if command == CMD_DELETE_TEMPLATE_BY_PIN:
+                user_id, fid = unpack('<24sB', data[:25])
+                user_id = self._cstr(user_id)
+                uid = next((u['uid'] for u in self.users.values() if u['user_id'] == user_id), None)
+                return ok if uid and self.templates.pop((uid, fid), None) is not None else error
+            if command == CMD_GET_USER_TEMPLATE:
+                uid, fid = unpack('hb', data[:3])
+                template = self.templates.get((uid, fid))
+                if template is None:
+                    return error
+                return self._data_replies(session, template + b'\x00')
+            if command == const.CMD_PREPARE_DATA:
+                session.write_buffer = bytearray()
+                return ok
+            if command == const.CMD_DATA:
+                session.write_buffer.extend(data)
+                return ok
+            if command == CMD_SAVE_USERTEMPS:
+                saved = self._save_user_templates(bytes(session.write_buffer))
+                session.write_buffer = bytearray()
+                return ok if saved else error
+            if command == CMD_READ_BUFFER:
+                _, rrq, fct, _ = unpack('<bhii', data[:11])
+                if rrq == const.CMD_USERTEMP_RRQ and fct == const.FCT_USER:
+                    session.read_buffer = self._users_buffer()
+                elif rrq == const.CMD_DB_RRQ and fct == const.FCT_FINGERTMP:
+                    session.read_buffer = self._templates_buffer()
+                elif rrq == const.CMD_ATTLOG_RRQ:
+                    session.read_buffer = self._attendance_buffer()
+                else:
+                    return [(const.CMD_ACK_UNKNOWN, b'')]
+                return [(const.CMD_ACK_OK, pack('<BI', 0, len(session.read_buffer)) + b'\x00' * 4)]
+            if command == CMD_READ_CHUNK:
+                start, size = unpack('<ii', data[:8])
+                return self._data_replies(session, session.read_buffer[start:start + size])
+            if command == const.CMD_FREE_DATA:
+                session.read_buffer = b''
+                session.write_buffer = bytearray()
+                return ok
+            if command == const.CMD_CLEAR_DATA:
+                self.users.clear()
+                self.templates.clear()
+                self.attendance.clear()
+                return ok
+            if command == const.CMD_CLEAR_ATTLOG:
+                self.attendance.clear()
+                return ok
+            if command == const.CMD_REG_EVENT:
+                session.event_flags = unpack('I', data[:4])[0] if len(data) >= 4 else 0
+                return ok
+            if command in (const.CMD_REFRESHDATA, const.CMD_CANCELCAPTURE, const.CMD_STARTVERIFY,
+                           const.CMD_SET_TIME, const.CMD_OPTIONS_WRQ, const.CMD_ACK_ERROR, const.CMD_ACK_UNKNOWN):
+                return ok
+        return [(const.CMD_ACK_UNKNOWN, b'')]
+
+    # Mạng
+
+    def _send(self, session: _Session, code: int, data: bytes, reply_id: int):
+        header = pack('<4H', code, 0, session.session_id, reply_id)
+        packet = pack('<4H', code, _checksum(header + data), session.session_id, reply_id) + data
+        if session.tcp:
+            packet = pack('<HHI', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, len(packet)) + packet
+        if self.bandwidth:
+            time.sleep(len(packet) / float(self.bandwidth))
+        with session.lock:
+            session.send(packet)
+        self.stats['bytes_out'] += len(packet)
+
+    def _process(self, session: _Session, packet: bytes) -> bool:
+        """Xử lý một gói từ client, trả về False nếu client ngắt kết nối"""
+        if len(packet) < 8:
+            return True
+        command, _, _, reply_id = unpack('<4H', packet[:8])
+        if command == const.CMD_ACK_OK:
+            # Client xác nhận đã nhận sự kiện realtime, không phản hồi
+            return True
+        self.stats['commands'] += 1
+        replies = self.handle_command(session, command, packet[8:])
+        if self.latency:
+            time.sleep(self.latency)
+        if self.loss and random.random() < self.loss:
+            self.stats['dropped'] += 1
+            if not session.tcp:
+                return True
+            # TCP không mất gói, chỉ chậm như khi truyền lại
+            time.sleep(max(self.latency * 3, 0.2))
+        for code, data in replies:
+            self._send(session, code, data, reply_id)
+        return command != const.CMD_EXIT
+
+    def _new_session_id(self) -> int:
+        return random.randint(1, const.USHRT_MAX - 2)
+
+    def _serve_tcp_client(self, conn: socket.socket):
+        session = _Session(self._new_session_id(), True, conn.sendall)
+        with self._lock:
+            self._sessions[conn] = session
+        try:
+            while not self._stop.is_set():
+                top = self._recv_exact(conn, 8)
+                if not top:
+                    break
+                magic1, magic2, length = unpack('<HHI', top)
+                if magic1 != const.MACHINE_PREPARE_DATA_1 or magic2 != const.MACHINE_PREPARE_DATA_2:
+                    break
+                packet = self._recv_exact(conn, length)
+                if packet is None or not self._process(session, packet):
+                    break
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._sessions.pop(conn, None)
+            conn.close()
+
+    @staticmethod
+    def _recv_exact(conn: socket.socket, size: int) -> Optional[bytes]:
+        chunks = []
+        while size > 0:
+            chunk = conn.recv(size)
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def _tcp_loop(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._tcp_sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve_tcp_client, args=(conn,), daemon=True).start()
+
+    def _udp_loop(self):
+        while not self._stop.is_set():
+            try:
+                packet, addr = self._udp_sock.recvfrom(65535)
+            except OSError:
+                break
+            with self._lock:
+                session = self._sessions.get(addr)
+                if session is None or (len(packet) >= 2 and unpack('<H', packet[:2])[0] == const.CMD_CONNECT):
+                    session = _Session(self._new_session_id(), False,
+                                       lambda data, addr=addr: self._udp_sock.sendto(data, addr))
+                    self._sessions[addr] = session
+            try:
+                if not self._process(session, packet):
+                    with self._lock:
+                        self._sessions.pop(addr, None)
+            except Exception as e:
+                logger.debug(f"Lỗi xử lý gói UDP từ {addr}: {str(e)}")
+
+    def start(self) -> 'ZKDeviceEmulator':
+        """Bắt đầu lắng nghe TCP và UDP"""
+        self._stop.clear()
+        self._tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._tcp_sock.bind((self.host, self.port))
+        self._tcp_sock.listen(16)
+        self.port = self._tcp_sock.getsockname()[1]
+        self._udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp_sock.bind((self.host, self.port))
+        for target in (self._tcp_loop, self._udp_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"🧪 Máy chấm công giả lập {self.serial} đang chạy tại {self.host}:{self.port} "
+                    f"({len(self.users)} users, {len(self.templates)} vân tay, {len(self.attendance)} bản ghi)")
+        return self
+
+    def stop(self):
+        """Dừng máy giả lập"""
+        self._stop.set()
+        for sock in (self._tcp_sock, self._udp_sock):
+            if sock:
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+        with self._lock:
+            sessions = list(self._sessions.keys())
+        for key in sessions:
+            if isinstance(key, socket.socket):
+                try:
+                    key.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def device_config(self, device_id: int = 1, force_udp: bool = True) -> Dict:
+        """Cấu hình thiết bị dùng cho AttendanceDeviceSync trỏ tới máy giả lập"""
+        return {
+            'id': device_id,
+            'device_name': f"{self.device_name} #{device_id}",
+            'ip': self.host,
+            'port': self.port,
+            'password': self.password,
+            'timeout': 10,
+            'force_udp': force_udp,
+            'ommit_ping': True,
+            'enable': True
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Máy chấm công ZKTeco giả lập")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4370)
+    parser.add_argument('--serial', default='EMU0000001')
+    parser.add_argument('--users', type=int, default=3000)
+    parser.add_argument('--fingers-per-user', type=int, default=2)
+    parser.add_argument('--template-size', type=int, default=512)
+    parser.add_argument('--records', type=int, default=0)
+    parser.add_argument('--users-cap', type=int, default=3000)
+    parser.add_argument('--fingers-cap', type=int, default=6000)
+    parser.add_argument('--rec-cap', type=int, default=100000)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--loss', type=float, default=0)
+    parser.add_argument('--bandwidth', type=int, default=None, help="byte/giây")
+    parser.add_argument('--punch-interval', type=float, default=0,
+                        help="Tự sinh một lượt chấm công ngẫu nhiên mỗi N giây (0: tắt)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    emulator = ZKDeviceEmulator(
+        host=args.host, port=args.port, serial=args.serial,
+        users_cap=max(args.users_cap, args.users), fingers_cap=max(args.fingers_cap, args.users * args.fingers_per_user),
+        rec_cap=max(args.rec_cap, args.records), latency_ms=args.latency_ms, loss=args.loss, bandwidth=args.bandwidth
+    )
+    emulator.populate(args.users, args.fingers_per_user, args.records, args.template_size)
+    emulator.start()
+    try:
+        while True:
+            time.sleep(args.punch_interval or 1)
+            if args.punch_interval and emulator.users:
+                user = random.choice(list(emulator.users.values()))
+                emulator.punch(user['user_id'])
+    except KeyboardInterrupt:
+        emulator.stop()
+        print(f"Thống kê: {emulator.stats}")
+
+
+if __name__ == "__main__":
+    main()